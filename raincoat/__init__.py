@@ -20,15 +20,32 @@ up up down down left right left right b a
 
 from __future__ import annotations
 
-from raincoat import metadata as _metadata_module
 from raincoat.match import Checker, Match, NotMatching
 
 __all__ = ["Match", "Checker", "NotMatching"]
 
-
-_metadata = _metadata_module.extract_metadata()
-__author__ = _metadata["author"]
-__author_email__ = _metadata["email"]
-__license__ = _metadata["license"]
-__url__ = _metadata["url"]
-__version__ = _metadata["version"]
+# Reading the package metadata scans the installed distributions, so it's only
+# done when one of these attributes is actually accessed.
+_METADATA_ATTRIBUTES = {
+    "__author__": "author",
+    "__author_email__": "email",
+    "__license__": "license",
+    "__url__": "url",
+    "__version__": "version",
+}
+
+
+def __getattr__(name):
+    try:
+        key = _METADATA_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    from raincoat import metadata
+
+    values = metadata.extract_metadata()
+    globals().update(
+        (attribute, values[metadata_key])
+        for attribute, metadata_key in _METADATA_ATTRIBUTES.items()
+    )
+    return values[key]
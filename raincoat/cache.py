@@ -0,0 +1,348 @@
+"""
+Persistent caches, kept on disk between runs.
+
+Each kind of cached data gets its own Cache, stored in its own subdirectory of
+the cache directory. Values must be JSON-serializable.
+
+Where entries are stored is up to the backend: the cache directory, and
+optionally a cache server (RAINCOAT_CACHE_URL) shared between machines, e.g.
+CI runners, so that what one of them downloaded or parsed benefits the others.
+The HTTP responses are kept out of the cache server: they may come from
+requests authenticated with a GitHub token, and anyone reaching the server can
+read them. So are the indexes of local files, which are of no use elsewhere.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter, namedtuple
+
+from raincoat import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_dir():
+    path = os.getenv("RAINCOAT_CACHE_DIR")
+    if not path:
+        base = os.getenv("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        path = os.path.join(base, "raincoat")
+    return path
+
+
+def touch(path):
+    """
+    Entries are evicted by last access (see cache_usage), which is their
+    modification time: atimes are often not updated.
+    """
+    with contextlib.suppress(OSError):
+        os.utime(path)
+
+
+# Hits and misses of each kind, since they were last saved
+counters: Counter = Counter()
+counters_lock = threading.Lock()
+
+
+def record_access(kind, hit):
+    with counters_lock:
+        counters[(kind, "hits" if hit else "misses")] += 1
+
+
+@contextlib.contextmanager
+def lock_file(path):
+    if fcntl is None:
+        yield
+        return
+    # POSIX locks (unlike flock) work on NFS.
+    with open(path, "a") as handler:
+        fcntl.lockf(handler, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(handler, fcntl.LOCK_UN)
+
+
+def get_stats_path():
+    return os.path.join(get_cache_dir(), "stats.json")
+
+
+def read_stats():
+    """
+    Return a dict: kind > {"hits": ..., "misses": ...}
+    """
+    try:
+        with open(get_stats_path(), encoding="utf-8") as handler:
+            return json.load(handler)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError):
+        logger.warning("Ignoring the unreadable cache statistics")
+        return {}
+
+
+def save_stats():
+    """
+    Add the counters to the statistics of the cache directory.
+    """
+    with counters_lock:
+        current = dict(counters)
+        counters.clear()
+    if not current:
+        return
+
+    path = get_stats_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with lock_file(path + ".lock"):
+        stats = read_stats()
+        for (kind, name), count in current.items():
+            kind_stats = stats.setdefault(kind, {"hits": 0, "misses": 0})
+            kind_stats[name] = kind_stats.get(name, 0) + count
+        with open(path, "w", encoding="utf-8") as handler:
+            json.dump(stats, handler, indent=2, sort_keys=True)
+
+
+class Entry(namedtuple("Entry", "value stored_at expires_at")):
+    def is_fresh(self, now=None):
+        if self.expires_at is None:
+            return True
+        return (time.time() if now is None else now) < self.expires_at
+
+
+class DirectoryBackend:
+    """
+    Entries are files in a directory, which can be shared between processes
+    and machines (e.g. on NFS): they are written to a temporary file in the
+    same directory, flushed to disk and renamed, under a lock, so that readers
+    never see a partially written entry.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, kind, name):
+        return os.path.join(self.directory, kind, name[:2], name + ".json")
+
+    def lock(self, directory):
+        return lock_file(os.path.join(directory, ".lock"))
+
+    def read(self, kind, name):
+        """
+        Return the content of the entry (bytes), or None.
+        """
+        path = self.get_path(kind, name)
+        try:
+            with open(path, "rb") as handler:
+                content = handler.read()
+        except FileNotFoundError:
+            return None
+        touch(path)
+        return content
+
+    def write(self, kind, name, content):
+        path = self.get_path(kind, name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        with self.lock(directory):
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as handler:
+                    handler.write(content)
+                    handler.flush()
+                    os.fsync(handler.fileno())
+                os.replace(temp_path, path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+
+    def delete(self, kind, name):
+        path = self.get_path(kind, name)
+        try:
+            with self.lock(os.path.dirname(path)):
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class HTTPBackend:
+    """
+    Entries are stored on an HTTP server, at <url>/<kind>/<name>.json, read
+    with GET, written with PUT and deleted with DELETE. Any server doing
+    that will do (e.g. nginx with WebDAV, or a bucket).
+
+    The cache is only there to make things faster: if the server can't be
+    reached, it's not used for the rest of the run.
+    """
+
+    def __init__(self, url, timeout=10):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.available = True
+
+    def request(self, method, kind, name, content=None):
+        """
+        Return the response content, or None if there's no entry or the server
+        can't be reached.
+        """
+        import urllib.error
+        import urllib.request
+
+        if not self.available or settings.is_offline():
+            return None
+
+        request = urllib.request.Request(
+            f"{self.url}/{kind}/{name}.json", data=content, method=method
+        )
+        if content is not None:
+            request.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as exc:
+            if exc.code != 404:
+                logger.warning(f"Cache server: {method} {request.full_url}: {exc}")
+            return None
+        except OSError as exc:
+            logger.warning(f"Cannot reach the cache server at {self.url}: {exc}")
+            self.available = False
+            return None
+
+    def read(self, kind, name):
+        return self.request("GET", kind, name)
+
+    def write(self, kind, name, content):
+        self.request("PUT", kind, name, content)
+
+    def delete(self, kind, name):
+        self.request("DELETE", kind, name)
+
+
+class LayeredBackend:
+    """
+    Reads from the local backend first, then from the remote one (keeping a
+    local copy). Writes to both.
+    """
+
+    def __init__(self, local, remote):
+        self.local = local
+        self.remote = remote
+
+    def read(self, kind, name):
+        content = self.local.read(kind, name)
+        if content is None:
+            content = self.remote.read(kind, name)
+            if content is not None:
+                self.local.write(kind, name, content)
+        return content
+
+    def write(self, kind, name, content):
+        self.local.write(kind, name, content)
+        self.remote.write(kind, name, content)
+
+    def delete(self, kind, name):
+        self.local.delete(kind, name)
+        self.remote.delete(kind, name)
+
+
+# Kinds never sent to the cache server
+LOCAL_KINDS = {"http", "scan-index", "django-local-index"}
+# (directory, url) > backend. Shared by the Caches, so that a cache server that
+# can't be reached is only waited for once.
+backends: dict = {}
+backends_lock = threading.Lock()
+
+
+def get_backend(directory=None, kind=None):
+    """
+    The cache directory, shared with the cache server at RAINCOAT_CACHE_URL if
+    there's one (and the kind is not local).
+    """
+    directory = directory or get_cache_dir()
+    url = "" if kind in LOCAL_KINDS else settings.get("cache_url")
+    with backends_lock:
+        try:
+            return backends[directory, url]
+        except KeyError:
+            pass
+        backend = DirectoryBackend(directory)
+        if url:
+            backend = LayeredBackend(backend, HTTPBackend(url))
+        backends[directory, url] = backend
+        return backend
+
+
+class Cache:
+    def __init__(self, kind, directory=None, backend=None):
+        self.kind = kind
+        self.backend = backend or get_backend(directory, kind=kind)
+
+    def get_name(self, key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get_entry(self, key):
+        """
+        Return the Entry stored for this key, even if it has expired,
+        or None.
+        """
+        try:
+            content = self.backend.read(self.kind, self.get_name(key))
+            if content is not None:
+                content = json.loads(content)
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable {self.kind} cache entry for {key}")
+            content = None
+
+        if content is None or content.get("key") != key:
+            record_access(self.kind, hit=False)
+            return None
+
+        record_access(self.kind, hit=True)
+
+        return Entry(
+            value=content["value"],
+            stored_at=content["stored_at"],
+            expires_at=content["expires_at"],
+        )
+
+    def get(self, key, default=None):
+        """
+        Return the value stored for this key if it has not expired.
+        When running offline, expired values are better than nothing.
+        """
+        entry = self.get_entry(key)
+        if entry is None or not (entry.is_fresh() or settings.is_offline()):
+            return default
+        return entry.value
+
+    def set(self, key, value, ttl=None):
+        """
+        Store the value. Without a ttl (in seconds), it never expires.
+        """
+        now = time.time()
+        content = {
+            "key": key,
+            "value": value,
+            "stored_at": now,
+            "expires_at": None if ttl is None else now + ttl,
+        }
+        self.backend.write(
+            self.kind, self.get_name(key), json.dumps(content).encode("utf-8")
+        )
+
+    def delete(self, key):
+        self.backend.delete(self.kind, self.get_name(key))
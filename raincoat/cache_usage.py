@@ -0,0 +1,224 @@
+"""
+Size of the cache directory, and eviction of the least recently used entries
+so that it stays within a budget: set RAINCOAT_CACHE_MAX_SIZE (e.g. 2G) and it
+will be checked at the end of the runs, or run
+"raincoat cache prune --max-size 2G".
+
+Reading an entry (or a package archive) updates its modification time, which
+is used as the time of last access.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import logging
+import os
+import re
+import shutil
+import time
+from collections import namedtuple
+from operator import attrgetter
+
+from raincoat import settings
+from raincoat.cache import get_cache_dir, lock_file, read_stats, save_stats
+
+logger = logging.getLogger(__name__)
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+SIZE_REGEX = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$", re.IGNORECASE)
+# After an automatic eviction, the cache is at most this fraction of the
+# budget, so that the next runs don't have to evict again right away.
+LOW_WATERMARK = 0.9
+# Seconds between two automatic checks of the size of the cache
+EVICTION_INTERVAL = 600
+ARCHIVES = "archives"
+
+# kind: kind of cache, path: file (or directory, for archives)
+Item = namedtuple("Item", "kind path size last_access")
+
+
+def parse_size(value):
+    """
+    "500M" or "2G" or "1000" (bytes) > number of bytes
+    """
+    match = SIZE_REGEX.match(str(value))
+    if not match:
+        raise ValueError(f"Invalid size: {value!r} (expected e.g. 500M or 2G)")
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.upper()])
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "TB"
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def get_directory_size(path):
+    size = 0
+    for root, __, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                size += os.stat(os.path.join(root, name)).st_size
+    return size
+
+
+def list_archives(directory):
+    # archives/<package>/<version>/<archive>
+    for package in os.listdir(directory):
+        package_dir = os.path.join(directory, package)
+        for version in os.listdir(package_dir):
+            if version.startswith("tmp"):
+                # A download in progress
+                continue
+            path = os.path.join(package_dir, version)
+            with contextlib.suppress(OSError):
+                yield Item(
+                    ARCHIVES, path, get_directory_size(path), os.stat(path).st_mtime
+                )
+
+
+def list_entries(kind, directory):
+    for root, __, files in os.walk(directory):
+        for name in files:
+            # Not the locks or the temporary files
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(root, name)
+            with contextlib.suppress(OSError):
+                stat = os.stat(path)
+                yield Item(kind, path, stat.st_size, stat.st_mtime)
+
+
+def list_items(directory=None):
+    """
+    Yield the Items of the cache: its entries, and the package archives.
+    """
+    directory = directory or get_cache_dir()
+    try:
+        kinds = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return
+    for kind in kinds:
+        kind_dir = os.path.join(directory, kind)
+        if not os.path.isdir(kind_dir):
+            continue
+        if kind == ARCHIVES:
+            yield from list_archives(kind_dir)
+        else:
+            yield from list_entries(kind, kind_dir)
+
+
+def get_stats(directory=None):
+    """
+    Return a dict: kind > {"entries": ..., "size": ..., "hits": ..., "misses": ...}
+    """
+    save_stats()
+    stats = {}
+    for kind, counts in read_stats().items():
+        stats[kind] = {"entries": 0, "size": 0, **counts}
+    for item in list_items(directory):
+        kind_stats = stats.setdefault(
+            item.kind, {"entries": 0, "size": 0, "hits": 0, "misses": 0}
+        )
+        kind_stats["entries"] += 1
+        kind_stats["size"] += item.size
+    return stats
+
+
+def remove(item):
+    if item.kind == ARCHIVES:
+        shutil.rmtree(item.path, ignore_errors=True)
+        return
+    with lock_file(os.path.join(os.path.dirname(item.path), ".lock")):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(item.path)
+
+
+def prune(max_size, directory=None, items=None):
+    """
+    Remove the least recently used items until the cache takes at most
+    max_size bytes. Return the number of removed items and their size.
+    """
+    if items is None:
+        items = list(list_items(directory))
+    total = sum(item.size for item in items)
+    removed = freed = 0
+    for item in sorted(items, key=attrgetter("last_access")):
+        if total <= max_size:
+            break
+        remove(item)
+        total -= item.size
+        removed += 1
+        freed += item.size
+    return removed, freed
+
+
+def list_kinds(directory=None):
+    """
+    The kinds of cache found in the cache directory.
+    """
+    directory = directory or get_cache_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(
+        name for name in names if os.path.isdir(os.path.join(directory, name))
+    )
+
+
+def clear(kinds=None, directory=None):
+    """
+    Remove the given kinds of cache (all of them by default, and the
+    statistics). Only the existing kinds are accepted: anything else (e.g. a
+    path) raises a ValueError.
+    """
+    directory = directory or get_cache_dir()
+    existing = list_kinds(directory)
+    if not kinds:
+        kinds = existing
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(directory, "stats.json"))
+    unknown = sorted(set(kinds) - set(existing))
+    if unknown:
+        raise ValueError(f"Unknown kinds of cache: {', '.join(unknown)}")
+    for kind in kinds:
+        shutil.rmtree(os.path.join(directory, kind), ignore_errors=True)
+
+
+def evict_if_needed():
+    """
+    If the cache exceeds RAINCOAT_CACHE_MAX_SIZE, remove the least recently
+    used items. The size is only checked every few minutes.
+    """
+    max_size = settings.get("cache_max_size")
+    if not max_size:
+        return
+    budget = parse_size(max_size)
+
+    directory = get_cache_dir()
+    marker = os.path.join(directory, ".last-eviction")
+    try:
+        if time.time() - os.stat(marker).st_mtime < EVICTION_INTERVAL:
+            return
+    except FileNotFoundError:
+        pass
+    os.makedirs(directory, exist_ok=True)
+    with open(marker, "w"):
+        pass
+
+    items = list(list_items(directory))
+    if sum(item.size for item in items) <= budget:
+        return
+    removed, freed = prune(int(budget * LOW_WATERMARK), items=items)
+    logger.info(f"Cache over {max_size}: removed {removed} entries ({freed} bytes)")
+
+
+def end_of_run():
+    save_stats()
+    evict_if_needed()
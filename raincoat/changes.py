@@ -0,0 +1,157 @@
+"""
+Find what changed since a git ref: the files, and the packages whose version
+changed in the requirements or lock files, so that only the matches they
+concern are checked.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import json
+import os
+import re
+import subprocess
+from collections import namedtuple
+
+from raincoat.exceptions import RaincoatException
+from raincoat.utils import normalize_name
+
+# files: set of normalized paths, packages: set of normalized package names
+Changes = namedtuple("Changes", "files packages")
+
+REQUIREMENT_REGEX = re.compile(
+    r"^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*(?:===?|~=)\s*([^\s;#,]+)",
+    re.MULTILINE,
+)
+TOML_PACKAGE_REGEX = re.compile(
+    r'^name\s*=\s*"([^"]+)"\s*\nversion\s*=\s*"([^"]+)"', re.MULTILINE
+)
+
+
+def parse_requirements(content):
+    return dict(REQUIREMENT_REGEX.findall(content))
+
+
+def parse_toml_lock(content):
+    # poetry.lock, uv.lock, pdm.lock: [[package]] tables starting with the
+    # name and the version.
+    return dict(TOML_PACKAGE_REGEX.findall(content))
+
+
+def parse_pipfile_lock(content):
+    versions = {}
+    for section in ("default", "develop"):
+        for name, info in json.loads(content).get(section, {}).items():
+            versions[name] = info.get("version", "").lstrip("=")
+    return versions
+
+
+def parse_raincoat_lock(content):
+    return json.loads(content).get("versions", {})
+
+
+# Pattern of the file name > function returning a dict: package > version
+DEPENDENCY_FILES = {
+    "requirements*.txt": parse_requirements,
+    "constraints*.txt": parse_requirements,
+    "requirements/*.txt": parse_requirements,
+    "poetry.lock": parse_toml_lock,
+    "uv.lock": parse_toml_lock,
+    "pdm.lock": parse_toml_lock,
+    "Pipfile.lock": parse_pipfile_lock,
+    "raincoat.lock": parse_raincoat_lock,
+}
+
+
+def get_parser(path):
+    path = path.replace(os.sep, "/")
+    for pattern, parser in DEPENDENCY_FILES.items():
+        if fnmatch.fnmatch(os.path.basename(path), pattern) or fnmatch.fnmatch(
+            "/".join(path.split("/")[-2:]), pattern
+        ):
+            return parser
+    return None
+
+
+def git(*args):
+    result = subprocess.run(
+        ["git", *args], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise RaincoatException(
+            "Error while running git {}: {}".format(
+                " ".join(args), result.stderr.decode("utf-8").strip()
+            )
+        )
+    return result.stdout.decode("utf-8")
+
+
+def get_changed_files(ref):
+    """
+    Files (relative to the current directory) that differ from the ref,
+    including uncommitted and untracked ones.
+    """
+    changed = git("diff", "--name-only", "--relative", ref, "--").splitlines()
+    untracked = git("ls-files", "--others", "--exclude-standard").splitlines()
+    return {os.path.normpath(path) for path in changed + untracked if path}
+
+
+def get_old_content(ref, path):
+    result = subprocess.run(
+        ["git", "show", f"{ref}:./{path}"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        # The file didn't exist
+        return None
+    return result.stdout.decode("utf-8")
+
+
+def get_changed_packages(ref, files):
+    """
+    Packages whose version changed between the ref and the working copy, in
+    the dependency files among the given files.
+    """
+    packages = set()
+    for path in files:
+        parser = get_parser(path)
+        if parser is None:
+            continue
+
+        versions = []
+        for content in (get_old_content(ref, path), read_file(path)):
+            try:
+                versions.append(parser(content) if content else {})
+            except ValueError:
+                versions.append({})
+
+        old, new = (
+            {normalize_name(name): version for name, version in v.items()}
+            for v in versions
+        )
+        packages |= {
+            name for name in old.keys() | new.keys() if old.get(name) != new.get(name)
+        }
+    return packages
+
+
+def read_file(path):
+    try:
+        with open(path, encoding="utf-8") as handler:
+            return handler.read()
+    except FileNotFoundError:
+        return None
+
+
+def since(ref):
+    files = get_changed_files(ref)
+    return Changes(files=files, packages=get_changed_packages(ref, files))
+
+
+def from_file_list(handler):
+    """
+    Only the files listed (one per line), without checking dependencies.
+    """
+    files = {os.path.normpath(line.strip()) for line in handler if line.strip()}
+    return Changes(files=files, packages=set())
@@ -1,13 +1,16 @@
 from __future__ import annotations
 
 import contextlib
+import itertools
 import logging
 import os
 import sys
 
 import click
 
-from raincoat import __version__, glue, utils
+from raincoat import glue, lock, settings, utils
+from raincoat.color import get_color
+from raincoat.match import Unknown
 
 logger = logging.getLogger(__name__)
 
@@ -36,6 +39,8 @@ def click_set_verbosity(ctx: click.Context, param: click.Parameter, value: int)
 def set_verbosity(verbosity: int) -> None:
     level = get_log_level(verbosity=verbosity)
     logging.basicConfig(level=level)
+    # basicConfig does nothing once logging is configured (e.g. in the daemon)
+    logging.getLogger().setLevel(level)
     level_name = logging.getLevelName(level)
     logger.debug(
         f"Log level set to {level_name}",
@@ -47,27 +52,37 @@ def set_verbosity(verbosity: int) -> None:
 def handle_errors():
     try:
         yield
+    except click.ClickException:
+        raise
     except Exception as exc:
         logger.debug("Exception details:", exc_info=exc)
         messages = [str(e) for e in utils.causes(exc)]
         raise click.ClickException("\n".join(e for e in messages if e))
 
 
-@click.command(context_settings=CONTEXT_SETTINGS)
-@click.argument("path", nargs=-1, type=click.Path(exists=True))
-@click.option(
-    "-e",
-    "--exclude",
-    multiple=True,
-    help="Files and folders to exclude (e.g. 'test_*')",
-)
-@click.option(
-    "-c/-nc",
-    "--color/--no-color",
-    default=None,
-    help="Should output be colorized ? (default : yes for TTYs)",
-)
-@click.option(
+class DefaultGroup(click.Group):
+    """
+    Group of subcommands that runs the default one when the first argument is
+    not the name of a subcommand, so that "raincoat ." keeps working. An
+    existing path wins over a subcommand of the same name ("raincoat cache"
+    checks the "cache" directory if there is one), and the options of the
+    group are honored among the options of the default one ("raincoat -v -V").
+    """
+
+    default_command = "check"
+    group_options = {"-h", "--help", "-V", "--version"}
+
+    def parse_args(self, ctx, args):
+        options = list(itertools.takewhile(lambda arg: arg.startswith("-"), args))
+        group_options = [arg for arg in options if arg in self.group_options]
+        if group_options:
+            args = group_options
+        elif not args or args[0] not in self.commands or os.path.exists(args[0]):
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+verbose_option = click.option(
     "-v",
     "--verbose",
     is_eager=True,
@@ -75,37 +90,396 @@ def handle_errors():
     count=True,
     help="Use multiple times to increase verbosity",
 )
-@click.version_option(__version__, "-V", "--version", prog_name=PROGRAM_NAME)
-@handle_errors()
-def cli(path, exclude, color, **kwargs):
+
+
+def click_parse_shard(ctx: click.Context, param: click.Parameter, value):
+    from raincoat import shard as shard_module
+
+    if value is None:
+        return None
+    try:
+        return shard_module.parse_shard(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
+
+def common_options(function):
+    options = [
+        click.argument("path", nargs=-1, type=click.Path(exists=True)),
+        click.option(
+            "-e",
+            "--exclude",
+            multiple=True,
+            help="Files and folders to exclude (e.g. 'test_*')",
+        ),
+        click.option(
+            "--update-lock",
+            is_flag=True,
+            default=None,
+            help="Resolve the current versions again and rewrite raincoat.lock "
+            "(by default, it's used if it exists)",
+        ),
+        click.option(
+            "--shard",
+            metavar="I/N",
+            callback=click_parse_shard,
+            help="Split the work between N jobs, and only do the part of the I-th "
+            "one (from 1 to N)",
+        ),
+        verbose_option,
+    ]
+    for option in reversed(options):
+        function = option(function)
+    return function
+
+
+@click.group(cls=DefaultGroup, context_settings=CONTEXT_SETTINGS)
+@click.version_option(
+    None, "-V", "--version", package_name=PROGRAM_NAME, prog_name=PROGRAM_NAME
+)
+def cli():
     """
     Analyze your code to find outdated copy-pasted snippets.
     "Raincoat has you covered when your code is not DRY."
 
+    Without a command, runs "check".
+
     Full documentation at http://raincoat.readthedocs.io/en/latest/
     """
+
+
+@cli.command(context_settings={"auto_envvar_prefix": ENV_PREFIX})
+@common_options
+@click.option(
+    "-c/-nc",
+    "--color/--no-color",
+    default=None,
+    help="Should output be colorized ? (default : yes for TTYs)",
+)
+@click.option(
+    "--offline/--online",
+    default=None,
+    help="Only use the cache, never the network. Matches that can't be "
+    "checked are reported as unknown.",
+)
+@click.option(
+    "--since",
+    metavar="REF",
+    help="Only check the files changed since this git ref, and the comments "
+    "about packages whose version changed in the requirements",
+)
+@click.option(
+    "--files-from",
+    type=click.File("r"),
+    help="Only check the files listed in this file (- for stdin), one per line",
+)
+@click.option(
+    "--affected-by",
+    multiple=True,
+    metavar="NAME",
+    help="Only check the comments about this package or repository (owner/name), "
+    "using an index of the comments kept in the cache",
+)
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Keep running, and check the comments again when the files change",
+)
+@click.option(
+    "--report",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Also write the results to this file, to be merged with the reports of "
+    "the other shards with raincoat merge-reports",
+)
+@handle_errors()
+def check(
+    path,
+    exclude,
+    color,
+    offline,
+    update_lock,
+    since,
+    files_from,
+    affected_by,
+    watch,
+    shard,
+    report,
+    **kwargs,
+):
+    """
+    Check the Raincoat comments in the given paths (defaults to the current
+    directory).
+    """
+    from raincoat import cache_usage
+    from raincoat import shard as shard_module
+
     if not path:
         path = ["."]
 
+    if watch and (since or files_from or affected_by or shard or report):
+        raise click.UsageError(
+            "--watch cannot be used with --since, --files-from, --affected-by, "
+            "--shard or --report"
+        )
+
+    changes = None
+    if since and files_from:
+        raise click.UsageError("--since and --files-from are mutually exclusive")
+    if since or files_from or affected_by:
+        # Only imported when needed, it's not that light.
+        from raincoat import changes as changes_module
+
+        if since:
+            changes = changes_module.since(since)
+        elif files_from:
+            changes = changes_module.from_file_list(files_from)
+        else:
+            changes = changes_module.Changes(files=set(), packages=set())
+        changes.packages.update(affected_by)
+
     if color is None:
         color = sys.stdout.isatty()
 
-    errors = (
-        error_match
-        for element in path
-        for error_match in glue.raincoat(path=element, exclude=exclude, color=color)
-    )
-    has_errors = False
-    for line in errors:
-        has_errors = True
+    with settings.override(offline=offline, update_lock=update_lock), lock.use_lock():
+        if watch:
+            watch_paths(path, exclude=exclude, color=color)
+            return
+
+        lines = (
+            line
+            for element in path
+            for line in glue.raincoat(
+                path=element,
+                exclude=exclude,
+                color=color,
+                changes=changes,
+                shard=shard,
+            )
+        )
+        results = echo_results(lines)
+
+    cache_usage.end_of_run()
+    if report:
+        shard_module.write_report(report, shard, results)
+    conclude(results)
+
+
+def echo_results(lines):
+    """
+    Print the lines, and return a list of (line, unknown).
+    """
+    results = []
+    for line in lines:
         click.echo(line)
-    if has_errors:
+        results.append((str(line), isinstance(line, Unknown)))
+    return results
+
+
+def conclude(results):
+    unknown = sum(1 for __, is_unknown in results if is_unknown)
+    if unknown:
+        click.echo(f"{unknown} match(es) could not be checked.", err=True)
+    if len(results) > unknown:
         raise click.Abort("Inconsistencies were found.")
 
 
+def watch_paths(paths, exclude, color):
+    from raincoat import watch
+
+    lines = watch.watch(paths, exclude=exclude, color=get_color(color))
+    try:
+        for line in lines:
+            click.echo(line)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lines.close()
+
+
+@cli.command(context_settings={"auto_envvar_prefix": ENV_PREFIX})
+@common_options
+@handle_errors()
+def fetch(path, exclude, update_lock, shard, **kwargs):
+    """
+    Download everything needed to check the Raincoat comments in the given
+    paths into the cache, without checking them. "raincoat check --offline"
+    can then run without network.
+    """
+    from raincoat import cache_usage
+
+    if not path:
+        path = ["."]
+
+    count = 0
+    with settings.override(update_lock=update_lock), lock.use_lock():
+        for element in path:
+            count += glue.fetch(path=element, exclude=exclude, shard=shard)
+    cache_usage.end_of_run()
+    click.echo(f"Fetched the data of {count} match(es).")
+
+
+@cli.command("merge-reports", context_settings={"auto_envvar_prefix": ENV_PREFIX})
+@click.argument("reports", nargs=-1, required=True, type=click.Path(exists=True))
+@verbose_option
+@handle_errors()
+def merge_reports(reports, **kwargs):
+    """
+    Print the results of the reports written by raincoat check --shard i/n
+    --report, as if everything had been checked at once.
+    """
+    from raincoat import shard as shard_module
+
+    results = shard_module.merge_reports(reports)
+    for line, unknown in results:
+        click.echo(Unknown(line) if unknown else line)
+    conclude(results)
+
+
+@cli.command("daemon", context_settings={"auto_envvar_prefix": ENV_PREFIX})
+@click.option("--stop", is_flag=True, help="Stop the running daemon")
+@verbose_option
+@handle_errors()
+def daemon_command(stop, **kwargs):
+    """
+    Run in the background, keeping everything warm, so that the next raincoat
+    commands are forwarded to it and run faster. Set RAINCOAT_NO_DAEMON=1 to
+    bypass it.
+    """
+    from raincoat import daemon
+
+    if stop:
+        if not daemon.stop():
+            raise click.ClickException("No daemon is running.")
+        return
+
+    daemon.serve()
+
+
+@cli.command(context_settings={"auto_envvar_prefix": ENV_PREFIX})
+@verbose_option
+@handle_errors()
+def lsp(**kwargs):
+    """
+    Run a language server on the standard input and output, so that editors
+    show the results of the Raincoat comments of the open files.
+    """
+    from raincoat import lsp as lsp_module
+
+    sys.exit(lsp_module.serve())
+
+
+def click_parse_size(ctx: click.Context, param: click.Parameter, value):
+    from raincoat import cache_usage
+
+    if value is None:
+        return None
+    try:
+        return cache_usage.parse_size(value)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc))
+
+
+@cli.group("cache", context_settings={"auto_envvar_prefix": ENV_PREFIX})
+def cache_group():
+    """
+    Manage the cache directory.
+    """
+
+
+@cache_group.command("stats")
+@verbose_option
+@handle_errors()
+def cache_stats(**kwargs):
+    """
+    Show the size and hit rate of each kind of cache.
+    """
+    from raincoat import cache_usage
+
+    stats = cache_usage.get_stats()
+    total = {"entries": 0, "size": 0, "hits": 0, "misses": 0}
+    rows = []
+    for kind, kind_stats in sorted(stats.items()):
+        rows.append((kind, kind_stats))
+        for name in total:
+            total[name] += kind_stats[name]
+    rows.append(("Total", total))
+
+    click.echo(
+        f"{'Kind':<28}{'Entries':>9}{'Size':>11}{'Hits':>9}{'Misses':>9}"
+        f"{'Hit rate':>10}"
+    )
+    for kind, kind_stats in rows:
+        accesses = kind_stats["hits"] + kind_stats["misses"]
+        hit_rate = f"{kind_stats['hits'] / accesses:.0%}" if accesses else "-"
+        click.echo(
+            f"{kind:<28}{kind_stats['entries']:>9}"
+            f"{cache_usage.format_size(kind_stats['size']):>11}"
+            f"{kind_stats['hits']:>9}{kind_stats['misses']:>9}{hit_rate:>10}"
+        )
+
+
+@cache_group.command("prune")
+@click.option(
+    "--max-size",
+    default=lambda: settings.get("cache_max_size") or None,
+    callback=click_parse_size,
+    help="Remove the least recently used entries until the cache is at most this "
+    "size (e.g. 500M, 2G). Defaults to RAINCOAT_CACHE_MAX_SIZE",
+)
+@verbose_option
+@handle_errors()
+def cache_prune(max_size, **kwargs):
+    """
+    Remove the least recently used entries of the cache.
+    """
+    from raincoat import cache_usage
+
+    if max_size is None:
+        raise click.UsageError("--max-size is required (or RAINCOAT_CACHE_MAX_SIZE)")
+    removed, freed = cache_usage.prune(max_size)
+    click.echo(f"Removed {removed} entries ({cache_usage.format_size(freed)}).")
+
+
+def click_check_kinds(ctx: click.Context, param: click.Parameter, value):
+    from raincoat import cache_usage
+
+    existing = cache_usage.list_kinds()
+    for kind in value:
+        if kind not in existing:
+            raise click.BadParameter(
+                f"{kind!r} is not a kind of cache "
+                f"(existing: {', '.join(existing) or 'none'})"
+            )
+    return value
+
+
+@cache_group.command("clear")
+@click.argument("kinds", nargs=-1, callback=click_check_kinds)
+@verbose_option
+@handle_errors()
+def cache_clear(kinds, **kwargs):
+    """
+    Remove the given kinds of cache (see raincoat cache stats), or all of them.
+    """
+    from raincoat import cache_usage
+
+    cache_usage.clear(kinds)
+    click.echo("Cache cleared.")
+
+
 def main():
     # https://click.palletsprojects.com/en/7.x/python3/
     os.environ.setdefault("LC_ALL", "C.UTF-8")
     os.environ.setdefault("LANG", "C.UTF-8")
 
+    args = sys.argv[1:]
+    # Watching or serving would keep the daemon busy forever.
+    forward = args[:1] not in (["daemon"], ["lsp"]) and "--watch" not in args
+    if forward and not settings.get("no_daemon"):
+        from raincoat import daemon
+
+        exit_code = daemon.forward(args)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
     return cli()
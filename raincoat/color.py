@@ -3,8 +3,6 @@ from __future__ import annotations
 from colorama import Fore, Style
 from colorama import init as colorama_init
 
-colorama_init()
-
 COLOR_DICT = {
     "neutral": Style.RESET_ALL,
     "match": Fore.YELLOW + Style.BRIGHT,
@@ -35,9 +33,21 @@ class Color:
         return apply_color
 
 
+_colorama_initialized = False
+
+
+def init_colorama():
+    # Only wrap the output streams when colors are actually requested.
+    global _colorama_initialized
+    if not _colorama_initialized:
+        colorama_init()
+        _colorama_initialized = True
+
+
 def get_color(color=False):
     color_dict = {}
     if color:
+        init_colorama()
         color_dict = COLOR_DICT
 
     return Color(color_dict)
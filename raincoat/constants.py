@@ -3,3 +3,5 @@ from __future__ import annotations
 FILE_NOT_FOUND = "FILE_NOT_FOUND"
 
 ELEMENT_NOT_FOUND = "ELEMENT_NOT_FOUND"
+
+UNKNOWN = "UNKNOWN"
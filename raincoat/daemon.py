@@ -0,0 +1,289 @@
+"""
+"raincoat daemon" keeps a process running with everything warm (match types
+loaded, installed distributions scanned, parsed elements and HTTP connections
+in memory), listening on a Unix socket. When it's running, the raincoat
+command forwards its arguments to it instead of doing the work itself.
+
+Requests are handled one at a time: each of them runs in the working
+directory and with the environment variables of the client.
+
+Each interpreter (i.e. virtualenv) and version of the raincoat code has its own
+daemon: a daemon only answers the clients running the same code as itself,
+the others do the work themselves. Unix sockets are needed: elsewhere, the
+command always does the work itself.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from raincoat import settings
+from raincoat.cache import get_cache_dir
+from raincoat.exceptions import RaincoatException
+
+logger = logging.getLogger(__name__)
+
+HAS_UNIX_SOCKETS = hasattr(socket, "AF_UNIX")
+# Seconds the client waits for the daemon to take its request. The daemon
+# handles one request at a time: if it's busy (or stuck), the client does the
+# work itself.
+ACCEPT_TIMEOUT = 2
+ACCEPTED = b"accepted\n"
+
+
+def get_code_signature():
+    """
+    Identifies the interpreter and the raincoat code it runs. Reading the
+    version of raincoat would scan the installed distributions, so the files of
+    the package are used instead: they change when raincoat is upgraded.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    signature = hashlib.sha256()
+    signature.update(f"{sys.executable}\0{sys.prefix}\0".encode("utf-8"))
+    for root, folders, files in os.walk(directory):
+        folders.sort()
+        for name in sorted(files):
+            if not name.endswith(".py"):
+                continue
+            path = os.path.join(root, name)
+            with contextlib.suppress(OSError):
+                stat = os.stat(path)
+                signature.update(
+                    f"{path}\0{stat.st_mtime_ns}\0{stat.st_size}\0".encode("utf-8")
+                )
+    return signature.hexdigest()[:16]
+
+
+def get_socket_path():
+    return settings.get("daemon_socket") or os.path.join(
+        get_cache_dir(), f"daemon-{get_code_signature()}.sock"
+    )
+
+
+def send(request, path=None, timeout=None):
+    """
+    Send a request to the daemon and return its response, or None if it's not
+    running or doesn't take the request within the timeout.
+    """
+    if not HAS_UNIX_SOCKETS:
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(ACCEPT_TIMEOUT if timeout is None else timeout)
+    try:
+        client.connect(path or get_socket_path())
+        client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with client.makefile("rb") as handler:
+            if handler.readline() != ACCEPTED:
+                return None
+            # Once it's taken, the request runs as long as it needs.
+            client.settimeout(None)
+            line = handler.readline()
+    except OSError:
+        return None
+    finally:
+        client.close()
+    return json.loads(line) if line else None
+
+
+def forward(args, path=None):
+    """
+    Run the command in the daemon, if it's running, and return its exit code.
+    Return None if it's not running (or runs other code than ours).
+    """
+    stdin = None
+    if "-" in args and not sys.stdin.isatty():
+        stdin = sys.stdin.read()
+
+    response = send(
+        {
+            "args": args,
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+            "signature": get_code_signature(),
+            "isatty": sys.stdout.isatty(),
+            "stdin": stdin,
+        },
+        path=path,
+    )
+    if response is None or "exit_code" not in response:
+        return None
+
+    sys.stdout.write(response["stdout"])
+    sys.stdout.flush()
+    sys.stderr.write(response["stderr"])
+    return response["exit_code"]
+
+
+def stop(path=None):
+    """
+    Return True if there was a daemon to stop.
+    """
+    return send({"command": "stop"}, path=path) is not None
+
+
+class Output(io.StringIO):
+    def __init__(self, isatty):
+        super().__init__()
+        self._isatty = isatty
+
+    def isatty(self):
+        return self._isatty
+
+
+@contextlib.contextmanager
+def client_context(request):
+    """
+    Run with the working directory, environment, stdin and stdout of the
+    client. Logging is configured as in a new process: only the client's
+    output gets the logs, at the level of its own -v.
+    """
+    previous_cwd = os.getcwd()
+    previous_env = dict(os.environ)
+    stdout, stderr = Output(request.get("isatty", False)), Output(False)
+    handler = logging.StreamHandler(stderr)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root_logger = logging.getLogger()
+    previous_handlers, previous_level = root_logger.handlers[:], root_logger.level
+
+    os.environ.clear()
+    os.environ.update(request.get("env", {}))
+    os.chdir(request["cwd"])
+    root_logger.handlers = [handler]
+    root_logger.setLevel(logging.WARNING)
+    previous_stdin, sys.stdin = sys.stdin, io.StringIO(request.get("stdin") or "")
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            yield stdout, stderr
+    finally:
+        sys.stdin = previous_stdin
+        root_logger.handlers = previous_handlers
+        root_logger.setLevel(previous_level)
+        os.chdir(previous_cwd)
+        os.environ.clear()
+        os.environ.update(previous_env)
+
+
+def get_environment_signature():
+    """
+    Changes when packages are installed or removed.
+    """
+    signature = []
+    for path in sys.path:
+        try:
+            signature.append(os.stat(path or ".").st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return signature
+
+
+class Daemon:
+    def __init__(self):
+        self.environment_signature = None
+        self.code_signature = get_code_signature()
+
+    def warm_up(self):
+        import asttokens  # noqa
+
+        from raincoat import http_utils, source
+        from raincoat.match import get_match_types
+
+        http_utils.shared_adapters = {}
+
+        match_types = get_match_types()
+        for match_type in list(match_types):
+            match_types[match_type]
+        source.get_environment()
+        self.environment_signature = get_environment_signature()
+
+    def refresh(self):
+        from raincoat import source
+
+        signature = get_environment_signature()
+        if signature != self.environment_signature:
+            logger.info("Installed packages changed, scanning them again")
+            source.get_environment.cache_clear()
+            self.environment_signature = signature
+
+    def run(self, request):
+        from raincoat import cli
+
+        self.refresh()
+        with client_context(request) as (stdout, stderr):
+            try:
+                cli.cli.main(args=request["args"], prog_name=cli.PROGRAM_NAME)
+                exit_code = 0
+            except SystemExit as exc:
+                exit_code = exc.code if isinstance(exc.code, int) else 1
+            except Exception:
+                logger.exception("Unexpected error")
+                exit_code = 1
+
+        return {
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+            "exit_code": exit_code,
+        }
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        self.wfile.write(ACCEPTED)
+        command = request.get("command", "run")
+        response = {}
+        if command == "run":
+            if request.get("signature") == self.server.daemon.code_signature:
+                response = self.server.daemon.run(request)
+            else:
+                # The client will do the work itself.
+                logger.info("Request from a client running other code, ignored")
+        elif command == "stop":
+            # shutdown waits for the request to be handled.
+            threading.Thread(target=self.server.shutdown).start()
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+if HAS_UNIX_SOCKETS:
+
+    class Server(socketserver.UnixStreamServer):
+        def __init__(self, path, daemon):
+            self.daemon = daemon
+            super().__init__(path, RequestHandler)
+
+
+def serve(path=None):
+    if not HAS_UNIX_SOCKETS:
+        raise RaincoatException("The daemon needs Unix sockets")
+    path = path or get_socket_path()
+    if send({"command": "ping"}, path=path) is not None:
+        raise RaincoatException(f"A daemon is already listening on {path}")
+    with contextlib.suppress(FileNotFoundError):
+        # Left by a daemon that didn't stop properly
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    daemon = Daemon()
+    daemon.warm_up()
+
+    previous_umask = os.umask(0o077)
+    try:
+        server = Server(path, daemon)
+    finally:
+        os.umask(previous_umask)
+
+    logger.info(f"Listening on {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(path)
@@ -16,3 +16,15 @@ class NotMatching(Exception):
     """
     Raincoat comment match was almost found but the format is slightly wrong.
     """
+
+
+class RateLimitExceeded(RaincoatException):
+    """
+    The GitHub API rate limit was exceeded.
+    """
+
+
+class OfflineCacheMiss(RaincoatException):
+    """
+    Running offline, and the data we need is not in the cache.
+    """
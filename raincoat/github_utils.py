@@ -1,13 +1,243 @@
 from __future__ import annotations
 
+import logging
 import os
+import threading
+import time
+from collections import Counter, namedtuple
 
 import requests
 
+from raincoat import http_utils, settings
+from raincoat.exceptions import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.github.com/"
+
+# When requests are waiting for the same budget, those of higher priority go
+# first.
+HIGH, NORMAL, LOW = 0, 1, 2
+
+MAX_RETRIES = 3
+
+Budget = namedtuple("Budget", "limit remaining reset")
+
+
+def get_resource(url):
+    """
+    GitHub has separate budgets for the different parts of its API.
+    """
+    path = url[len(API_URL) :]
+    if path.startswith("search/"):
+        return "search"
+    if path.startswith("graphql"):
+        return "graphql"
+    return "core"
+
+
+class RateLimiter:
+    """
+    Keeps track of the GitHub API budget through the X-RateLimit-* headers
+    of the responses, and holds requests back when it's exhausted.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.budgets = {}
+        # (resource, priority) > number of requests in acquire
+        self.waiting = Counter()
+
+    def acquire(self, resource, priority=NORMAL):
+        """
+        Take a request from the budget, waiting for the reset if it's
+        exhausted. Requests of higher priority waiting for the same budget
+        go first.
+        """
+        with self.condition:
+            self.waiting[resource, priority] += 1
+            try:
+                self.wait_for_budget(resource, priority)
+            finally:
+                self.waiting[resource, priority] -= 1
+                self.condition.notify_all()
+
+    def wait_for_budget(self, resource, priority):
+        while True:
+            budget = self.budgets.get(resource)
+            if budget is None:
+                return
+
+            if budget.remaining > 0:
+                if self.is_preceded(resource, priority):
+                    self.condition.wait()
+                    continue
+                self.budgets[resource] = budget._replace(remaining=budget.remaining - 1)
+                return
+
+            delay = budget.reset - time.time()
+            if delay <= 0:
+                # The limit has been reset since our last response.
+                del self.budgets[resource]
+                return
+
+            check_delay(delay, resource)
+            logger.warning(
+                f"GitHub API {resource} budget is exhausted, "
+                f"pausing for {int(delay) + 1}s until it is reset"
+            )
+            self.condition.wait(timeout=delay + 1)
+
+    def is_preceded(self, resource, priority):
+        return any(self.waiting[resource, other] for other in range(priority))
+
+    def release(self, resource):
+        """
+        The request didn't use the budget (e.g. it was answered by the cache)
+        """
+        with self.condition:
+            budget = self.budgets.get(resource)
+            if budget is not None:
+                self.budgets[resource] = budget._replace(
+                    remaining=min(budget.limit, budget.remaining + 1)
+                )
+            self.condition.notify_all()
+
+    def update(self, response):
+        headers = response.headers
+        try:
+            budget = Budget(
+                limit=int(headers["X-RateLimit-Limit"]),
+                remaining=int(headers["X-RateLimit-Remaining"]),
+                reset=int(headers["X-RateLimit-Reset"]),
+            )
+        except (KeyError, ValueError):
+            return
+        self.set_budget(headers.get("X-RateLimit-Resource", "core"), budget)
+
+    def set_budget(self, resource, budget):
+        with self.condition:
+            self.budgets[resource] = budget
+            self.condition.notify_all()
+
+
+rate_limiter = RateLimiter()
+
+
+def check_delay(delay, resource):
+    max_wait = settings.get("github_max_wait")
+    if delay > max_wait:
+        raise RateLimitExceeded(
+            f"GitHub API {resource} rate limit exceeded, and it will only be reset "
+            f"in {int(delay)}s (more than RAINCOAT_GITHUB_MAX_WAIT={max_wait}s). "
+            "Setting RAINCOAT_GITHUB_TOKEN gives a larger budget."
+        )
+
+
+def get_retry_delay(response):
+    """
+    If the response says we've been rate limited, return the number of seconds
+    to wait before retrying, otherwise None.
+    """
+    if response.status_code not in (403, 429):
+        return None
+    headers = response.headers
+    if "Retry-After" in headers:
+        # Secondary rate limits
+        try:
+            return int(headers["Retry-After"])
+        except ValueError:
+            return 60
+    if headers.get("X-RateLimit-Remaining") == "0":
+        try:
+            return max(0, int(headers["X-RateLimit-Reset"]) - time.time()) + 1
+        except (KeyError, ValueError):
+            return 60
+    return None
+
+
+class GitHubSession(requests.Session):
+    """
+    Session that schedules calls to the GitHub API according to the remaining
+    rate limit budget. It accepts an additional priority argument
+    (HIGH, NORMAL, LOW) to the request methods.
+    """
+
+    def __init__(self, rate_limiter=rate_limiter):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+
+    def request(self, method, url, *args, priority=NORMAL, **kwargs):
+        if not url.startswith(API_URL):
+            return super().request(method, url, *args, **kwargs)
+
+        resource = get_resource(url)
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.acquire(resource, priority=priority)
+            response = super().request(method, url, *args, **kwargs)
+
+            if getattr(response, "from_cache", False):
+                self.rate_limiter.release(resource)
+                return response
+
+            self.rate_limiter.update(response)
+            delay = get_retry_delay(response)
+            if delay is None or attempt == MAX_RETRIES:
+                return response
+
+            check_delay(delay, resource)
+            logger.warning(
+                f"GitHub API {resource} rate limit hit, retrying {url} in {delay:.0f}s"
+            )
+            time.sleep(delay)
+
 
 def get_session():
-    session = requests.Session()
+    session = GitHubSession()
+    http_utils.mount_cache(session)
     token = os.getenv("RAINCOAT_GITHUB_TOKEN")
     if token:
         session.auth = tuple(token.split(":"))
     return session
+
+
+def report_budget(session, expected, resource="core"):
+    """
+    Log how much of the GitHub API budget we're about to use. Querying the
+    rate limit doesn't count against it, so it bypasses the rate limiter, and
+    the answer must be fresh, so it bypasses the cache.
+    """
+    if settings.is_offline():
+        return
+    try:
+        response = requests.Session.request(
+            session,
+            "GET",
+            API_URL + "rate_limit",
+            headers={"Cache-Control": "no-cache"},
+        )
+    except requests.RequestException as exc:
+        # It's only informative.
+        logger.info(f"Could not query the GitHub API rate limit: {exc}")
+        return
+    if response.status_code != 200:
+        return
+    try:
+        info = response.json()["resources"][resource]
+        budget = Budget(
+            limit=info["limit"], remaining=info["remaining"], reset=info["reset"]
+        )
+    except (KeyError, ValueError):
+        return
+    session.rate_limiter.set_budget(resource, budget)
+
+    message = (
+        f"Expecting to use up to {expected} GitHub API {resource} requests, "
+        f"{budget.remaining}/{budget.limit} remaining"
+    )
+    if expected > budget.remaining:
+        reset = time.strftime("%H:%M:%S", time.localtime(budget.reset))
+        logger.warning(f"{message}. The run will pause until the reset at {reset}.")
+    else:
+        logger.info(message)
+    return budget
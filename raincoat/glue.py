@@ -12,10 +12,11 @@ will:
 from __future__ import annotations
 
 import itertools
+import os
 
-from . import grep
+from . import grep, index
 from .color import get_color
-from .match import check_matches
+from .match import Unknown, check_matches, fetch_matches
 
 
 def class_key(match):
@@ -26,17 +27,67 @@ def class_key_name(match):
     return match.__class__.__name__
 
 
-def raincoat(path, exclude=None, color=False):
+def find_matches(path, exclude=None, changes=None, shard=None):
     """
-    Main entrypoint
+    Return a dict: match type > matches found in path.
+
+    If changes is given, only the matches in the changed files, or depending on
+    a changed package. If shard is given, only the matches of this shard.
     """
-    matches = sorted(grep.find_in_dir(path, exclude=exclude), key=class_key_name)
+    if changes is None:
+        matches = grep.find_in_dir(path, exclude=exclude)
+    else:
+        matches = find_changed_matches(path, exclude=exclude, changes=changes)
+    if shard is not None:
+        from .shard import select_matches
+
+        matches = select_matches(matches, shard)
+    return group_matches(matches)
+
+
+def group_matches(matches):
+    """
+    Return a dict: match type > matches.
+    """
+    matches = sorted(matches, key=class_key_name)
 
     matches_dict = {}
     for match_class, matches_for_class in itertools.groupby(matches, key=class_key):
         matches_for_class = list(matches_for_class)
         matches_dict[match_class.match_type] = matches_for_class
+    return matches_dict
+
+
+def find_changed_matches(path, exclude, changes):
+    yield from grep.find_in_files(changes.files, base_dir=path, exclude=exclude)
+    if not changes.packages:
+        return
+    # The files that didn't change may depend on the packages that did.
+    scan_index = index.ScanIndex(path, exclude=exclude)
+    for match in scan_index.find_affected(changes.packages):
+        if os.path.normpath(match.filename) not in changes.files:
+            yield match
+
+
+def raincoat(path, exclude=None, color=False, changes=None, shard=None):
+    """
+    Main entrypoint
+    """
+    matches_dict = find_matches(path, exclude=exclude, changes=changes, shard=shard)
 
     color_obj = get_color(color)
     for error, match in check_matches(matches_dict):
-        yield match.format(error, color_obj)
+        line = match.format(error, color_obj)
+        if isinstance(error, Unknown):
+            line = Unknown(line)
+        yield line
+
+
+def fetch(path, exclude=None, shard=None):
+    """
+    Fill the caches with what checking path needs. Return the number of
+    matches.
+    """
+    matches_dict = find_matches(path, exclude=exclude, shard=shard)
+    fetch_matches(matches_dict)
+    return sum(len(matches) for matches in matches_dict.values())
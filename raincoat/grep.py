@@ -80,6 +80,36 @@ def list_python_files(base_dir=".", exclude=None):
                 yield os.path.normpath(os.path.join(root, filename))
 
 
+def is_excluded(path, exclude):
+    """
+    Same rules as list_python_files: the file or one of its folders matches
+    one of the patterns.
+    """
+    exclude = {os.path.normpath(pattern) for pattern in exclude or []}
+    path = os.path.normpath(path)
+    while path and path not in (os.curdir, os.sep):
+        if any(fnmatch.fnmatch(path, pattern) for pattern in exclude):
+            return True
+        path = os.path.dirname(path)
+    return False
+
+
+def find_in_files(files, base_dir=".", exclude=None):
+    """
+    Like find_in_dir, but only in the given files (those which are Python
+    files inside base_dir).
+    """
+    base_dir = os.path.abspath(base_dir)
+    for filename in sorted(files):
+        if not filename.endswith(".py") or not os.path.isfile(filename):
+            continue
+        if os.path.commonpath([base_dir, os.path.abspath(filename)]) != base_dir:
+            continue
+        if is_excluded(filename, exclude):
+            continue
+        yield from find_in_file(os.path.normpath(filename))
+
+
 def find_in_dir(base_dir=".", exclude=None):
     for python_file in list_python_files(base_dir, exclude=exclude):
         yield from find_in_file(python_file)
@@ -0,0 +1,305 @@
+"""
+Every network call goes through a session created by get_session. Those
+sessions use a private HTTP cache, stored on disk, that follows Cache-Control
+and revalidates expired responses using ETag and Last-Modified. Requests with
+"Cache-Control: no-cache" or "no-store" go straight to the network, and their
+responses are not stored.
+
+When running offline, responses are only read from the cache, even expired,
+and a missing one raises OfflineCacheMiss.
+
+Identical requests made at the same time by different threads are merged
+into a single one, and the number of simultaneous connections to each host
+is limited.
+"""
+
+from __future__ import annotations
+
+import base64
+import contextlib
+import copy
+import email.utils
+import functools
+import hashlib
+import logging
+import threading
+import urllib.parse
+from concurrent.futures import Future
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from raincoat import settings
+from raincoat.cache import Cache, get_cache_dir
+from raincoat.exceptions import OfflineCacheMiss
+
+logger = logging.getLogger(__name__)
+
+# These describe the content as it was transferred, but we store it decoded.
+TRANSFER_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+CONDITIONAL_HEADERS = {"if-none-match", "if-modified-since"}
+BYPASS_DIRECTIVES = {"no-cache", "no-store"}
+
+
+def parse_cache_control(headers):
+    directives = {}
+    for directive in headers.get("Cache-Control", "").split(","):
+        name, __, value = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def get_max_age(headers):
+    """
+    Number of seconds during which the response can be used without
+    revalidation.
+    """
+    directives = parse_cache_control(headers)
+    if "no-cache" in directives:
+        return 0
+    try:
+        return max(0, int(directives["max-age"]))
+    except (KeyError, ValueError):
+        pass
+
+    try:
+        expires = email.utils.parsedate_to_datetime(headers["Expires"])
+        date = email.utils.parsedate_to_datetime(headers["Date"])
+    except (KeyError, TypeError, ValueError):
+        return 0
+    return max(0, int((expires - date).total_seconds()))
+
+
+def is_cacheable(response):
+    if response.status_code != 200:
+        return False
+    if "no-store" in parse_cache_control(response.headers):
+        return False
+    return bool(
+        get_max_age(response.headers)
+        or "ETag" in response.headers
+        or "Last-Modified" in response.headers
+    )
+
+
+def get_cache_key(request):
+    # Responses may differ depending on who asks for them, but we don't want the
+    # credentials in clear in the cache.
+    authorization = request.headers.get("Authorization", "")
+    vary = hashlib.sha256(
+        "\n".join([authorization, request.headers.get("Accept", "")]).encode()
+    ).hexdigest()[:16]
+    return f"{request.method} {request.url} {vary}"
+
+
+def serialize_response(response):
+    return {
+        "url": response.url,
+        "status_code": response.status_code,
+        "reason": response.reason,
+        "headers": {
+            key: value
+            for key, value in response.headers.items()
+            if key.lower() not in TRANSFER_HEADERS
+        },
+        "content": base64.b64encode(response.content).decode("ascii"),
+    }
+
+
+def deserialize_response(request, value):
+    response = requests.Response()
+    response.url = value["url"]
+    response.status_code = value["status_code"]
+    response.reason = value["reason"]
+    response.headers = CaseInsensitiveDict(value["headers"])
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = base64.b64decode(value["content"])
+    response.request = request
+    response.from_cache = True  # type: ignore
+    return response
+
+
+class SingleFlight:
+    """
+    Merges identical calls running at the same time: the first caller does
+    the work, the others wait for its result.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function):
+        """
+        Returns a tuple (result, shared), shared being True if the result was
+        computed for another caller.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = function()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+class HostLimiter:
+    """
+    Limits the number of simultaneous connections to each host, so that
+    running checks in parallel doesn't look like abuse to the servers.
+    """
+
+    def __init__(self, max_connections=None):
+        self.max_connections = max_connections or settings.get(
+            "max_connections_per_host"
+        )
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    @contextlib.contextmanager
+    def limit(self, host):
+        with self.lock:
+            semaphore = self.semaphores.setdefault(
+                host, threading.BoundedSemaphore(self.max_connections)
+            )
+        with semaphore:
+            yield
+
+
+# Shared by all the sessions
+single_flight = SingleFlight()
+host_limiter = HostLimiter()
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    Transport adapter implementing a private HTTP cache for GET requests,
+    and sharing the responses of identical concurrent requests.
+    """
+
+    def __init__(self, cache=None, shared=False, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache or Cache("http")
+        # Shared adapters keep their connections open when the session closes.
+        self.shared = shared
+
+    def close(self):
+        if not self.shared:
+            super().close()
+
+    def send(self, request, **kwargs):
+        if (
+            request.method != "GET"
+            or CONDITIONAL_HEADERS & {key.lower() for key in request.headers}
+            or BYPASS_DIRECTIVES & set(parse_cache_control(request.headers))
+        ):
+            return self.send_network(request, **kwargs)
+
+        key = get_cache_key(request)
+        response, shared = single_flight.do(
+            key, functools.partial(self.send_cached, request, key, **kwargs)
+        )
+        if shared:
+            # Each caller gets its own copy (the content has already been read).
+            # It didn't cost this caller a request, so it counts as cached.
+            response = copy.copy(response)
+            response.request = request
+            response.from_cache = True  # type: ignore
+        return response
+
+    def send_network(self, request, **kwargs):
+        if settings.is_offline():
+            raise OfflineCacheMiss(
+                f"{request.method} {request.url} is not in the cache (offline)"
+            )
+        host = urllib.parse.urlsplit(request.url).hostname
+        with host_limiter.limit(host):
+            response = super().send(request, **kwargs)
+            if not kwargs.get("stream"):
+                # Release the connection before leaving the slot.
+                response.content
+        return response
+
+    def send_cached(self, request, key, **kwargs):
+        entry = self.cache.get_entry(key)
+
+        if entry is not None:
+            if entry.is_fresh() or settings.is_offline():
+                logger.debug(f"HTTP cache hit for {request.url}")
+                return deserialize_response(request, entry.value)
+
+            headers = CaseInsensitiveDict(entry.value["headers"])
+            if "ETag" in headers:
+                request.headers["If-None-Match"] = headers["ETag"]
+            if "Last-Modified" in headers:
+                request.headers["If-Modified-Since"] = headers["Last-Modified"]
+
+        response = self.send_network(request, **kwargs)
+
+        if entry is not None and response.status_code == 304:
+            logger.debug(f"HTTP cache revalidated {request.url}")
+            cached = deserialize_response(request, entry.value)
+            cached.headers.update(
+                (key, value)
+                for key, value in response.headers.items()
+                if key.lower() not in TRANSFER_HEADERS
+            )
+            self.store(key, cached)
+            # The content comes from the cache, but we did go through the network.
+            cached.from_cache = False  # type: ignore
+            return cached
+
+        if is_cacheable(response):
+            self.store(key, response)
+
+        return response
+
+    def store(self, key, response):
+        self.cache.set(
+            key, serialize_response(response), ttl=get_max_age(response.headers)
+        )
+
+
+# The daemon sets this to a dict (cache directory > adapter), so that the
+# connections are reused from one run to the next.
+shared_adapters: dict | None = None
+
+
+def get_adapter():
+    if shared_adapters is None:
+        return CachingAdapter()
+
+    directory = get_cache_dir()
+    if directory not in shared_adapters:
+        shared_adapters[directory] = CachingAdapter(
+            cache=Cache("http", directory=directory), shared=True
+        )
+    return shared_adapters[directory]
+
+
+def mount_cache(session):
+    adapter = get_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def get_session():
+    session = requests.Session()
+    mount_cache(session)
+    return session
@@ -0,0 +1,88 @@
+"""
+Reverse index: dependency (package or repository) > files with comments about
+it, kept in the cache for each scanned directory.
+
+Updating it only needs to read the files that were modified since the last
+time (detected through their size and modification time), so that finding
+the comments affected by a dependency change doesn't read the whole tree.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+
+from raincoat import grep
+from raincoat.cache import Cache
+from raincoat.utils import normalize_name
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_dependency(name):
+    # Repositories (owner/name) are kept as-is, package names are normalized.
+    if "/" in name:
+        return name
+    return normalize_name(name)
+
+
+def get_stat(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def get_dependencies(matches):
+    return sorted(
+        {dependency for match in matches for dependency in match.get_dependencies()}
+    )
+
+
+class ScanIndex:
+    def __init__(self, base_dir=".", exclude=None):
+        self.base_dir = base_dir
+        self.exclude = exclude or []
+        self.cache = Cache("scan-index")
+        self.key = "{} {}".format(
+            os.path.abspath(base_dir), " ".join(sorted(self.exclude))
+        )
+
+    def update(self):
+        """
+        Return a dict: file > {"stat": ..., "dependencies": [...]}, after
+        reading the files that changed.
+        """
+        previous = self.cache.get(self.key) or {}
+        files = {}
+        read = 0
+        for path in grep.list_python_files(self.base_dir, exclude=self.exclude):
+            try:
+                stat = get_stat(path)
+            except OSError:
+                continue
+            entry = previous.get(path)
+            if entry is None or entry["stat"] != stat:
+                read += 1
+                entry = {
+                    "stat": stat,
+                    "dependencies": get_dependencies(grep.find_in_file(path)),
+                }
+            files[path] = entry
+
+        logger.debug(f"Scan index of {self.base_dir}: read {read}/{len(files)} files")
+        if files != previous:
+            self.cache.set(self.key, files)
+        return files
+
+    def find_affected(self, dependencies):
+        """
+        Yield the matches that depend on one of the given dependencies.
+        """
+        dependencies = {normalize_dependency(name) for name in dependencies}
+        if not dependencies:
+            return
+        for path, entry in sorted(self.update().items()):
+            if dependencies.isdisjoint(entry["dependencies"]):
+                continue
+            for match in grep.find_in_file(path):
+                if match.get_dependencies() & dependencies:
+                    yield match
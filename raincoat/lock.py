@@ -0,0 +1,105 @@
+"""
+The lockfile (raincoat.lock) records what "current" resolved to: latest
+versions of packages that are not installed, heads of branches, and hashes
+of the code elements. When it exists, checks use it instead of resolving
+again, so that they don't depend on the network or on the time of day.
+
+Entries that are missing are resolved and added. --update-lock starts from
+an empty lockfile, so that everything is resolved again.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from raincoat import settings
+
+logger = logging.getLogger(__name__)
+
+SECTIONS = ("versions", "branches", "elements")
+
+
+class Lock:
+    def __init__(self, path, content=None):
+        self.path = path
+        self.content = {section: {} for section in SECTIONS}
+        for section, values in (content or {}).items():
+            if section in self.content:
+                self.content[section].update(values)
+        self.modified = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as handler:
+            return cls(path, json.load(handler))
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as handler:
+                json.dump(self.content, handler, indent=2, sort_keys=True)
+                handler.write("\n")
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.modified = False
+
+    def get(self, section, key):
+        with self.lock:
+            return self.content[section].get(key)
+
+    def set(self, section, key, value):
+        with self.lock:
+            if self.content[section].get(key) != value:
+                self.content[section][key] = value
+                self.modified = True
+
+
+def hash_element(element):
+    return hashlib.sha256(json.dumps(element).encode("utf-8")).hexdigest()
+
+
+current: Lock | None = None
+
+
+def get_lock():
+    """
+    Return the Lock of the run, or None if there's no lockfile.
+    """
+    return current
+
+
+@contextlib.contextmanager
+def use_lock():
+    """
+    Load the lockfile (if it exists or we were asked to update it) for the
+    duration of the run, and save it at the end if it changed.
+    """
+    global current
+
+    path = settings.get("lock")
+    if settings.get("update_lock"):
+        lock = Lock(path)
+        lock.modified = True
+    elif os.path.exists(path):
+        lock = Lock.load(path)
+    else:
+        lock = None
+
+    previous, current = current, lock
+    try:
+        yield lock
+        if lock is not None and lock.modified:
+            logger.info(f"Writing {path}")
+            lock.save()
+    finally:
+        current = previous
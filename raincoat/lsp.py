@@ -0,0 +1,288 @@
+"""
+raincoat lsp: a language server (over stdin/stdout) publishing the results of
+the Raincoat comments of the open Python files as diagnostics, so that editors
+show them inline.
+
+Typing never waits for a check: the verdicts already known (by comment,
+wherever it is in the file) are published right away, and the new comments
+are checked in a background thread, once the document has stopped changing
+for a moment. Saving a document checks its comments again.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import urllib.parse
+from operator import itemgetter
+
+from raincoat import glue, grep
+from raincoat.match import Unknown, check_matches
+from raincoat.watch import get_signature
+
+logger = logging.getLogger(__name__)
+
+# Seconds without changes before a document is checked
+DEBOUNCE = 0.5
+
+SEVERITY_WARNING = 2
+SEVERITY_INFORMATION = 3
+# Full documents are sent on every change
+SYNC_FULL = 1
+METHOD_NOT_FOUND = -32601
+
+
+def read_message(stream):
+    """
+    Return the next message, or None at the end of the stream.
+    """
+    headers = {}
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.decode("ascii").strip()
+        if not line:
+            break
+        name, __, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    content = stream.read(int(headers["content-length"]))
+    return json.loads(content)
+
+
+def write_message(stream, message):
+    content = json.dumps(message).encode("utf-8")
+    stream.write(f"Content-Length: {len(content)}\r\n\r\n".encode("ascii"))
+    stream.write(content)
+    stream.flush()
+
+
+def uri_to_path(uri):
+    parsed = urllib.parse.urlparse(uri)
+    if parsed.scheme != "file":
+        return None
+    path = urllib.parse.unquote(parsed.path)
+    try:
+        relative = os.path.relpath(path)
+    except ValueError:
+        # Another drive, on Windows
+        return path
+    return path if relative.startswith(os.pardir) else relative
+
+
+def get_diagnostic(match, error, text):
+    lines = text.splitlines()
+    line = match.lineno - 1
+    length = len(lines[line]) if line < len(lines) else 0
+    return {
+        "range": {
+            "start": {"line": line, "character": 0},
+            "end": {"line": line, "character": length},
+        },
+        "severity": (
+            SEVERITY_INFORMATION if isinstance(error, Unknown) else SEVERITY_WARNING
+        ),
+        "source": "raincoat",
+        "message": error.strip(),
+    }
+
+
+class Server:
+    def __init__(self, input, output, debounce=DEBOUNCE):
+        self.input = input
+        self.output = output
+        self.debounce = debounce
+        # uri > text
+        self.documents = {}
+        # signature of a comment > error (None if the match is fine)
+        self.verdicts = {}
+        # uri > time at which it should be checked
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.stopped = False
+        self.shutdown_requested = False
+        self.worker = threading.Thread(target=self.work, daemon=True)
+
+    def send(self, message):
+        with self.write_lock:
+            write_message(self.output, {"jsonrpc": "2.0", **message})
+
+    def serve(self):
+        """
+        Handle the messages until "exit". Return the exit code.
+        """
+        self.worker.start()
+        try:
+            while True:
+                message = read_message(self.input)
+                if message is None or message.get("method") == "exit":
+                    break
+                self.handle(message)
+        finally:
+            with self.condition:
+                self.stopped = True
+                self.condition.notify()
+            self.worker.join()
+        return 0 if self.shutdown_requested else 1
+
+    def handle(self, message):
+        method = message.get("method")
+        params = message.get("params") or {}
+        handler = getattr(self, "on_" + (method or "").replace("/", "_"), None)
+
+        if "id" not in message:
+            # A notification
+            if handler is not None:
+                handler(params)
+            return
+
+        if handler is None:
+            self.send(
+                {
+                    "id": message["id"],
+                    "error": {
+                        "code": METHOD_NOT_FOUND,
+                        "message": f"{method} is not supported",
+                    },
+                }
+            )
+            return
+        self.send({"id": message["id"], "result": handler(params)})
+
+    def on_initialize(self, params):
+        return {
+            "capabilities": {
+                "textDocumentSync": {
+                    "openClose": True,
+                    "change": SYNC_FULL,
+                    "save": True,
+                }
+            },
+            "serverInfo": {"name": "raincoat"},
+        }
+
+    def on_shutdown(self, params):
+        self.shutdown_requested = True
+        return None
+
+    def on_textDocument_didOpen(self, params):
+        document = params["textDocument"]
+        self.update(document["uri"], document["text"])
+
+    def on_textDocument_didChange(self, params):
+        changes = params["contentChanges"]
+        if changes:
+            self.update(params["textDocument"]["uri"], changes[-1]["text"])
+
+    def on_textDocument_didSave(self, params):
+        uri = params["textDocument"]["uri"]
+        text = self.documents.get(uri)
+        if text is None:
+            return
+        # The code they talk about may have changed since they were checked.
+        for match in self.find_matches(uri, text):
+            self.verdicts.pop(get_signature(match), None)
+        self.schedule(uri)
+
+    def on_textDocument_didClose(self, params):
+        uri = params["textDocument"]["uri"]
+        with self.condition:
+            self.documents.pop(uri, None)
+            self.pending.pop(uri, None)
+        self.send(
+            {
+                "method": "textDocument/publishDiagnostics",
+                "params": {"uri": uri, "diagnostics": []},
+            }
+        )
+
+    def update(self, uri, text):
+        if uri_to_path(uri) is None:
+            return
+        with self.condition:
+            self.documents[uri] = text
+        self.publish(uri, text)
+        self.schedule(uri)
+
+    def schedule(self, uri):
+        with self.condition:
+            self.pending[uri] = time.monotonic() + self.debounce
+            self.condition.notify()
+
+    def find_matches(self, uri, text):
+        return list(grep.find_in_string(text, uri_to_path(uri)))
+
+    def publish(self, uri, text):
+        """
+        Publish the verdicts we know, without checking anything.
+        """
+        diagnostics = []
+        for match in self.find_matches(uri, text):
+            error = self.verdicts.get(get_signature(match))
+            if error is not None:
+                diagnostics.append(get_diagnostic(match, error, text))
+        self.send(
+            {
+                "method": "textDocument/publishDiagnostics",
+                "params": {"uri": uri, "diagnostics": diagnostics},
+            }
+        )
+
+    def work(self):
+        while True:
+            with self.condition:
+                if self.stopped:
+                    return
+                if not self.pending:
+                    self.condition.wait()
+                    continue
+                uri, when = min(self.pending.items(), key=itemgetter(1))
+                delay = when - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                del self.pending[uri]
+                text = self.documents.get(uri)
+
+            if text is None:
+                continue
+            try:
+                self.check(uri, text)
+            except Exception:
+                logger.exception(f"Error while checking {uri}")
+
+    def check(self, uri, text):
+        # Taken before checking: the checkers store things on the matches.
+        signatures = {
+            id(match): (match, get_signature(match))
+            for match in self.find_matches(uri, text)
+        }
+        matches = [
+            match
+            for match, signature in signatures.values()
+            if signature not in self.verdicts
+        ]
+        if matches:
+            errors = {
+                id(match): error
+                for error, match in check_matches(glue.group_matches(matches))
+            }
+            for match in matches:
+                self.verdicts[signatures[id(match)][1]] = errors.get(id(match))
+
+        with self.condition:
+            # Otherwise, it will be checked again soon.
+            up_to_date = self.documents.get(uri) == text
+        if up_to_date:
+            self.publish(uri, text)
+
+
+def serve(input=None, output=None):
+    server = Server(input or sys.stdin.buffer, output or sys.stdout.buffer)
+    return server.serve()
@@ -1,37 +1,46 @@
 """
 All different types of matches.
 
-When coded, every new type of match should be added
-in the match_classes list at the end of this file
+Match types are registered through the "raincoat.match" entry point group.
+Only the names of the entry points are read when the registry is built: the
+match class itself is imported the first time a comment of this type is seen.
 """
 
 from __future__ import annotations
 
 import logging
 import sys
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from itertools import count
-from typing import Iterable
-
-from typing_extensions import Protocol
+from typing import Iterable, Protocol
 
 from raincoat.exceptions import NotMatching  # TODO
 
-if sys.version_info < (3, 10):
-    import importlib_metadata
-else:
-    from importlib import metadata as importlib_metadata
+logger = logging.getLogger(__name__)
 
 
-logger = logging.getLogger(__name__)
+class Unknown(str):
+    """
+    A result telling that a match could not be checked (e.g. running offline
+    without the data in the cache), rather than an inconsistency.
+    """
 
 
 class Checker(Protocol):
     def check(self, matches: Match) -> Iterable[Match]: ...
 
+    # Checkers may also implement fetch(matches), filling the caches with
+    # everything check needs, without checking anything. If they don't, check
+    # is run and its results ignored.
+
 
 class Match:
     match_type = None  # Will dynamically be given the name of the entrypoint
     checker: type[Checker] | None = None
+    # The (sorted) arguments of the comment, set by match_from_comment. Unlike
+    # the attributes, checkers never change them.
+    arguments: tuple = ()
 
     def __init__(self, filename, lineno):
         self.filename = filename
@@ -40,6 +49,21 @@ class Match:
     def __str__(self):
         return f"Match in {self.filename}:{self.lineno}"
 
+    def get_dependencies(self):
+        """
+        Names of the packages (normalized) or repositories (owner/name) this
+        match depends on: when their version changes in the requirements, or
+        with --affected-by, the match is checked again.
+        """
+        return set()
+
+    def get_shard_key(self):
+        """
+        With --shard, matches with the same key are checked by the same job.
+        Matches needing the same source should have the same key.
+        """
+        return f"{self.match_type} {self.filename}"
+
     def format(self, message, color):
         message = message.strip()
         result = ""
@@ -69,14 +93,17 @@ def match_from_comment(match_type, filename, lineno, **kwargs):
     creates a match
     """
     try:
-        return match_types[match_type](filename, lineno, **kwargs)
+        match_class = get_match_types()[match_type]
     except KeyError:
         raise NotMatching
+    match = match_class(filename, lineno, **kwargs)
+    match.arguments = tuple(sorted(kwargs.items()))
+    return match
 
 
 def check_matches(matches):
     for match_type, matches_for_type in matches.items():
-        match_class = match_types[match_type]
+        match_class = get_match_types()[match_type]
         checker = match_class.checker
 
         if checker is None:
@@ -85,29 +112,122 @@ def check_matches(matches):
         yield from checker().check(matches_for_type)
 
 
+def fetch_matches(matches):
+    """
+    Fetch the data of all the match types concurrently.
+    """
+    with ThreadPoolExecutor() as executor:
+        futures = [
+            executor.submit(fetch_matches_for_type, match_type, matches_for_type)
+            for match_type, matches_for_type in matches.items()
+        ]
+        for future in futures:
+            future.result()
+
+
+def fetch_matches_for_type(match_type, matches):
+    match_class = get_match_types()[match_type]
+    checker = match_class.checker
+
+    if checker is None:
+        raise NotImplementedError(f"{match_class} has no checker")
+
+    checker_instance = checker()
+    fetch = getattr(checker_instance, "fetch", None)
+    if fetch is not None:
+        fetch(matches)
+    else:
+        for __ in checker_instance.check(matches):
+            pass
+
+
 def get_match_entrypoints():
+    if sys.version_info < (3, 10):
+        import importlib_metadata
+    else:
+        from importlib import metadata as importlib_metadata
+
     return importlib_metadata.entry_points(group="raincoat.match")
 
 
-def compute_match_types():
-    # Even builtin match types are defined using the entry points.
-    match_types = {}
-    for match_entry_point in get_match_entrypoints():
-        match_type = match_entry_point.name
-        match_class = match_entry_point.load()
+class MatchTypes(MutableMapping):
+    """
+    Registry of the match types: maps the match type name to the Match subclass.
+
+    Entry points are only loaded on first access, so that a slow or broken plugin
+    costs nothing unless a comment of its type is found.
+    """
+
+    def __init__(self, entry_points):
+        self.entry_points = {}
+        self.loaded = {}
+
+        for entry_point in entry_points:
+            match_type = entry_point.name
+            if match_type in self.entry_points:
+                logger.warning(
+                    "Several classes registered for the match type {}. "
+                    "{} will be ignored, {} will be used."
+                    "".format(
+                        match_type,
+                        entry_point.value,
+                        self.entry_points[match_type].value,
+                    )
+                )
+                continue
+
+            self.entry_points[match_type] = entry_point
+
+    def __getitem__(self, match_type):
+        try:
+            return self.loaded[match_type]
+        except KeyError:
+            pass
+
+        # Raises KeyError for unknown match types
+        entry_point = self.entry_points[match_type]
+        logger.debug(f"Loading match type {match_type} from {entry_point.value}")
+        match_class = entry_point.load()
         match_class.match_type = match_type
+        self.loaded[match_type] = match_class
+        return match_class
+
+    def __setitem__(self, match_type, match_class):
+        self.loaded[match_type] = match_class
 
-        if match_type in match_types:
-            logger.warning(
-                "Several classes registered for the match type {}. "
-                "{} will be ignored, {} will be used."
-                "".format(match_type, match_class, match_types[match_type])
-            )
-            continue
+    def __delitem__(self, match_type):
+        found = False
+        for mapping in (self.loaded, self.entry_points):
+            if match_type in mapping:
+                del mapping[match_type]
+                found = True
+        if not found:
+            raise KeyError(match_type)
 
-        match_types[match_type] = match_class
+    def __iter__(self):
+        yield from self.entry_points
+        yield from (key for key in self.loaded if key not in self.entry_points)
 
-    return match_types
+    def __len__(self):
+        return len(set(self.entry_points) | set(self.loaded))
+
+
+def compute_match_types():
+    # Even builtin match types are defined using the entry points.
+    return MatchTypes(get_match_entrypoints())
+
+
+def get_match_types():
+    # The registry is only built when the first Raincoat comment is found.
+    global match_types
+    try:
+        return match_types
+    except NameError:
+        match_types = compute_match_types()
+        return match_types
 
 
-match_types = compute_match_types()
+def __getattr__(name):
+    if name == "match_types":
+        return get_match_types()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
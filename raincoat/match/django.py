@@ -1,82 +1,271 @@
 from __future__ import annotations
 
+import hashlib
+import logging
+import math
+import os
 import re
+import subprocess
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 
-from raincoat import github_utils, source
-from raincoat.match import Match, NotMatching
+from raincoat import github_utils, settings, source
+from raincoat.cache import Cache
+from raincoat.exceptions import OfflineCacheMiss, RaincoatException
+from raincoat.match import Match, NotMatching, Unknown
 
+logger = logging.getLogger(__name__)
 
-def get_merge_commit_sha1(ticket, session):
-    # This is an adaptation of
-    # https://github.com/django/code.djangoproject.com/blob/
-    # cad96e2d980fc0453b34dd3d17ce6cb895e1aa89/trac-env/htdocs/
-    # tickethacks.js#L99-L209
+SEARCH_URL = "https://api.github.com/search/issues?q="
+# GitHub search queries accept at most 5 AND/OR/NOT operators
+TICKETS_PER_SEARCH = 6
+# Number of tickets whose PRs are inspected simultaneously
+MAX_WORKERS = 8
+# Tickets that are not merged may be merged later
+UNMERGED_TICKET_TTL = 60 * 60
+# Listing all the commits of a release takes a few hundred requests, but then
+# any commit can be checked for free. Below this number of commits to check,
+# it's cheaper to compare them one by one.
+RELEASE_COMMITS_THRESHOLD = 300
 
-    # This is definitely the place where we could USE raincoat
-    # ... But there's not yet raincoat comments for github
-    # and this code is not released in PyPI
-    ticket = int(ticket)
-    pr_title_patterns = ["#{} ", "#{},", "#{}:", "#{})"]
-    url = "https://api.github.com/search/issues?q="
-    args = "repo:django/django+state:closed+in:title+type:pr+"
-    args += "+".join(pattern.format(ticket) for pattern in pr_title_patterns)
-    response = session.get(url + urllib.parse.quote(args, safe="+:"))
-    response.raise_for_status()
-    search_results = response.json()
+pr_title_regex = re.compile(r"#(\d+)\b")
+merged_regex = re.compile(r"(?:merged|fixed) in \b([0-9a-f]{6,40})\b")
 
-    merged_regex = re.compile(r"(?:merged|fixed) in \b([0-9a-f]{6,40})\b")
 
-    for pr in search_results["items"]:
-        number = pr["number"]
+def search_ticket_prs(tickets, session):
+    """
+    Find the closed PRs mentioning each ticket in their title, using one
+    search query for several tickets.
 
-        if number == ticket:
-            # skip this element if PR id == ticket id
-            continue
+    Returns a dict: ticket > list of PR numbers, in the search results order.
+    """
+    tickets = sorted({int(ticket) for ticket in tickets})
+    prs = {ticket: [] for ticket in tickets}
 
-        merged = (
-            session.get(
-                "https://api.github.com/repos/django/django/pulls/{}/merge".format(
-                    number
-                )
-            ).status_code
-            == 204
-        )
+    for i in range(0, len(tickets), TICKETS_PER_SEARCH):
+        batch = tickets[i : i + TICKETS_PER_SEARCH]
+        args = "repo:django/django+state:closed+in:title+type:pr+"
+        args += "+OR+".join(f"#{ticket}" for ticket in batch)
+        url = SEARCH_URL + urllib.parse.quote(args, safe="+:") + "&per_page=100"
 
-        if merged:
-            response = session.get(
-                f"https://api.github.com/repos/django/django/pulls/{number}"
-            )
+        while url:
+            response = session.get(url, priority=github_utils.NORMAL)
             response.raise_for_status()
-            pr_details = response.json()
 
-            return pr_details["merge_commit_sha"]
+            for pr in response.json()["items"]:
+                number = pr["number"]
+                in_title = {int(t) for t in pr_title_regex.findall(pr["title"])}
+                for ticket in in_title.intersection(batch):
+                    # skip this element if PR id == ticket id
+                    if number != ticket:
+                        prs[ticket].append(number)
 
-        # Check if the PR was merged manually
+            url = response.links.get("next", {}).get("url")
+
+    return prs
+
+
+def get_pr_merge_commit_sha1(number, session):
+    """
+    Return the sha1 of the commit that merged the PR, or None if it was
+    not merged.
+    """
+    merged = (
+        session.get(
+            "https://api.github.com/repos/django/django/pulls/{}/merge".format(number),
+            priority=github_utils.NORMAL,
+        ).status_code
+        == 204
+    )
+
+    if merged:
         response = session.get(
-            "https://api.github.com/repos/django/django/issues/{}/comments".format(
-                number
-            )
+            f"https://api.github.com/repos/django/django/pulls/{number}",
+            priority=github_utils.NORMAL,
         )
         response.raise_for_status()
-        comments = response.json()
-        for comment in comments:
-            merged_in = merged_regex.search(comment["body"])
-            if merged_in:
-                return merged_in.group(1)
+        pr_details = response.json()
+
+        return pr_details["merge_commit_sha"]
+
+    # Check if the PR was merged manually
+    response = session.get(
+        "https://api.github.com/repos/django/django/issues/{}/comments".format(number),
+        # Manual merges are rare, this is the least useful request
+        priority=github_utils.LOW,
+    )
+    response.raise_for_status()
+    comments = response.json()
+    for comment in comments:
+        merged_in = merged_regex.search(comment["body"])
+        if merged_in:
+            return merged_in.group(1)
+
+    return None
+
+
+def find_merge_commit_sha1(prs, session):
+    for number in prs:
+        sha1 = get_pr_merge_commit_sha1(number, session)
+        if sha1:
+            return sha1
+    return None
+
+
+def get_merge_commit_sha1s(tickets, session):
+    """
+    Return a dict: ticket > sha1 of the commit that fixed it (or None).
+
+    Tickets are searched in batches, then the PRs of each ticket are
+    inspected concurrently.
+    """
+    # This is an adaptation of
+    # https://github.com/django/code.djangoproject.com/blob/
+    # cad96e2d980fc0453b34dd3d17ce6cb895e1aa89/trac-env/htdocs/
+    # tickethacks.js#L99-L209
+
+    # This is definitely the place where we could USE raincoat
+    # ... But there's not yet raincoat comments for github
+    # and this code is not released in PyPI
+    prs = search_ticket_prs(tickets, session)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        sha1s = executor.map(
+            lambda ticket_prs: find_merge_commit_sha1(ticket_prs, session),
+            prs.values(),
+        )
+        return dict(zip(prs, sha1s))
+
+
+def get_merge_commit_sha1(ticket, session):
+    return get_merge_commit_sha1s([ticket], session)[int(ticket)]
 
 
 def is_commit_in_version(commit, version, session):
     url = "https://api.github.com/repos/django/django/compare/{}...{}" "".format(
         commit, version
     )
-    response = session.get(url)
+    response = session.get(url, priority=github_utils.HIGH)
     response.raise_for_status()
     diff = response.json()
     return not diff.get("status") == "diverged"
 
 
+def are_commits_in_version(commits, version, session):
+    """
+    Return a dict: commit > whether it is in the given version, checked
+    concurrently.
+    """
+    commits = list(commits)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = executor.map(
+            lambda commit: is_commit_in_version(commit, version, session), commits
+        )
+        return dict(zip(commits, results))
+
+
+def get_commits_in_version(version, session):
+    """
+    Return the set of all the commits reachable from the version, paging
+    through the commits API.
+    """
+    url = (
+        "https://api.github.com/repos/django/django/commits?sha={}&per_page=100".format(
+            version
+        )
+    )
+    commits = set()
+    while url:
+        response = session.get(url)
+        response.raise_for_status()
+        commits.update(commit["sha"] for commit in response.json())
+        url = response.links.get("next", {}).get("url")
+    return commits
+
+
+class LocalDjangoRepository:
+    """
+    Resolves tickets using a local clone of Django (RAINCOAT_DJANGO_REPO),
+    without any network call.
+
+    Commit messages are scanned once for "Fixed #NNNN" into an index
+    ticket > commits, kept in the cache as long as the refs of the clone
+    don't change. A ticket is fixed in a version if one of its commits
+    (on main or backported) is an ancestor of the release tag.
+    """
+
+    fixed_regex = re.compile(r"\bFixed\s+((?:#\d+[\s,]*(?:and\s+)?)+)", re.IGNORECASE)
+    ticket_regex = re.compile(r"#(\d+)")
+
+    def __init__(self, path):
+        self.path = path
+
+    def git(self, *args, check=True):
+        result = subprocess.run(
+            ["git", "-C", self.path, *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if check and result.returncode != 0:
+            raise RaincoatException(
+                "Error while running git {} in {}: {}".format(
+                    " ".join(args), self.path, result.stderr.decode("utf-8").strip()
+                )
+            )
+        return result
+
+    def get_index(self):
+        refs = self.git("show-ref").stdout
+        key = "{} {}".format(
+            os.path.abspath(self.path), hashlib.sha256(refs).hexdigest()
+        )
+        cache = Cache("django-local-index")
+        index = cache.get(key)
+        if index is None:
+            index = self.build_index()
+            cache.set(key, index)
+        return index
+
+    def build_index(self):
+        logger.info(f"Indexing the Django tickets of {self.path}")
+        # Commits are separated by a NUL byte, the sha1 is on the first line.
+        log = self.git("log", "--all", "--format=%H%n%B%x00").stdout.decode("utf-8")
+        index = {}
+        for commit in log.split("\0"):
+            sha1, __, message = commit.strip().partition("\n")
+            for fixed in self.fixed_regex.findall(message):
+                for ticket in self.ticket_regex.findall(fixed):
+                    index.setdefault(ticket, []).append(sha1)
+        return index
+
+    def get_commits_in_version(self, version):
+        """
+        Return the set of all the commits that are part of the version.
+        """
+        result = self.git("rev-list", version, "--", check=False)
+        if result.returncode != 0:
+            raise RaincoatException(
+                "Could not find Django {} in {}: {}".format(
+                    version, self.path, result.stderr.decode("utf-8").strip()
+                )
+            )
+        return set(result.stdout.decode("utf-8").split())
+
+    def get_tickets_in_version(self, tickets, version):
+        index = self.get_index()
+        in_version = self.get_commits_in_version(version)
+        return {
+            ticket
+            for ticket in tickets
+            if in_version.intersection(index.get(str(ticket), []))
+        }
+
+
 class DjangoChecker:
+    def __init__(self):
+        # version > set of commits, for the duration of the run
+        self.release_commits = {}
+
     def get_match_info(self, matches):
         info = {}
         for match in matches:
@@ -84,25 +273,175 @@ class DjangoChecker:
         return info
 
     def check(self, matches):
-        __, django_version = source.get_current_or_latest_version("django")
+        matches = list(matches)
+        try:
+            __, django_version = source.get_current_or_latest_version("django")
+        except OfflineCacheMiss as exc:
+            return [
+                (Unknown(f"Could not be checked: {exc}"), match) for match in matches
+            ]
 
         match_info = self.get_match_info(matches)
 
         return self.check_matches(match_info, django_version)
 
+    def fetch(self, matches):
+        __, django_version = source.get_current_or_latest_version("django")
+        self.get_tickets_in_version(self.get_match_info(matches), django_version)
+
     def check_matches(self, match_info, django_version):
+        merged, unknown = self.get_tickets_in_version(match_info, django_version)
+
+        for ticket, ticket_matches in match_info.items():
+            if ticket in unknown:
+                for match in ticket_matches:
+                    yield (
+                        Unknown(
+                            "Could not be checked: ticket #{} is not in the "
+                            "cache".format(ticket)
+                        ),
+                        match,
+                    )
+            elif ticket in merged:
+                for match in ticket_matches:
+                    yield (
+                        "Ticket #{} has been merged in Django {}".format(
+                            ticket, django_version
+                        ),
+                        match,
+                    )
+
+    def get_tickets_in_version(self, tickets, version):
+        """
+        Return the set of tickets that were fixed in the given version, and
+        the set of tickets we couldn't check (running offline).
+        """
+        repo_path = settings.get("django_repo")
+        if repo_path:
+            local_repository = LocalDjangoRepository(repo_path)
+            return local_repository.get_tickets_in_version(tickets, version), set()
+
         with github_utils.get_session() as session:
-            for ticket, ticket_matches in match_info.items():
-                sha1 = get_merge_commit_sha1(ticket, session)
-                if sha1:
-                    if is_commit_in_version(sha1, django_version, session):
-                        for match in ticket_matches:
-                            yield (
-                                "Ticket #{} has been merged in Django {}".format(
-                                    ticket, django_version
-                                ),
-                                match,
-                            )
+            sha1s = self.get_merge_commit_sha1s(tickets, session)
+            in_version = self.are_commits_in_version(
+                set(sha1s.values()) - {None}, version, session
+            )
+
+        merged = {ticket for ticket, sha1 in sha1s.items() if in_version.get(sha1)}
+        unknown = {
+            ticket
+            for ticket in tickets
+            if ticket not in sha1s
+            or (sha1s[ticket] and sha1s[ticket] not in in_version)
+        }
+        return merged, unknown
+
+    def get_merge_commit_sha1s(self, tickets, session):
+        """
+        Once a ticket is merged, its merge commit never changes, so it's cached
+        forever. Tickets that are not merged yet are looked up again after
+        UNMERGED_TICKET_TTL.
+        """
+        cache = Cache("django-tickets")
+        sha1s = {}
+        missing = []
+        for ticket in tickets:
+            entry = cache.get_entry(str(ticket))
+            if entry is not None and (entry.is_fresh() or settings.is_offline()):
+                sha1s[ticket] = entry.value
+            else:
+                missing.append(ticket)
+
+        if missing and not settings.is_offline():
+            # One search per batch of tickets, then for each PR found, up to 3
+            # calls (usually 1 PR per ticket).
+            github_utils.report_budget(
+                session,
+                expected=math.ceil(len(missing) / TICKETS_PER_SEARCH),
+                resource="search",
+            )
+            github_utils.report_budget(session, expected=3 * len(missing))
+
+            for ticket, sha1 in get_merge_commit_sha1s(missing, session).items():
+                ttl = None if sha1 else UNMERGED_TICKET_TTL
+                cache.set(str(ticket), sha1, ttl=ttl)
+                sha1s[ticket] = sha1
+
+        return sha1s
+
+    def are_commits_in_version(self, commits, version, session):
+        """
+        Released versions don't change, so whether a commit is part of one is
+        cached forever.
+        """
+        cache = Cache("django-commits-in-version")
+        in_version = {}
+        missing = []
+        for commit in commits:
+            result = cache.get(f"{commit}...{version}")
+            if result is None:
+                missing.append(commit)
+            else:
+                in_version[commit] = result
+
+        if not missing:
+            return in_version
+
+        release_commits = self.get_release_commits(
+            version,
+            session,
+            fetch=len(missing) >= RELEASE_COMMITS_THRESHOLD
+            and not settings.is_offline(),
+        )
+        if release_commits is not None:
+            results = {
+                commit: is_in_release(commit, release_commits) for commit in missing
+            }
+        elif settings.is_offline():
+            return in_version
+        else:
+            github_utils.report_budget(session, expected=len(missing))
+            results = are_commits_in_version(missing, version, session)
+
+        for commit, result in results.items():
+            cache.set(f"{commit}...{version}", result)
+            in_version[commit] = result
+
+        return in_version
+
+    def get_release_commits(self, version, session, fetch):
+        """
+        Return the set of the commits of the version if we already know it
+        (it's kept forever), or if fetch is True, otherwise None.
+        """
+        if version in self.release_commits:
+            return self.release_commits[version]
+
+        cache = Cache("django-release-commits")
+        commits = cache.get(version)
+        if commits is not None:
+            commits = set(commits)
+        elif fetch:
+            logger.info(f"Listing the commits of Django {version}")
+            commits = get_commits_in_version(version, session)
+            cache.set(version, sorted(commits))
+        else:
+            return None
+
+        self.release_commits[version] = commits
+        return commits
+
+
+def is_in_release(commit, release_commits):
+    """
+    Tickets merged by hand give abbreviated sha1s ("merged in abc1234"), the
+    release commits are full ones.
+    """
+    if commit in release_commits:
+        return True
+    return len(commit) < 40 and any(
+        release_commit.startswith(commit) for release_commit in release_commits
+    )
 
 
 class DjangoMatch(Match):
@@ -118,6 +457,13 @@ class DjangoMatch(Match):
         except (AttributeError, TypeError):
             raise NotMatching
 
+    def get_dependencies(self):
+        return {"django"}
+
+    def get_shard_key(self):
+        # All the tickets need the same release commits.
+        return "django"
+
     def __str__(self):
         return (
             "Django ticket #{match.ticket} "
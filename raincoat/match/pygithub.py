@@ -1,37 +1,115 @@
 from __future__ import annotations
 
+import re
 from collections import namedtuple
 
 from raincoat import source
+from raincoat.exceptions import OfflineCacheMiss
 from raincoat.match import NotMatching
 from raincoat.match.python import PythonChecker, PythonMatch
 
 PyGithubKey = namedtuple("PyGithubKey", "repo commit")
 
+sha1_regex = re.compile(r"^[0-9a-f]{7,40}$")
+
 
 class PyGithubChecker(PythonChecker):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.branch_commit_cache = {}
+        # (repo, commit, branch, path) for the files that are the same at
+        # the commit and at the head of the branch
+        self.unchanged_files = set()
+
+    def check(self, matches):
+        matches = list(matches)
+        # All at once (and free when the lockfile has the heads).
+        self.resolve_branches(matches)
+        # What the lockfile knows doesn't need to be compared.
+        matches = [match for match in matches if not self.is_locked_unchanged(match)]
+        self.find_unchanged_files(matches)
+        return super().check(matches)
+
+    def fetch(self, matches):
+        matches = list(matches)
+        self.resolve_branches(matches)
+        self.find_unchanged_files(matches)
+        return super().fetch(matches)
+
+    def resolve_branches(self, matches):
+        """
+        Resolve the heads of all the branches at once.
+        """
+        branches = {(match.repo, match.branch) for match in matches}
+        branches -= set(self.branch_commit_cache)
+        if not branches:
+            return
+        try:
+            commits = source.get_branch_commits(branches)
+        except OfflineCacheMiss:
+            # The branches we have will be found one by one.
+            return
+        for (repo, branch), commit in commits.items():
+            self.branch_commit_cache[(repo, branch)] = PyGithubKey(
+                repo=repo, commit=commit
+            )
 
-    def current_source_key(self, match):
+    def find_unchanged_files(self, matches):
+        """
+        Compare the git blob sha1s of the files at both ends, so that
+        unchanged files are only downloaded once.
+        """
+        files = set()
+        heads = {}
+        for match in matches:
+            try:
+                head = self.get_branch_key(match).commit
+            except OfflineCacheMiss:
+                continue
+            heads[match] = head
+            if head == match.commit:
+                continue
+            for commit in (match.commit, head):
+                files.add((match.repo, commit, match.get_path()))
+
+        blobs = source.get_blob_shas(files) if files else {}
+
+        for match, head in heads.items():
+            path = match.get_path()
+            match_blob = blobs.get((match.repo, match.commit, path))
+            head_blob = blobs.get((match.repo, head, path))
+            if match_blob is not None and match_blob == head_blob:
+                self.unchanged_files.add((match.repo, match.commit, match.branch, path))
+
+    def get_branch_key(self, match):
         branch_key = (match.repo, match.branch)
-        if branch_key in self.branch_commit_cache:
-            key = self.branch_commit_cache[branch_key]
-            match.branch_commit = key.commit
-            return key
+        if branch_key not in self.branch_commit_cache:
+            commit = source.get_branch_commit(match.repo, match.branch)
+            self.branch_commit_cache[branch_key] = PyGithubKey(
+                repo=match.repo, commit=commit
+            )
+        return self.branch_commit_cache[branch_key]
 
-        commit = source.get_branch_commit(match.repo, match.branch)
-        github_key = PyGithubKey(repo=match.repo, commit=commit)
+    def current_source_key(self, match):
+        key = self.get_branch_key(match)
+        match.branch_commit = key.commit[:8]
 
-        self.branch_commit_cache[(match.repo, match.branch)] = github_key
-        match.branch_commit = commit[:8]
+        unchanged_key = (match.repo, match.commit, match.branch, match.get_path())
+        if unchanged_key in self.unchanged_files:
+            # Same content: no need to download the file at the head.
+            return self.match_source_key(match)
 
-        return github_key
+        return key
 
     def match_source_key(self, match):
         return PyGithubKey(repo=match.repo, commit=match.commit)
 
+    def element_cache_key(self, key):
+        # Branch or tag names may move, commits don't.
+        if not sha1_regex.match(key.commit):
+            return None
+        return f"github {key.repo}@{key.commit}"
+
     def get_source(self, key, files):
         return source.download_files_from_repo(
             repo=key.repo, commit=key.commit, files=files
@@ -53,6 +131,12 @@ class PyGithubMatch(PythonMatch):
 
         super().__init__(filename, lineno)
 
+    def get_dependencies(self):
+        return {self.repo}
+
+    def get_shard_key(self):
+        return f"pygithub {self.repo}"
+
     def __str__(self):
         return (
             "{match.repo}@{match.commit} vs {match.branch} branch"
@@ -5,7 +5,6 @@ from collections import namedtuple
 from raincoat import source
 from raincoat.match import NotMatching
 from raincoat.match.python import PythonChecker, PythonMatch
-from raincoat.utils import Cleaner
 
 PyPIKey = namedtuple("PyPIKey", "package version installed")
 
@@ -32,15 +31,28 @@ class PyPIChecker(PythonChecker):
     def match_source_key(self, match):
         return PyPIKey(match.package, match.version, installed=False)
 
+    def element_cache_key(self, key):
+        # Installed files may be edited, released versions don't change.
+        if key.installed:
+            return None
+        return f"pypi {key.package}=={key.version}"
+
+    def verdict_cache_key(self, key, path):
+        if not key.installed:
+            return super().verdict_cache_key(key, path)
+        # Installed files may be edited: their content tells if they changed.
+        digest = source.get_installed_file_hash(key.package, path)
+        if digest is None:
+            return None
+        return f"pypi {key.package}=={key.version} installed {digest}"
+
     def get_source(self, key, files):
         if key.installed:
             all_files = source.get_distributed_files(key.package)
             return source.open_installed(all_files, files_to_open=files)
         else:
-            with Cleaner() as cleaner:
-                path = cleaner.mkdir()
-                source.download_package(key.package, key.version, path)
-                return source.open_downloaded(path, files)
+            archive = source.get_package_archive(key.package, key.version)
+            return source.open_archive(archive, files)
 
 
 class PyPIMatch(PythonMatch):
@@ -57,6 +69,13 @@ class PyPIMatch(PythonMatch):
 
         super().__init__(filename, lineno)
 
+    def get_dependencies(self):
+        return {source.normalize_name(self.package)}
+
+    def get_shard_key(self):
+        # Both the version of the comment and the current one
+        return f"pypi {source.normalize_name(self.package)}"
+
     def __str__(self):
         return (
             "{match.package} == {match.version}{vs_match} "
@@ -1,12 +1,34 @@
 from __future__ import annotations
 
 import difflib
+import logging
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from itertools import groupby
 from operator import itemgetter
 
-from raincoat import constants, parse
-from raincoat.match import Match
+from raincoat import constants, lock, parse
+from raincoat.cache import Cache
+from raincoat.exceptions import OfflineCacheMiss
+from raincoat.match import Match, Unknown
+
+logger = logging.getLogger(__name__)
+
+# Number of sources fetched simultaneously
+MAX_WORKERS = 8
+
+CONSTANTS = {
+    constant: constant
+    for constant in (
+        constants.FILE_NOT_FOUND,
+        constants.ELEMENT_NOT_FOUND,
+        constants.UNKNOWN,
+    )
+}
+
+# Parsed elements of the sources that never change, by cache key. Only useful
+# in a long running process (the daemon): it saves reading the cache.
+elements_memory: dict = {}
 
 
 class PythonChecker:
@@ -40,56 +62,220 @@ class PythonChecker:
         """
         raise NotImplementedError
 
+    def element_cache_key(self, key):
+        """
+        If the source identified by this key never changes, return a string
+        identifying it, so that its parsed elements are kept in the cache.
+        """
+        return None
+
     def check(self, matches):
         """
         Main entrypoint
         """
-        matches = list(matches)
+        matches = [match for match in matches if not self.is_locked_unchanged(match)]
+
+        # Matches whose sources didn't change since the last run have the
+        # same verdict.
+        verdicts = Cache("python-verdicts")
+        # A dict: match > error message (None if the match is fine)
+        results = {}
+        verdict_keys = {}
+        to_check = []
+        for match in matches:
+            verdict_key = self.get_verdict_key(match)
+            verdict = None if verdict_key is None else verdicts.get(verdict_key)
+            if verdict is None:
+                verdict_keys[match] = verdict_key
+                to_check.append(match)
+            else:
+                results[match] = verdict["message"]
 
         # A set of all source keys.
         # source_key should be: (source, path, element)
-        source_keys = sorted(set(self.get_source_keys(matches)))
+        source_keys = sorted(set(self.get_source_keys(to_check)))
 
         # A dict: (source_key, path, element_key) > element
         elements = dict(self.get_elements(source_keys))
 
-        # A generator yielding every match and the error message
-        return self.run_matches(matches, elements)
+        for message, match in self.run_matches(to_check, elements):
+            results[match] = message
+
+        for match in to_check:
+            message = results.get(match)
+            if verdict_keys[match] is not None and not isinstance(message, Unknown):
+                verdicts.set(verdict_keys[match], {"message": message})
+
+        # Every match and the error message
+        return [
+            (results[match], match)
+            for match in matches
+            if results.get(match) is not None
+        ]
+
+    def fetch(self, matches):
+        """
+        Fetch and parse every source check needs, concurrently, so that
+        they're in the cache.
+        """
+        source_keys = sorted(set(self.get_source_keys(list(matches))))
+        by_source = [list(keys) for __, keys in groupby(source_keys, key=itemgetter(0))]
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            for __ in executor.map(
+                lambda keys: list(self.get_elements(keys)), by_source
+            ):
+                pass
+
+    def get_verdict_key(self, match):
+        """
+        Return a string identifying the match and both its sources, if they
+        never change, otherwise None.
+        """
+        try:
+            current_key = self.current_source_key(match)
+        except OfflineCacheMiss:
+            return None
+        path = match.get_path()
+        match_cache_key = self.verdict_cache_key(self.match_source_key(match), path)
+        current_cache_key = self.verdict_cache_key(current_key, path)
+        if match_cache_key is None or current_cache_key is None:
+            return None
+        return "{} {} {} {}:{}".format(
+            match.match_type,
+            match_cache_key,
+            current_cache_key,
+            path,
+            match.get_element(),
+        )
+
+    def verdict_cache_key(self, source_key, path):
+        """
+        Identifies the file at this path in this source, for the verdict cache,
+        or None if it may change.
+        """
+        return self.element_cache_key(source_key)
+
+    def get_locked_hash(self, source_key, path, element_name):
+        lockfile = lock.get_lock()
+        cache_key = self.element_cache_key(source_key)
+        if lockfile is None or cache_key is None:
+            return None
+        return lockfile.get("elements", f"{cache_key} {path}:{element_name}")
+
+    def is_locked_unchanged(self, match):
+        """
+        If the lockfile says the element is the same on both sides, there's
+        nothing to fetch.
+        """
+        if lock.get_lock() is None:
+            return False
+        path, element = match.get_path(), match.get_element()
+        try:
+            current_key = self.current_source_key(match)
+        except OfflineCacheMiss:
+            return False
+        match_hash = self.get_locked_hash(self.match_source_key(match), path, element)
+        current_hash = self.get_locked_hash(current_key, path, element)
+        return match_hash is not None and match_hash == current_hash
+
+    def lock_element(self, source_key, path, element_name, element):
+        lockfile = lock.get_lock()
+        cache_key = self.element_cache_key(source_key)
+        # Only found elements are recorded, so that equal hashes mean that
+        # there's nothing to report.
+        if lockfile is None or cache_key is None or isinstance(element, str):
+            return
+        lockfile.set(
+            "elements", f"{cache_key} {path}:{element_name}", lock.hash_element(element)
+        )
 
     def get_source_keys(self, matches):
         for match in matches:
             path, element = match.get_path(), match.get_element()
             match_key = self.match_source_key(match)
             yield match_key, path, element
-            current_key = self.current_source_key(match)
+            try:
+                current_key = self.current_source_key(match)
+            except OfflineCacheMiss:
+                # Reported in run_matches
+                continue
             yield current_key, path, element
 
     def get_elements(self, source_keys):
         grouped_keys = group_composite(source_keys)
+        cache = Cache("python-elements")
         for source_key, files_dict in grouped_keys.items():
-            files_source = self.get_source(source_key, set(files_dict))
+            cache_key = self.element_cache_key(source_key)
+            missing = {}
             for path, element_names in files_dict.items():
-                file_source = files_source[path]
-                if file_source is constants.FILE_NOT_FOUND:
+                for element_name in element_names:
+                    full_key = (source_key, path, element_name)
+                    element = None
+                    if cache_key is not None:
+                        element_key = f"{cache_key} {path}:{element_name}"
+                        element = elements_memory.get(element_key)
+                        if element is None:
+                            element = cache.get(element_key)
+                    if element is None:
+                        missing.setdefault(path, []).append(element_name)
+                    else:
+                        # Constants are compared by identity.
+                        if isinstance(element, str):
+                            element = CONSTANTS[element]
+                        elements_memory[element_key] = element
+                        self.lock_element(source_key, path, element_name, element)
+                        yield full_key, element
+
+            if not missing:
+                continue
+
+            try:
+                files_source = self.get_source(source_key, set(missing))
+            except OfflineCacheMiss as exc:
+                logger.warning(str(exc))
+                for path, element_names in missing.items():
                     for element_name in element_names:
-                        full_key = (source_key, path, element_name)
-                        yield full_key, constants.FILE_NOT_FOUND
-                else:
-                    elements = parse.find_elements(file_source, element_names)
-                    for element_name, element_source in elements:
-                        full_key = (source_key, path, element_name)
-                        yield full_key, element_source
+                        yield (source_key, path, element_name), constants.UNKNOWN
+                continue
+
+            for path, element_names in missing.items():
+                for element_name, element in self.parse_file(
+                    files_source[path], element_names
+                ):
+                    if cache_key is not None:
+                        element_key = f"{cache_key} {path}:{element_name}"
+                        cache.set(element_key, element)
+                        elements_memory[element_key] = element
+                    self.lock_element(source_key, path, element_name, element)
+                    yield (source_key, path, element_name), element
+
+    def parse_file(self, file_source, element_names):
+        if file_source is constants.FILE_NOT_FOUND:
+            for element_name in element_names:
+                yield element_name, constants.FILE_NOT_FOUND
+        else:
+            yield from parse.find_elements(file_source, element_names)
 
     def run_matches(self, matches, elements):
         for match in matches:
             path, element = match.get_path(), match.get_element()
 
+            try:
+                current_source_key = self.current_source_key(match)
+            except OfflineCacheMiss as exc:
+                yield self.run_unknown(match, reason=str(exc))
+                continue
+
             match_key = (self.match_source_key(match), path, element)
-            current_key = (self.current_source_key(match), path, element)
+            current_key = (current_source_key, path, element)
 
             match_element = elements.get(match_key)
             current_element = elements.get(current_key)
 
+            if constants.UNKNOWN in (match_element, current_element):
+                yield self.run_unknown(match, reason="the source is not in the cache")
+                continue
+
             not_found = match_element in (
                 constants.FILE_NOT_FOUND,
                 constants.ELEMENT_NOT_FOUND,
@@ -102,6 +288,9 @@ class PythonChecker:
                     current_element=current_element,
                 )
 
+    def run_unknown(self, match, reason):
+        return Unknown(f"Could not be checked: {reason}"), match
+
     def run_match(self, match, match_element, current_element):
         if match_element is constants.FILE_NOT_FOUND:
             return (
@@ -150,6 +339,8 @@ def group_composite(elements):
 
     """
     elements = list(elements)
+    if not elements:
+        return OrderedDict()
 
     # End of recursion
     if len(elements[0]) == 1:
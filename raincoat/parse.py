@@ -4,8 +4,6 @@ import ast
 from collections import deque
 from typing import Iterable
 
-import asttokens
-
 from raincoat.constants import ELEMENT_NOT_FOUND
 
 Line = str
@@ -20,6 +18,8 @@ class CodeLocator(ast.NodeVisitor):
         self.open_nodes = deque()
 
     def load(self):
+        import asttokens
+
         self.nodes = {}
         self.marked_ast = asttokens.ASTTokens(self.source, parse=True)
         self.visit(self.marked_ast.tree)
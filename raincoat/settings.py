@@ -0,0 +1,73 @@
+"""
+Settings that apply to the whole run.
+
+Each setting can be given through a RAINCOAT_<NAME> environment variable, and
+the command line overrides them for the duration of a run.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import os
+
+DEFAULTS = {
+    # Only use what's in the caches, never the network.
+    "offline": False,
+    # Path of the lockfile, used if it exists
+    "lock": "raincoat.lock",
+    # Resolve everything again and rewrite the lockfile
+    "update_lock": False,
+    # Cache server shared with other machines (see cache.HTTPBackend)
+    "cache_url": "",
+    # Size (e.g. 2G) above which the least recently used cache entries are
+    # removed (see cache_usage)
+    "cache_max_size": "",
+    # Run in the current process rather than forwarding to the daemon
+    "no_daemon": False,
+    # Socket of the daemon (default: in the cache directory, see daemon)
+    "daemon_socket": "",
+    # Local clone of Django, used rather than the GitHub API (see match.django)
+    "django_repo": "",
+    # Longest pause (in seconds) when the GitHub API budget is exhausted,
+    # beyond which the requests fail (see github_utils.RateLimiter)
+    "github_max_wait": 60 * 60,
+    # Simultaneous connections to each host (see http_utils.HostLimiter)
+    "max_connections_per_host": 4,
+}
+
+TRUE_VALUES = {"1", "true", "yes", "on"}
+
+overrides: dict = {}
+
+
+def get(name):
+    if name in overrides:
+        return overrides[name]
+
+    default = DEFAULTS[name]
+    value = os.getenv(f"RAINCOAT_{name.upper()}")
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in TRUE_VALUES
+    return type(default)(value)
+
+
+@contextlib.contextmanager
+def override(**settings):
+    """
+    Settings given as None are left untouched.
+    """
+    previous = dict(overrides)
+    overrides.update(
+        (name, value) for name, value in settings.items() if value is not None
+    )
+    try:
+        yield
+    finally:
+        overrides.clear()
+        overrides.update(previous)
+
+
+def is_offline():
+    return get("offline")
@@ -0,0 +1,100 @@
+"""
+--shard i/n splits the checks between n jobs running in parallel (e.g. CI
+nodes). Matches are assigned to a shard by the source they need (the package,
+the repository...), not by file, so that each source is only downloaded by
+one job. The assignment only depends on the comments, so every job computes
+the same one.
+
+Each job can write a report (--report), and "raincoat merge-reports" prints
+the results of all the shards as a single run would.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from collections import namedtuple
+
+from raincoat.exceptions import RaincoatException
+
+# index is between 1 and count
+Shard = namedtuple("Shard", "index count")
+
+
+def parse_shard(value):
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"{value!r} is not of the form i/n (e.g. 1/4)")
+    if not 1 <= index <= count:
+        raise ValueError(f"{value!r}: the shard should be between 1 and {count}")
+    return Shard(index, count)
+
+
+def get_shard_index(key, count):
+    # Python's hash() changes from one process to the next.
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return int(digest, 16) % count + 1
+
+
+def select_matches(matches, shard):
+    for match in matches:
+        if get_shard_index(match.get_shard_key(), shard.count) == shard.index:
+            yield match
+
+
+def write_report(path, shard, results):
+    """
+    results is a list of (output, unknown)
+    """
+    report = {
+        "shard": list(shard) if shard else None,
+        "results": [
+            {"output": output, "unknown": unknown} for output, unknown in results
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as handler:
+        json.dump(report, handler, indent=2)
+        handler.write("\n")
+
+
+def read_report(path):
+    try:
+        with open(path, encoding="utf-8") as handler:
+            report = json.load(handler)
+        return report["shard"], report["results"]
+    except (OSError, ValueError, KeyError, TypeError) as exc:
+        raise RaincoatException(f"Cannot read the report {path}") from exc
+
+
+def merge_reports(paths):
+    """
+    Return the list of (output, unknown) of all the reports, checking that
+    they cover every shard exactly once.
+    """
+    shards = []
+    results = []
+    for path in paths:
+        shard, shard_results = read_report(path)
+        shards.append(Shard(*shard) if shard else Shard(1, 1))
+        results.extend(
+            (result["output"], result["unknown"]) for result in shard_results
+        )
+
+    counts = {shard.count for shard in shards}
+    if len(counts) > 1:
+        raise RaincoatException(
+            "The reports don't have the same number of shards: {}".format(
+                ", ".join(str(count) for count in sorted(counts))
+            )
+        )
+    (count,) = counts
+    indexes = sorted(shard.index for shard in shards)
+    if indexes != list(range(1, count + 1)):
+        missing = sorted(set(range(1, count + 1)) - set(indexes))
+        duplicate = sorted({index for index in indexes if indexes.count(index) > 1})
+        raise RaincoatException(
+            f"The reports should cover each of the {count} shards once "
+            f"(missing: {missing or 'none'}, duplicate: {duplicate or 'none'})"
+        )
+    return sorted(results)
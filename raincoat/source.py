@@ -1,28 +1,44 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+import json
+import logging
 import os
+import pathlib
+import shutil
 import subprocess
 import sys
 import tarfile
+import tempfile
+import threading
+import time
 import zipfile
 
-import requests
-from packaging.version import parse
-
-from raincoat import github_utils
+from raincoat import github_utils, http_utils, lock, settings
+from raincoat.cache import Cache, get_cache_dir, record_access, touch
 from raincoat.constants import FILE_NOT_FOUND
+from raincoat.exceptions import OfflineCacheMiss
+from raincoat.utils import normalize_name
 
 if sys.version_info < (3, 10):
     import importlib_metadata
 else:
     from importlib import metadata as importlib_metadata
 
+logger = logging.getLogger(__name__)
+
 
 def download_package(package, version, download_dir):
     full_package = f"{package}=={version}"
 
+    # Our standard streams may not be a terminal: "raincoat lsp" speaks its
+    # protocol on them.
     result = subprocess.run(
-        ["pip", "download", "--no-deps", "-d", download_dir, full_package]
+        ["pip", "download", "--no-deps", "-d", download_dir, full_package],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
     )
     if result.returncode != 0:
         raise ValueError(
@@ -32,6 +48,47 @@ def download_package(package, version, download_dir):
         )
 
 
+def get_package_archive(package, version):
+    """
+    Return the path to the archive of this version of the package, downloaded
+    once and kept in the cache directory.
+    """
+    directory = os.path.join(
+        get_cache_dir(), "archives", normalize_name(package), version
+    )
+    try:
+        (archive_name,) = os.listdir(directory)
+    except (FileNotFoundError, ValueError):
+        record_access("archives", hit=False)
+    else:
+        record_access("archives", hit=True)
+        touch(directory)
+        return os.path.join(directory, archive_name)
+
+    if settings.is_offline():
+        raise OfflineCacheMiss(
+            f"The archive of {package}=={version} is not in the cache (offline)"
+        )
+
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    # Download in a temporary directory then move it, so that concurrent runs
+    # never see a partial download.
+    download_dir = tempfile.mkdtemp(dir=os.path.dirname(directory))
+    try:
+        download_package(package, version, download_dir)
+        try:
+            os.rename(download_dir, directory)
+        except OSError:
+            # Someone else was faster.
+            shutil.rmtree(download_dir)
+    except BaseException:
+        shutil.rmtree(download_dir, ignore_errors=True)
+        raise
+
+    (archive_name,) = os.listdir(directory)
+    return os.path.join(directory, archive_name)
+
+
 def open_in_wheel(wheel, pathes):
     with zipfile.ZipFile(wheel, "r") as zf:
         sources = {}
@@ -61,8 +118,11 @@ def open_in_tarball(tarball, pathes):
 def open_downloaded(download_path, pathes):
     (archive_name,) = os.listdir(download_path)
 
-    archive_path = os.path.join(download_path, archive_name)
-    ext = os.path.splitext(archive_name)[1]
+    return open_archive(os.path.join(download_path, archive_name), pathes)
+
+
+def open_archive(archive_path, pathes):
+    ext = os.path.splitext(archive_path)[1]
 
     if ext == ".gz":
         return open_in_tarball(archive_path, pathes)
@@ -87,15 +147,174 @@ def open_installed(all_files, files_to_open):
     return sources
 
 
+class Environment:
+    """
+    Snapshot of the distributions installed in the given pathes (defaults to
+    sys.path), indexed by normalized name.
+
+    The index is built by listing the metadata directories once, metadata and
+    file lists are only read for the distributions we ask about, and memoized.
+    """
+
+    METADATA_SUFFIXES = (".dist-info", ".egg-info")
+
+    def __init__(self, pathes=None):
+        self.pathes = sys.path if pathes is None else pathes
+        self.distributions = dict(self.find_distributions())
+        self.versions = {}
+        self.files = {}
+
+    def find_distributions(self):
+        found = set()
+        for path in self.pathes:
+            try:
+                entries = sorted(os.listdir(path or "."))
+            except OSError:
+                continue
+
+            for entry in entries:
+                if not entry.endswith(self.METADATA_SUFFIXES):
+                    continue
+                # Metadata directories are named <name>-<version>.dist-info,
+                # with dashes escaped in both parts.
+                name = normalize_name(os.path.splitext(entry)[0].split("-")[0])
+                # Like importlib.metadata, the first one on the path wins.
+                if name in found:
+                    continue
+                found.add(name)
+                yield name, importlib_metadata.PathDistribution(
+                    pathlib.Path(path or ".", entry)
+                )
+
+    def get_version(self, package):
+        """
+        Return the installed version of the package, or None if it's not installed.
+        """
+        name = normalize_name(package)
+        if name not in self.versions:
+            try:
+                distribution = self.distributions[name]
+            except KeyError:
+                version = None
+            else:
+                version = distribution.version
+            self.versions[name] = version
+        return self.versions[name]
+
+    def get_files(self, package):
+        """
+        Return a dict mapping the path of each file of the installed
+        package to its importlib.metadata.PackagePath.
+        """
+        name = normalize_name(package)
+        if name not in self.files:
+            try:
+                distribution = self.distributions[name]
+            except KeyError:
+                files = []
+            else:
+                files = distribution.files or []
+            self.files[name] = {str(f): f for f in files}
+        return self.files[name]
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment():
+    """
+    The environment is only scanned once per run.
+    """
+    return Environment()
+
+
 def get_current_or_latest_version(package):
+    version = get_environment().get_version(package)
+    if version is not None:
+        return True, version
+
+    lockfile = lock.get_lock()
+    if lockfile is None:
+        return False, get_latest_version(package)
+
+    version = lockfile.get("versions", normalize_name(package))
+    if version is None:
+        version = get_latest_version(package)
+        lockfile.set("versions", normalize_name(package), version)
+    return False, version
+
+
+# How long the latest version of a package is considered fresh
+LATEST_VERSION_TTL = 60 * 60
+# How long after that we still use it while it's revalidated in the background
+LATEST_VERSION_STALE_TTL = 24 * 60 * 60
+
+
+def get_latest_version(package):
+    """
+    Return the latest stable version of a package on PyPI.
+
+    Only the resolved version is cached, along with the ETag of the PyPI
+    document, so that once the entry has expired, revalidating it costs
+    a 304 response.
+    """
+    cache = Cache("pypi-latest-version")
+    key = normalize_name(package)
+    entry = cache.get_entry(key)
+
+    if entry is not None:
+        if entry.is_fresh() or settings.is_offline():
+            return entry.value["version"]
+
+        if entry.is_fresh(now=time.time() - LATEST_VERSION_STALE_TTL):
+            # Stale while revalidate. The thread is not a daemon, so it will
+            # finish before the program exits.
+            threading.Thread(
+                target=revalidate_latest_version,
+                kwargs={"package": package, "cache": cache, "entry": entry},
+            ).start()
+            return entry.value["version"]
+
+    if settings.is_offline():
+        raise OfflineCacheMiss(
+            f"The latest version of {package} is not in the cache (offline)"
+        )
+
+    return fetch_latest_version(package=package, cache=cache, entry=entry)
+
+
+def revalidate_latest_version(package, cache, entry):
     try:
-        return True, importlib_metadata.version(package)
-    except importlib_metadata.PackageNotFoundError:
-        pass
-    pypi_url = f"https://pypi.python.org/pypi/{package}/json"
-    response = requests.get(pypi_url)
-    response.raise_for_status()
-    releases = response.json()["releases"]
+        fetch_latest_version(package=package, cache=cache, entry=entry)
+    except Exception:
+        logger.warning(
+            f"Could not revalidate the latest version of {package}", exc_info=True
+        )
+
+
+def fetch_latest_version(package, cache, entry):
+    # Only the version is kept, not the (large) JSON document.
+    headers = {"Cache-Control": "no-store"}
+    if entry is not None and entry.value.get("etag"):
+        headers["If-None-Match"] = entry.value["etag"]
+
+    pypi_url = f"https://pypi.org/pypi/{package}/json"
+    with http_utils.get_session() as session:
+        response = session.get(pypi_url, headers=headers)
+
+    if entry is not None and response.status_code == 304:
+        value = entry.value
+    else:
+        response.raise_for_status()
+        value = {
+            "version": find_latest_version(response.json()["releases"]),
+            "etag": response.headers.get("ETag"),
+        }
+
+    cache.set(normalize_name(package), value, ttl=LATEST_VERSION_TTL)
+    return value["version"]
+
+
+def find_latest_version(releases):
+    from packaging.version import parse
 
     versions = []
 
@@ -110,20 +329,201 @@ def get_current_or_latest_version(package):
 
         versions.append((parsed_version, version))
 
-    return False, next(iter(sorted(versions, reverse=True)))[1]
+    return max(versions)[1]
 
 
 def get_distributed_files(package):
-    return {str(f): f for f in importlib_metadata.files(package) or []}
+    return get_environment().get_files(package)
+
+
+def get_installed_file_hash(package, path):
+    """
+    Hash of the content of an installed file (which may have been edited since
+    it was installed), or None if the package doesn't have it.
+    """
+    try:
+        dist_file = get_distributed_files(package)[path]
+        content = dist_file.read_binary()
+    except (KeyError, OSError):
+        return None
+    return hashlib.sha256(content).hexdigest()
+
+
+# Branch heads move, but CI jobs started together can share them.
+BRANCH_COMMIT_TTL = 10 * 60
+# Number of branches resolved by each GraphQL query
+BRANCHES_PER_QUERY = 50
 
 
 def get_branch_commit(repo, branch):
+    return get_branch_commits([(repo, branch)])[(repo, branch)]
+
+
+def get_branch_commits(branches):
+    """
+    Return a dict: (repo, branch) > sha1 of the head of the branch.
+
+    Heads are kept in the cache for a few minutes. The missing ones are
+    resolved in batches with the GraphQL API when we have a token (it's not
+    available anonymously), and one by one otherwise.
+    """
+    cache = Cache("github-branch-heads")
+    lockfile = lock.get_lock()
+    commits = {}
+    missing = []
+    for repo, branch in sorted(set(branches)):
+        commit = lockfile and lockfile.get("branches", f"{repo}@{branch}")
+        if commit:
+            commits[(repo, branch)] = commit
+            continue
+        commit = cache.get(f"{repo}@{branch}")
+        if commit is None:
+            missing.append((repo, branch))
+        else:
+            commits[(repo, branch)] = commit
+
+    if missing:
+        commits.update(resolve_branch_commits(missing, cache))
+
+    if lockfile is not None:
+        for (repo, branch), commit in commits.items():
+            lockfile.set("branches", f"{repo}@{branch}", commit)
+    return commits
+
+
+def resolve_branch_commits(missing, cache):
+    with github_utils.get_session() as session:
+        resolved = {}
+        if session.auth and not settings.is_offline():
+            for i in range(0, len(missing), BRANCHES_PER_QUERY):
+                resolved.update(
+                    query_branch_commits(missing[i : i + BRANCHES_PER_QUERY], session)
+                )
+
+        for repo, branch in missing:
+            if (repo, branch) not in resolved:
+                resolved[(repo, branch)] = fetch_branch_commit(repo, branch, session)
+
+    for (repo, branch), commit in resolved.items():
+        cache.set(f"{repo}@{branch}", commit, ttl=BRANCH_COMMIT_TTL)
+    return resolved
+
+
+def query_branch_commits(branches, session):
+    """
+    Resolve several branch heads with a single GraphQL query. Branches that
+    could not be resolved are left out.
+    """
+    fields = []
+    for i, (repo, branch) in enumerate(branches):
+        owner, __, name = repo.partition("/")
+        # JSON strings are valid GraphQL strings
+        fields.append(
+            "b{}: repository(owner: {}, name: {}) "
+            "{{ ref(qualifiedName: {}) {{ target {{ oid }} }} }}".format(
+                i,
+                json.dumps(owner),
+                json.dumps(name),
+                json.dumps(f"refs/heads/{branch}"),
+            )
+        )
+    query = "query { " + " ".join(fields) + " }"
+
+    response = session.post(
+        github_utils.API_URL + "graphql",
+        json={"query": query},
+        priority=github_utils.HIGH,
+    )
+    if response.status_code != 200:
+        return {}
+
+    data = response.json().get("data") or {}
+    commits = {}
+    for i, (repo, branch) in enumerate(branches):
+        try:
+            commits[(repo, branch)] = data[f"b{i}"]["ref"]["target"]["oid"]
+        except (KeyError, TypeError):
+            continue
+    return commits
+
+
+def fetch_branch_commit(repo, branch, session):
     # This may fail, but so far, I don't really know how.
     url = f"https://api.github.com/repos/{repo}/branches/{branch}"
+    response = session.get(url, priority=github_utils.HIGH)
+    response.raise_for_status()
+    return response.json()["commit"]["sha"]
+
+
+# Number of files looked up by each GraphQL query
+BLOBS_PER_QUERY = 50
+
+
+def get_blob_shas(files):
+    """
+    files: (repo, commit, path) tuples. Return a dict: (repo, commit, path) >
+    sha1 of the git blob of the file at this commit, for the files we could
+    find. The blob sha1 changes if and only if the content changes, so
+    comparing them tells whether a file changed without downloading it.
+
+    A commit never changes, so they are cached forever. The missing ones are
+    looked up in batches with the GraphQL API when we have a token. Without
+    one, they're left out: downloading the files from raw.githubusercontent.com
+    costs less than finding out whether they changed.
+    """
+    cache = Cache("github-blob-shas")
+    blobs = {}
+    missing = []
+    for repo, commit, path in sorted(set(files)):
+        blob = cache.get(f"{repo}@{commit}:{path}")
+        if blob is None:
+            missing.append((repo, commit, path))
+        else:
+            blobs[(repo, commit, path)] = blob
+
+    if not missing or settings.is_offline():
+        return blobs
+
     with github_utils.get_session() as session:
-        response = session.get(url)
-        response.raise_for_status()
-        return response.json()["commit"]["sha"]
+        if not session.auth:
+            return blobs
+        for i in range(0, len(missing), BLOBS_PER_QUERY):
+            found = query_blob_shas(missing[i : i + BLOBS_PER_QUERY], session)
+            for (repo, commit, path), blob in found.items():
+                cache.set(f"{repo}@{commit}:{path}", blob)
+                blobs[(repo, commit, path)] = blob
+
+    return blobs
+
+
+def query_blob_shas(files, session):
+    """
+    Look up the blob sha1s of several files with a single GraphQL query.
+    Files that could not be found are left out.
+    """
+    fields = []
+    for i, (repo, commit, path) in enumerate(files):
+        owner, __, name = repo.partition("/")
+        fields.append(
+            "f{}: repository(owner: {}, name: {}) "
+            "{{ object(expression: {}) {{ ... on Blob {{ oid }} }} }}".format(
+                i, json.dumps(owner), json.dumps(name), json.dumps(f"{commit}:{path}")
+            )
+        )
+    query = "query { " + " ".join(fields) + " }"
+
+    response = session.post(github_utils.API_URL + "graphql", json={"query": query})
+    if response.status_code != 200:
+        return {}
+
+    data = response.json().get("data") or {}
+    blobs = {}
+    for i, file in enumerate(files):
+        try:
+            blobs[file] = data[f"f{i}"]["object"]["oid"]
+        except (KeyError, TypeError):
+            continue
+    return blobs
 
 
 def download_files_from_repo(repo, commit, files):
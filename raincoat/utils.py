@@ -2,12 +2,18 @@ from __future__ import annotations
 
 import logging
 import os
+import re
 import shutil
 import tempfile
 
 logger = logging.getLogger(__name__)
 
 
+def normalize_name(name):
+    # https://packaging.python.org/en/latest/specifications/name-normalization/
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
 def causes(exc: BaseException | None):
     """
     From a single exception with a chain of causes and contexts, make an iterable
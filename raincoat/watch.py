@@ -0,0 +1,247 @@
+"""
+raincoat --watch: after the first check, wait for Python files to be
+modified, read only those again, and only check the comments that are new or
+that changed. Only the verdicts that changed are printed.
+
+Files are watched with inotify on Linux. Elsewhere (or if inotify can't be
+used, e.g. too many watches), the tree is polled.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import itertools
+import logging
+import os
+import select
+import struct
+import time
+
+from raincoat import glue, grep, index
+from raincoat.match import check_matches
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two scans of the tree, when polling
+POLL_INTERVAL = 1.0
+# Seconds without events before we consider the editor is done saving
+DEBOUNCE = 0.1
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+WATCH_FLAGS = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def list_directories(base_dir, exclude):
+    for root, folders, __ in os.walk(base_dir):
+        folders[:] = [
+            folder
+            for folder in folders
+            if not grep.is_excluded(os.path.join(root, folder), exclude)
+        ]
+        yield os.path.normpath(root)
+
+
+def take_snapshot(paths, exclude):
+    """
+    Return a dict: Python file > [mtime, size].
+    """
+    snapshot = {}
+    for path in paths:
+        for filename in grep.list_python_files(path, exclude=exclude):
+            try:
+                snapshot[filename] = index.get_stat(filename)
+            except OSError:
+                continue
+    return snapshot
+
+
+class Poller:
+    def __init__(self, paths, exclude=None, interval=POLL_INTERVAL):
+        self.paths = paths
+        self.exclude = exclude
+        self.interval = interval
+        self.snapshot = take_snapshot(paths, exclude)
+
+    def wait(self):
+        """
+        Block until files change, return the set of those files.
+        """
+        while True:
+            time.sleep(self.interval)
+            snapshot = take_snapshot(self.paths, self.exclude)
+            changed = {
+                path
+                for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+class Inotify:
+    def __init__(self, paths, exclude=None):
+        self.exclude = exclude
+        # Raises AttributeError if there's no inotify
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise self.error()
+        # watch descriptor > directory
+        self.watches = {}
+        try:
+            for path in paths:
+                self.add_tree(path)
+        except OSError:
+            self.close()
+            raise
+
+    def error(self):
+        errno = ctypes.get_errno()
+        return OSError(errno, os.strerror(errno))
+
+    def add_tree(self, base_dir):
+        for directory in list_directories(base_dir, self.exclude):
+            descriptor = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), WATCH_FLAGS
+            )
+            if descriptor < 0:
+                raise self.error()
+            self.watches[descriptor] = directory
+
+    def wait(self):
+        changed = set()
+        while not changed:
+            changed |= self.read_events()
+            # Saving a file often comes as several events.
+            while select.select([self.fd], [], [], DEBOUNCE)[0]:
+                changed |= self.read_events()
+        return changed
+
+    def read_events(self):
+        return set(self.parse_events(os.read(self.fd, 64 * 1024)))
+
+    def parse_events(self, data):
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, __, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            directory = self.watches.get(descriptor)
+            if directory is None or not name:
+                continue
+            path = os.path.normpath(os.path.join(directory, os.fsdecode(name)))
+            if grep.is_excluded(path, self.exclude):
+                continue
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and os.path.isdir(path):
+                    self.add_tree(path)
+                    yield from grep.list_python_files(path, exclude=self.exclude)
+            elif path.endswith(".py"):
+                yield path
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_watcher(paths, exclude=None):
+    try:
+        return Inotify(paths, exclude=exclude)
+    except (AttributeError, OSError) as exc:
+        logger.info(f"Cannot use inotify ({exc}), polling the files instead")
+        return Poller(paths, exclude=exclude)
+
+
+def get_signature(match):
+    """
+    Identifies a comment, wherever it is in its file. Only what the comment
+    says is used: checkers store things on the matches (e.g. the version
+    found) while checking them.
+    """
+    return (match.match_type, match.arguments)
+
+
+class Session:
+    def __init__(self, color):
+        self.color = color
+        # file > {signature: (match, error)}, the error being None if the match
+        # is fine
+        self.verdicts = {}
+
+    def check_files(self, files, initial=False):
+        """
+        Yield the lines to print for the verdicts that changed in these files.
+        On the initial check, only the errors are printed.
+        """
+        found = {}
+        for filename in sorted(files):
+            try:
+                found[filename] = list(grep.find_in_file(filename))
+            except OSError:
+                # Deleted
+                found[filename] = []
+
+        to_check = [
+            match
+            for filename, matches in found.items()
+            for match in matches
+            if get_signature(match) not in self.verdicts.get(filename, {})
+        ]
+        errors = {
+            id(match): error
+            for error, match in check_matches(glue.group_matches(to_check))
+        }
+
+        for filename, matches in found.items():
+            previous = self.verdicts.get(filename, {})
+            verdicts = {}
+            for match in matches:
+                signature = get_signature(match)
+                if signature in previous:
+                    verdicts[signature] = (match, previous[signature][1])
+                    continue
+
+                error = errors.get(id(match))
+                verdicts[signature] = (match, error)
+                if error is not None:
+                    yield match.format(error, self.color)
+                elif not initial:
+                    yield self.color["match"](str(match)) + "\nOK\n"
+
+            if verdicts:
+                self.verdicts[filename] = verdicts
+            else:
+                self.verdicts.pop(filename, None)
+
+
+def watch(paths, exclude=None, color=None, watcher=None):
+    """
+    Yield the lines to print, forever.
+    """
+    watcher = watcher or get_watcher(paths, exclude=exclude)
+    session = Session(color=color)
+    try:
+        files = itertools.chain.from_iterable(
+            grep.list_python_files(path, exclude=exclude) for path in paths
+        )
+        yield from session.check_files(files, initial=True)
+        while True:
+            yield from session.check_files(watcher.wait())
+    finally:
+        watcher.close()
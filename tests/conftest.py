@@ -0,0 +1,11 @@
+from __future__ import annotations
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    # Never read or write the cache of the user running the tests
+    path = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("RAINCOAT_CACHE_DIR", str(path))
+    return path
@@ -0,0 +1,60 @@
+"""
+Startup time regression benchmark.
+
+Raincoat is often launched as a pre-commit hook, so what happens at import time
+matters. Timings are too noisy to be asserted in CI, so instead, these tests
+check that the expensive modules are not imported by runs that don't need them.
+"""
+
+from __future__ import annotations
+
+import subprocess
+import sys
+
+import pytest
+
+EXPENSIVE_MODULES = [
+    "asttokens",
+    "importlib.metadata",
+    "importlib_metadata",
+    "packaging",
+    "requests",
+    "typing_extensions",
+]
+
+LAZY_MODULES = ["raincoat.cache_usage", "raincoat.daemon", "raincoat.shard"]
+
+SCRIPT = """
+import sys
+
+{code}
+
+print(",".join(sorted(set(sys.modules) & set(sys.argv[1:]))))
+"""
+
+
+def imported_modules(code, modules=EXPENSIVE_MODULES):
+    result = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(code=code), *modules],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return [module for module in result.stdout.decode().strip().split(",") if module]
+
+
+def test_import_cli():
+    assert imported_modules("import raincoat.cli") == []
+
+
+def test_import_cli_commands():
+    # Only imported by the commands that need them
+    assert imported_modules("import raincoat.cli", modules=LAZY_MODULES) == []
+
+
+@pytest.mark.parametrize("color", [True, False])
+def test_run_without_comments(tmp_path, color):
+    code = f"""
+from raincoat import glue
+assert list(glue.raincoat({str(tmp_path)!r}, color={color})) == []
+"""
+    assert imported_modules(code) == []
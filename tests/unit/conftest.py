@@ -1,11 +1,30 @@
 from __future__ import annotations
 
+from collections import Counter
+
 import pytest
 
+from raincoat import cache, settings
 from raincoat.color import Color
+from raincoat.match import python
 from raincoat.match.pypi import PyPIMatch
 
 
+@pytest.fixture(autouse=True)
+def elements_memory(monkeypatch):
+    monkeypatch.setattr(python, "elements_memory", {})
+
+
+@pytest.fixture(autouse=True)
+def cache_counters(monkeypatch):
+    monkeypatch.setattr(cache, "counters", Counter())
+
+
+@pytest.fixture(autouse=True)
+def cache_backends(monkeypatch):
+    monkeypatch.setattr(cache, "backends", {})
+
+
 @pytest.fixture
 def match_module():
     return PyPIMatch(
@@ -83,3 +102,9 @@ class ValuesAreKeys:
 @pytest.fixture
 def color():
     return Color(ValuesAreKeys())
+
+
+@pytest.fixture
+def offline():
+    with settings.override(offline=True):
+        yield
@@ -0,0 +1,335 @@
+from __future__ import annotations
+
+import http.server
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from raincoat import cache
+
+
+@pytest.fixture
+def my_cache(tmp_path):
+    return cache.Cache("my-kind", directory=str(tmp_path))
+
+
+def get_path(my_cache, key):
+    return my_cache.backend.get_path(my_cache.kind, my_cache.get_name(key))
+
+
+def test_get_cache_dir(monkeypatch):
+    monkeypatch.setenv("RAINCOAT_CACHE_DIR", "/a/b")
+    assert cache.get_cache_dir() == "/a/b"
+
+
+def test_get_cache_dir_xdg(monkeypatch):
+    monkeypatch.delenv("RAINCOAT_CACHE_DIR")
+    monkeypatch.setenv("XDG_CACHE_HOME", "/a")
+    assert cache.get_cache_dir() == "/a/raincoat"
+
+
+def test_get_cache_dir_home(monkeypatch):
+    monkeypatch.delenv("RAINCOAT_CACHE_DIR")
+    monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+    monkeypatch.setenv("HOME", "/home/me")
+    assert cache.get_cache_dir() == "/home/me/.cache/raincoat"
+
+
+def test_cache_default_directory(cache_dir):
+    cache.Cache("a").set("b", 1)
+
+    assert os.listdir(cache_dir / "a")
+
+
+def test_get_set(my_cache):
+    assert my_cache.get("a") is None
+    my_cache.set("a", {"b": [1, 2]})
+    assert my_cache.get("a") == {"b": [1, 2]}
+
+
+def test_get_default(my_cache):
+    assert my_cache.get("a", 3) == 3
+
+
+def test_get_expired(my_cache):
+    my_cache.set("a", 1, ttl=-1)
+
+    assert my_cache.get("a") is None
+    entry = my_cache.get_entry("a")
+    assert entry.value == 1
+    assert not entry.is_fresh()
+
+
+def test_get_expired_offline(my_cache, offline):
+    my_cache.set("a", 1, ttl=-1)
+
+    assert my_cache.get("a") == 1
+
+
+def test_get_ttl(my_cache):
+    my_cache.set("a", 1, ttl=10)
+
+    entry = my_cache.get_entry("a")
+    assert entry.is_fresh()
+    assert not entry.is_fresh(now=entry.stored_at + 11)
+
+
+def test_get_no_ttl(my_cache):
+    my_cache.set("a", 1)
+
+    assert my_cache.get_entry("a").is_fresh(now=1e12)
+
+
+def test_get_corrupted(my_cache, caplog):
+    my_cache.set("a", 1)
+    with open(get_path(my_cache, "a"), "w") as handler:
+        handler.write("{")
+
+    assert my_cache.get("a") is None
+    assert "Ignoring unreadable my-kind cache entry for a" in caplog.text
+
+
+def test_get_other_key(my_cache, mocker):
+    my_cache.set("a", 1)
+    mocker.patch.object(my_cache, "get_name", return_value=my_cache.get_name("a"))
+
+    assert my_cache.get("b") is None
+
+
+def test_set_error(my_cache, mocker):
+    mocker.patch("os.replace", side_effect=OSError)
+
+    with pytest.raises(OSError):
+        my_cache.set("a", 1)
+
+    directory = os.path.dirname(get_path(my_cache, "a"))
+    assert os.listdir(directory) == [".lock"]
+
+
+def test_delete(my_cache):
+    my_cache.set("a", 1)
+    my_cache.delete("a")
+    my_cache.delete("a")
+
+    assert my_cache.get("a") is None
+
+
+class CacheServerHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = self.server.entries.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_PUT(self):
+        length = int(self.headers["Content-Length"])
+        self.server.entries[self.path] = self.rfile.read(length)
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_DELETE(self):
+        self.server.entries.pop(self.path, None)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def cache_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), CacheServerHandler)
+    server.entries = {}
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def http_backend(cache_server):
+    host, port = cache_server.server_address
+    return cache.HTTPBackend(f"http://{host}:{port}/cache/")
+
+
+def test_directory_backend(tmp_path):
+    backend = cache.DirectoryBackend(str(tmp_path))
+
+    assert backend.read("kind", "abcd") is None
+    backend.write("kind", "abcd", b"{}")
+    assert backend.read("kind", "abcd") == b"{}"
+    assert (tmp_path / "kind" / "ab" / "abcd.json").read_bytes() == b"{}"
+
+    backend.delete("kind", "abcd")
+    backend.delete("kind", "abcd")
+    assert backend.read("kind", "abcd") is None
+
+
+def test_directory_backend_concurrent(tmp_path):
+    backend = cache.DirectoryBackend(str(tmp_path))
+    backend.write("kind", "abcd", b"0")
+
+    def write(i):
+        backend.write("kind", "abcd", str(i).encode() * 1000)
+
+    def read(i):
+        content = backend.read("kind", "abcd")
+        assert len(set(content)) == 1
+
+    with ThreadPoolExecutor(8) as executor:
+        futures = [executor.submit(write, i) for i in range(1, 10)]
+        futures += [executor.submit(read, i) for i in range(50)]
+        for future in futures:
+            future.result()
+
+    assert sorted(os.listdir(tmp_path / "kind" / "ab")) == [".lock", "abcd.json"]
+
+
+def test_http_backend(http_backend, cache_server):
+    assert http_backend.read("kind", "abcd") is None
+
+    http_backend.write("kind", "abcd", b"{}")
+    assert cache_server.entries == {"/cache/kind/abcd.json": b"{}"}
+    assert http_backend.read("kind", "abcd") == b"{}"
+
+    http_backend.delete("kind", "abcd")
+    assert cache_server.entries == {}
+
+
+def test_http_backend_error(http_backend, mocker, caplog):
+    mocker.patch.object(CacheServerHandler, "do_GET", lambda self: self.send_error(500))
+
+    assert http_backend.read("kind", "abcd") is None
+    assert "Cache server: GET" in caplog.text
+    assert http_backend.available
+
+
+def test_http_backend_offline(http_backend, cache_server, offline):
+    http_backend.write("kind", "abcd", b"{}")
+
+    assert http_backend.read("kind", "abcd") is None
+    assert cache_server.entries == {}
+    assert http_backend.available
+
+
+def test_http_backend_unreachable(caplog):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    backend = cache.HTTPBackend(f"http://127.0.0.1:{port}")
+
+    assert backend.read("kind", "abcd") is None
+    assert not backend.available
+    assert "Cannot reach the cache server" in caplog.text
+    # Not tried again
+    caplog.clear()
+    backend.write("kind", "abcd", b"{}")
+    assert caplog.text == ""
+
+
+def test_layered_backend(tmp_path, http_backend, cache_server):
+    local = cache.DirectoryBackend(str(tmp_path))
+    backend = cache.LayeredBackend(local, http_backend)
+    cache_server.entries["/cache/kind/abcd.json"] = b"{}"
+
+    assert backend.read("kind", "abcd") == b"{}"
+    # Copied locally
+    assert local.read("kind", "abcd") == b"{}"
+
+    backend.write("kind", "efgh", b"[]")
+    assert local.read("kind", "efgh") == b"[]"
+    assert cache_server.entries["/cache/kind/efgh.json"] == b"[]"
+
+    backend.delete("kind", "efgh")
+    assert local.read("kind", "efgh") is None
+    assert "/cache/kind/efgh.json" not in cache_server.entries
+
+
+def test_get_backend(cache_dir):
+    backend = cache.get_backend()
+
+    assert isinstance(backend, cache.DirectoryBackend)
+    assert backend.directory == str(cache_dir)
+
+
+def test_get_backend_url(monkeypatch):
+    monkeypatch.setenv("RAINCOAT_CACHE_URL", "http://example.com/cache")
+
+    backend = cache.get_backend()
+
+    assert isinstance(backend, cache.LayeredBackend)
+    assert backend.remote.url == "http://example.com/cache"
+    # Shared, so that an unreachable server is only tried once
+    assert cache.get_backend() is backend
+
+
+def test_get_backend_local_kind(monkeypatch, cache_dir):
+    monkeypatch.setenv("RAINCOAT_CACHE_URL", "http://example.com/cache")
+
+    for kind in ("http", "scan-index", "django-local-index"):
+        backend = cache.Cache(kind).backend
+
+        assert isinstance(backend, cache.DirectoryBackend)
+        assert backend.directory == str(cache_dir)
+
+
+def test_cache_shared_between_machines(tmp_path, cache_server, monkeypatch):
+    host, port = cache_server.server_address
+    monkeypatch.setenv("RAINCOAT_CACHE_URL", f"http://{host}:{port}")
+
+    cache.Cache("a", directory=str(tmp_path / "runner1")).set("b", [1])
+
+    assert cache.Cache("a", directory=str(tmp_path / "runner2")).get("b") == [1]
+
+
+def test_record_access(my_cache):
+    my_cache.set("a", 1)
+    my_cache.get("a")
+    my_cache.get("b")
+    my_cache.get("b")
+
+    assert cache.counters == {("my-kind", "hits"): 1, ("my-kind", "misses"): 2}
+
+
+def test_save_stats(cache_dir):
+    cache.record_access("a", hit=True)
+    cache.save_stats()
+    cache.record_access("a", hit=True)
+    cache.record_access("a", hit=False)
+    cache.save_stats()
+
+    assert cache.read_stats() == {"a": {"hits": 2, "misses": 1}}
+    assert not cache.counters
+
+
+def test_save_stats_nothing(cache_dir):
+    cache.save_stats()
+
+    assert not os.path.exists(cache.get_stats_path())
+
+
+def test_read_stats_corrupted(cache_dir, caplog):
+    with open(cache.get_stats_path(), "w") as handler:
+        handler.write("{")
+
+    assert cache.read_stats() == {}
+    assert "unreadable cache statistics" in caplog.text
+
+
+def test_read_touches(my_cache):
+    my_cache.set("a", 1)
+    os.utime(get_path(my_cache, "a"), (1000, 1000))
+
+    my_cache.get("a")
+
+    assert os.stat(get_path(my_cache, "a")).st_mtime > 1000
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import os
+import time
+
+import pytest
+
+from raincoat import cache, cache_usage
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("1000", 1000),
+        ("500K", 500 * 1024),
+        ("2G", 2 * 1024**3),
+        ("1.5m", int(1.5 * 1024**2)),
+        ("10 MiB", 10 * 1024**2),
+        ("3GB", 3 * 1024**3),
+    ],
+)
+def test_parse_size(value, expected):
+    assert cache_usage.parse_size(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "G", "3X", "-1M"])
+def test_parse_size_error(value):
+    with pytest.raises(ValueError):
+        cache_usage.parse_size(value)
+
+
+@pytest.mark.parametrize(
+    "size, expected",
+    [(12, "12 B"), (2048, "2.0 KB"), (5 * 1024**3, "5.0 GB"), (3 * 1024**4, "3.0 TB")],
+)
+def test_format_size(size, expected):
+    assert cache_usage.format_size(size) == expected
+
+
+def set_entry(kind, key, size, last_access):
+    my_cache = cache.Cache(kind)
+    my_cache.set(key, "x" * size)
+    path = my_cache.backend.get_path(kind, my_cache.get_name(key))
+    os.utime(path, (last_access, last_access))
+    return path
+
+
+def add_archive(cache_dir, package, version, size, last_access):
+    directory = cache_dir / "archives" / package / version
+    directory.mkdir(parents=True)
+    (directory / f"{package}-{version}.tar.gz").write_bytes(b"x" * size)
+    os.utime(directory, (last_access, last_access))
+    return str(directory)
+
+
+def test_list_items(cache_dir):
+    path = set_entry("http", "a", 10, 1000)
+    archive = add_archive(cache_dir, "django", "4.2", 100, 2000)
+    # Downloads in progress are ignored
+    (cache_dir / "archives" / "django" / "tmpabcd").mkdir()
+
+    items = sorted(cache_usage.list_items())
+
+    assert items == [
+        cache_usage.Item("archives", archive, 100, 2000),
+        cache_usage.Item("http", path, os.stat(path).st_size, 1000),
+    ]
+
+
+def test_list_items_no_directory(tmp_path):
+    assert list(cache_usage.list_items(str(tmp_path / "nope"))) == []
+
+
+def test_get_stats(cache_dir):
+    set_entry("http", "a", 10, 1000)
+    set_entry("http", "b", 10, 1000)
+    add_archive(cache_dir, "django", "4.2", 100, 2000)
+    cache.Cache("http").get("a")
+    cache.Cache("http").get("c")
+    cache.Cache("gone").get("c")
+
+    stats = cache_usage.get_stats()
+
+    assert stats["http"]["entries"] == 2
+    assert stats["http"]["hits"] == 1
+    assert stats["http"]["misses"] == 1
+    assert stats["archives"] == {"entries": 1, "size": 100, "hits": 0, "misses": 0}
+    assert stats["gone"] == {"entries": 0, "size": 0, "hits": 0, "misses": 1}
+
+
+def test_prune(cache_dir):
+    old = set_entry("http", "old", 100, 1000)
+    recent = set_entry("http", "recent", 100, 3000)
+    archive = add_archive(cache_dir, "django", "4.2", 1000, 2000)
+    old_size = os.path.getsize(old)
+
+    removed, freed = cache_usage.prune(os.path.getsize(recent))
+
+    assert (removed, freed) == (2, old_size + 1000)
+    assert not os.path.exists(old)
+    assert not os.path.exists(archive)
+    assert os.path.exists(recent)
+
+
+def test_prune_nothing(cache_dir):
+    set_entry("http", "a", 100, 1000)
+
+    assert cache_usage.prune(10**6) == (0, 0)
+
+
+def test_prune_reading_updates_last_access(cache_dir):
+    first = set_entry("http", "first", 100, 1000)
+    second = set_entry("http", "second", 100, 2000)
+    cache.Cache("http").get("first")
+
+    cache_usage.prune(os.path.getsize(second))
+
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+
+
+def test_clear(cache_dir):
+    set_entry("http", "a", 10, 1000)
+    set_entry("python-elements", "a", 10, 1000)
+    cache.Cache("http").get("a")
+    cache.save_stats()
+
+    cache_usage.clear(["http"])
+    assert os.listdir(cache_dir / "python-elements")
+    assert not (cache_dir / "http").exists()
+
+    cache_usage.clear()
+    assert not (cache_dir / "python-elements").exists()
+    assert cache.read_stats() == {}
+
+
+@pytest.mark.parametrize("kind", ["..", "../victim", "/tmp"])
+def test_clear_not_a_kind(cache_dir, kind):
+    set_entry("http", "a", 10, 1000)
+    victim = cache_dir.parent / "victim"
+    victim.mkdir(exist_ok=True)
+
+    with pytest.raises(ValueError):
+        cache_usage.clear([kind])
+
+    assert victim.exists()
+    assert (cache_dir / "http").exists()
+
+
+def test_list_kinds(cache_dir):
+    set_entry("http", "a", 10, 1000)
+    add_archive(cache_dir, "django", "4.2", 100, 2000)
+    cache.save_stats()
+
+    assert cache_usage.list_kinds() == ["archives", "http"]
+
+
+def test_evict_if_needed(cache_dir, monkeypatch):
+    monkeypatch.setenv("RAINCOAT_CACHE_MAX_SIZE", "1K")
+    old = set_entry("http", "old", 1000, 1000)
+    recent = set_entry("http", "recent", 100, 2000)
+
+    cache_usage.evict_if_needed()
+
+    assert not os.path.exists(old)
+    assert os.path.exists(recent)
+
+
+def test_evict_if_needed_recently_checked(cache_dir, monkeypatch):
+    monkeypatch.setenv("RAINCOAT_CACHE_MAX_SIZE", "1K")
+    (cache_dir / ".last-eviction").write_text("")
+    old = set_entry("http", "old", 1000, 1000)
+
+    cache_usage.evict_if_needed()
+    assert os.path.exists(old)
+
+    past = time.time() - cache_usage.EVICTION_INTERVAL - 1
+    os.utime(cache_dir / ".last-eviction", (past, past))
+    cache_usage.evict_if_needed()
+    assert not os.path.exists(old)
+
+
+def test_evict_if_needed_no_budget(cache_dir, mocker):
+    list_items = mocker.patch("raincoat.cache_usage.list_items")
+
+    cache_usage.evict_if_needed()
+
+    assert list_items.mock_calls == []
+
+
+def test_evict_if_needed_under_budget(cache_dir, monkeypatch, mocker):
+    monkeypatch.setenv("RAINCOAT_CACHE_MAX_SIZE", "1M")
+    set_entry("http", "a", 1000, 1000)
+    prune = mocker.patch("raincoat.cache_usage.prune")
+
+    cache_usage.evict_if_needed()
+
+    assert prune.mock_calls == []
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import io
+import subprocess
+
+import pytest
+
+from raincoat import changes
+
+
+def test_parse_requirements():
+    content = """
+# Comment
+Django==4.2.1  # via something
+requests[socks] === 2.31.0
+umbrella>=1.0
+-r other.txt
+raincoat~=0.1 ; python_version < "3.9"
+"""
+    assert changes.parse_requirements(content) == {
+        "Django": "4.2.1",
+        "requests": "2.31.0",
+        "raincoat": "0.1",
+    }
+
+
+def test_parse_toml_lock():
+    content = """
+[[package]]
+name = "django"
+version = "4.2.1"
+description = "A web framework"
+
+[[package]]
+name = "umbrella"
+version = "1.0.0"
+"""
+    assert changes.parse_toml_lock(content) == {"django": "4.2.1", "umbrella": "1.0.0"}
+
+
+def test_parse_pipfile_lock():
+    content = '{"default": {"django": {"version": "==4.2.1"}}, "develop": {}}'
+    assert changes.parse_pipfile_lock(content) == {"django": "4.2.1"}
+
+
+def test_parse_raincoat_lock():
+    content = '{"versions": {"django": "4.2.1"}, "branches": {}}'
+    assert changes.parse_raincoat_lock(content) == {"django": "4.2.1"}
+
+
+@pytest.mark.parametrize(
+    "path, parser",
+    [
+        ("requirements.txt", changes.parse_requirements),
+        ("a/requirements-dev.txt", changes.parse_requirements),
+        ("requirements/base.txt", changes.parse_requirements),
+        ("a/poetry.lock", changes.parse_toml_lock),
+        ("Pipfile.lock", changes.parse_pipfile_lock),
+        ("a/b.txt", None),
+        ("a.py", None),
+    ],
+)
+def test_get_parser(path, parser):
+    assert changes.get_parser(path) is parser
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    def git(*args):
+        subprocess.run(
+            ["git", "-c", "user.name=a", "-c", "user.email=a@b.c", *args],
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+    git("init", "-q", ".")
+    (tmp_path / "a.py").write_text("")
+    (tmp_path / "b.py").write_text("")
+    (tmp_path / "requirements.txt").write_text("django==4.2\numbrella==1.0\n")
+    git("add", ".")
+    git("commit", "-q", "-m", "Initial")
+    return tmp_path
+
+
+def test_since(repo):
+    (repo / "a.py").write_text("a = 1")
+    (repo / "c.py").write_text("")
+    (repo / "requirements.txt").write_text("django==5.0\numbrella==1.0\nrc==1\n")
+
+    assert changes.since("HEAD") == changes.Changes(
+        files={"a.py", "c.py", "requirements.txt"}, packages={"django", "rc"}
+    )
+
+
+def test_since_unknown_ref(repo):
+    with pytest.raises(changes.RaincoatException):
+        changes.since("nope")
+
+
+def test_from_file_list():
+    handler = io.StringIO("a.py\n\n./b/c.py\n")
+
+    assert changes.from_file_list(handler) == changes.Changes(
+        files={"a.py", "b/c.py"}, packages=set()
+    )
@@ -5,7 +5,8 @@ import logging
 import click
 import pytest
 
-from raincoat import cli, exceptions
+from raincoat import cli, exceptions, lock, settings, shard
+from raincoat.match import Unknown
 
 
 @pytest.mark.parametrize(
@@ -28,6 +29,18 @@ def test_set_verbosity(mocker, caplog):
     assert records[0].value == "DEBUG"
 
 
+def test_set_verbosity_configured(monkeypatch):
+    # In the daemon, logging is already configured
+    root_logger = logging.getLogger()
+    monkeypatch.setattr(root_logger, "level", logging.WARNING)
+
+    cli.set_verbosity(1)
+    assert root_logger.level == logging.DEBUG
+
+    cli.set_verbosity(0)
+    assert root_logger.level == logging.INFO
+
+
 @pytest.mark.parametrize(
     "raised, expected",
     [
@@ -58,12 +71,185 @@ def test_handle_errors_no_error():
 
 def test_main(mocker):
     environ = mocker.patch("os.environ", {"LANG": "fr-FR.UTF-8"})
+    mocker.patch("raincoat.daemon.forward", return_value=None)
     mocker.patch("raincoat.cli.cli")
     cli.main()
 
     assert environ == {"LANG": "fr-FR.UTF-8", "LC_ALL": "C.UTF-8"}
 
 
+def test_main_forward(mocker):
+    mocker.patch("sys.argv", ["raincoat", "src"])
+    forward = mocker.patch("raincoat.daemon.forward", return_value=3)
+    main_cli = mocker.patch("raincoat.cli.cli")
+
+    with pytest.raises(SystemExit) as exc_info:
+        cli.main()
+
+    assert exc_info.value.code == 3
+    assert forward.mock_calls == [mocker.call(["src"])]
+    assert main_cli.mock_calls == []
+
+
+@pytest.mark.parametrize(
+    "argv, env",
+    [(["raincoat", "daemon"], {}), (["raincoat"], {"RAINCOAT_NO_DAEMON": "1"})],
+)
+def test_main_no_forward(mocker, monkeypatch, argv, env):
+    mocker.patch("sys.argv", argv)
+    for key, value in env.items():
+        monkeypatch.setenv(key, value)
+    forward = mocker.patch("raincoat.daemon.forward")
+    main_cli = mocker.patch("raincoat.cli.cli")
+
+    cli.main()
+
+    assert forward.mock_calls == []
+    assert main_cli.called
+
+
+def test_main_no_forward_watch(mocker):
+    mocker.patch("sys.argv", ["raincoat", "--watch"])
+    forward = mocker.patch("raincoat.daemon.forward")
+    mocker.patch("raincoat.cli.cli")
+
+    cli.main()
+
+    assert forward.mock_calls == []
+
+
+def test_check_watch(cli_runner, mocker):
+    watch = mocker.patch("raincoat.watch.watch")
+
+    def lines(*args, **kwargs):
+        yield "Oh :("
+        raise KeyboardInterrupt
+
+    watch.side_effect = lines
+
+    result = cli_runner.invoke(cli.cli, ["check", "--watch", "."])
+
+    assert result.exit_code == 0, result.output
+    assert result.output == "Oh :(\n"
+    assert watch.call_args[0] == ((".",),)
+
+
+def test_check_watch_since(cli_runner):
+    result = cli_runner.invoke(cli.cli, ["check", "--watch", "--since", "HEAD"])
+
+    assert result.exit_code == 2
+    assert "--watch cannot be used" in result.output
+
+
+def test_lsp(cli_runner, mocker):
+    serve = mocker.patch("raincoat.lsp.serve", return_value=0)
+
+    result = cli_runner.invoke(cli.cli, ["lsp"])
+
+    assert result.exit_code == 0, result.output
+    assert serve.called
+
+
+def test_cache_stats(cli_runner, mocker):
+    mocker.patch(
+        "raincoat.cache_usage.get_stats",
+        return_value={
+            "http": {"entries": 3, "size": 2048, "hits": 3, "misses": 1},
+            "archives": {"entries": 1, "size": 12, "hits": 0, "misses": 0},
+        },
+    )
+
+    result = cli_runner.invoke(cli.cli, ["cache", "stats"])
+
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        "Kind                          Entries       Size     Hits   Misses  Hit rate",
+        "archives                            1       12 B        0        0         -",
+        "http                                3     2.0 KB        3        1       75%",
+        "Total                               4     2.0 KB        3        1       75%",
+    ]
+
+
+def test_cache_prune(cli_runner, mocker):
+    prune = mocker.patch("raincoat.cache_usage.prune", return_value=(2, 2048))
+
+    result = cli_runner.invoke(cli.cli, ["cache", "prune", "--max-size", "1M"])
+
+    assert result.output == "Removed 2 entries (2.0 KB).\n"
+    assert prune.mock_calls == [mocker.call(1024**2)]
+
+
+def test_cache_prune_setting(cli_runner, mocker, monkeypatch):
+    monkeypatch.setenv("RAINCOAT_CACHE_MAX_SIZE", "2K")
+    prune = mocker.patch("raincoat.cache_usage.prune", return_value=(0, 0))
+
+    cli_runner.invoke(cli.cli, ["cache", "prune"])
+
+    assert prune.mock_calls == [mocker.call(2048)]
+
+
+@pytest.mark.parametrize(
+    "args, message",
+    [([], "--max-size is required"), (["--max-size", "3X"], "Invalid size")],
+)
+def test_cache_prune_error(cli_runner, args, message):
+    result = cli_runner.invoke(cli.cli, ["cache", "prune", *args])
+
+    assert result.exit_code == 2
+    assert message in result.output
+
+
+def test_cache_clear(cli_runner, mocker, cache_dir):
+    (cache_dir / "http").mkdir()
+    clear = mocker.patch("raincoat.cache_usage.clear")
+
+    result = cli_runner.invoke(cli.cli, ["cache", "clear", "http"])
+
+    assert result.output == "Cache cleared.\n"
+    assert clear.mock_calls == [mocker.call(("http",))]
+
+
+@pytest.mark.parametrize("kind", ["../victim", "/home/me/project", "nope"])
+def test_cache_clear_not_a_kind(cli_runner, cache_dir, kind):
+    (cache_dir / "http").mkdir()
+    victim = cache_dir.parent / "victim"
+    victim.mkdir(exist_ok=True)
+
+    result = cli_runner.invoke(cli.cli, ["cache", "clear", kind])
+
+    assert result.exit_code == 2
+    assert "is not a kind of cache (existing: http)" in result.output
+    assert victim.exists()
+    assert (cache_dir / "http").exists()
+
+
+def test_cli_end_of_run(cli_runner, mocker):
+    mocker.patch("raincoat.glue.raincoat", return_value=[])
+    end_of_run = mocker.patch("raincoat.cache_usage.end_of_run")
+
+    cli_runner.invoke(cli.cli, ["check"])
+
+    assert end_of_run.called
+
+
+def test_daemon_command(cli_runner, mocker):
+    serve = mocker.patch("raincoat.daemon.serve")
+
+    result = cli_runner.invoke(cli.cli, ["daemon"])
+
+    assert result.exit_code == 0, result.output
+    assert serve.called
+
+
+def test_daemon_command_stop(cli_runner, mocker):
+    mocker.patch("raincoat.daemon.stop", return_value=False)
+
+    result = cli_runner.invoke(cli.cli, ["daemon", "--stop"])
+
+    assert result.exit_code == 1
+    assert "No daemon is running." in result.output
+
+
 def test_cli(cli_runner, mocker, match):
     raincoat = mocker.patch("raincoat.glue.raincoat")
 
@@ -85,9 +271,194 @@ def test_cli_path(cli_runner, mocker, match):
     cli_runner.invoke(cli.cli, ["tests", "raincoat", "--exclude=*.py"])
 
     assert raincoat.mock_calls[0] == (
-        mocker.call.raincoat(path="tests", exclude=("*.py",), color=False)
+        mocker.call.raincoat(
+            path="tests", exclude=("*.py",), color=False, changes=None, shard=None
+        )
     )
 
     assert raincoat.mock_calls[2] == (
-        mocker.call.raincoat(path="raincoat", exclude=("*.py",), color=False)
+        mocker.call.raincoat(
+            path="raincoat",
+            exclude=("*.py",),
+            color=False,
+            changes=None,
+            shard=None,
+        )
     )
+
+
+def test_cli_offline_unknown(cli_runner, mocker):
+    def raincoat(**kwargs):
+        assert settings.is_offline()
+        yield Unknown("Could not be checked")
+
+    mocker.patch("raincoat.glue.raincoat", side_effect=raincoat)
+
+    result = cli_runner.invoke(cli.cli, ["--offline"])
+
+    assert "Could not be checked\n" in result.output
+    assert "1 match(es) could not be checked." in result.output
+    assert result.exit_code == 0
+    assert not settings.is_offline()
+
+
+def test_cli_check(cli_runner, mocker):
+    raincoat = mocker.patch("raincoat.glue.raincoat", return_value=[])
+
+    result = cli_runner.invoke(cli.cli, ["check", "tests"])
+
+    assert result.exit_code == 0
+    assert raincoat.mock_calls == [
+        mocker.call(path="tests", exclude=(), color=False, changes=None, shard=None)
+    ]
+
+
+def test_cli_default_command(cli_runner, mocker):
+    raincoat = mocker.patch("raincoat.glue.raincoat", return_value=[])
+
+    result = cli_runner.invoke(cli.cli, ["tests"])
+
+    assert result.exit_code == 0
+    assert raincoat.call_args.kwargs["path"] == "tests"
+
+
+def test_cli_default_command_path_named_like_command(
+    cli_runner, mocker, tmp_path, monkeypatch
+):
+    raincoat = mocker.patch("raincoat.glue.raincoat", return_value=[])
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache").mkdir()
+
+    result = cli_runner.invoke(cli.cli, ["cache"])
+
+    assert result.exit_code == 0, result.output
+    assert raincoat.call_args.kwargs["path"] == "cache"
+
+
+@pytest.mark.parametrize(
+    "args", [["-V"], ["-v", "-V"], ["-v", "--version"], ["--offline", "-V"]]
+)
+def test_cli_group_options(cli_runner, mocker, args):
+    raincoat = mocker.patch("raincoat.glue.raincoat", return_value=[])
+
+    result = cli_runner.invoke(cli.cli, args)
+
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith(f"{cli.PROGRAM_NAME}, version ")
+    assert not raincoat.called
+
+
+def test_cli_group_help(cli_runner):
+    result = cli_runner.invoke(cli.cli, ["-v", "-h"])
+
+    assert result.exit_code == 0, result.output
+    assert "Without a command, runs" in result.output
+
+
+def test_cli_fetch(cli_runner, mocker):
+    fetch = mocker.patch("raincoat.glue.fetch", return_value=3)
+
+    result = cli_runner.invoke(cli.cli, ["fetch", "--exclude=*.py"])
+
+    assert result.output == "Fetched the data of 3 match(es).\n"
+    assert fetch.mock_calls == [mocker.call(path=".", exclude=("*.py",), shard=None)]
+
+
+def test_cli_update_lock(cli_runner, mocker, tmp_path):
+    path = tmp_path / "raincoat.lock"
+
+    def fetch(**kwargs):
+        lock.get_lock().set("versions", "django", "4.2")
+        return 1
+
+    mocker.patch("raincoat.glue.fetch", side_effect=fetch)
+
+    with settings.override(lock=str(path)):
+        result = cli_runner.invoke(cli.cli, ["fetch", "--update-lock"])
+
+    assert result.exit_code == 0
+    assert '"django": "4.2"' in path.read_text()
+
+
+def test_cli_files_from(cli_runner, mocker):
+    raincoat = mocker.patch("raincoat.glue.raincoat", return_value=[])
+
+    cli_runner.invoke(cli.cli, ["--files-from", "-"], input="a.py\n")
+
+    assert raincoat.call_args.kwargs["changes"].files == {"a.py"}
+
+
+def test_cli_since_files_from(cli_runner):
+    result = cli_runner.invoke(cli.cli, ["--files-from", "-", "--since", "HEAD"])
+
+    assert result.exit_code == 2
+
+
+def test_cli_shard_report(cli_runner, mocker, tmp_path):
+    raincoat = mocker.patch(
+        "raincoat.glue.raincoat", return_value=["Oh :(", Unknown("Not checked")]
+    )
+    report = tmp_path / "report.json"
+
+    result = cli_runner.invoke(
+        cli.cli, ["--shard", "2/3", "--report", str(report), "--no-color"]
+    )
+
+    assert result.exit_code == 1
+    assert raincoat.call_args.kwargs["shard"] == (2, 3)
+    assert shard.read_report(str(report)) == (
+        [2, 3],
+        [
+            {"output": "Oh :(", "unknown": False},
+            {"output": "Not checked", "unknown": True},
+        ],
+    )
+
+
+def test_cli_shard_invalid(cli_runner):
+    result = cli_runner.invoke(cli.cli, ["--shard", "4/3"])
+
+    assert result.exit_code == 2
+    assert "between 1 and 3" in result.output
+
+
+def test_cli_fetch_shard(cli_runner, mocker):
+    fetch = mocker.patch("raincoat.glue.fetch", return_value=3)
+
+    cli_runner.invoke(cli.cli, ["fetch", "--shard", "1/2"])
+
+    assert fetch.call_args.kwargs["shard"] == (1, 2)
+
+
+def test_merge_reports(cli_runner, tmp_path):
+    paths = []
+    for index, results in [(1, [("Oh :(", False)]), (2, [("Not checked", True)])]:
+        paths.append(str(tmp_path / f"{index}.json"))
+        shard.write_report(paths[-1], shard.Shard(index, 2), results)
+
+    result = cli_runner.invoke(cli.cli, ["merge-reports", *paths])
+
+    assert result.output == (
+        "Not checked\nOh :(\n1 match(es) could not be checked.\n"
+        "Error: Inconsistencies were found.\n"
+    )
+    assert result.exit_code == 1
+
+
+def test_merge_reports_missing_shard(cli_runner, tmp_path):
+    path = str(tmp_path / "1.json")
+    shard.write_report(path, shard.Shard(1, 2), [])
+
+    result = cli_runner.invoke(cli.cli, ["merge-reports", path])
+
+    assert result.exit_code == 1
+    assert "missing: [2]" in result.output
+
+
+def test_cli_affected_by(cli_runner, mocker):
+    raincoat = mocker.patch("raincoat.glue.raincoat", return_value=[])
+
+    cli_runner.invoke(cli.cli, ["--affected-by", "django"])
+
+    changes = raincoat.call_args.kwargs["changes"]
+    assert (changes.files, changes.packages) == (set(), {"django"})
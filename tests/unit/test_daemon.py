@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import io
+import logging
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+from raincoat import daemon, exceptions, http_utils
+from raincoat.match import python
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    # Unix socket paths are limited to ~100 characters
+    path = os.path.join("/tmp", f"raincoat-test-{os.getpid()}-{id(tmp_path)}.sock")
+    yield path
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@pytest.fixture
+def running_daemon(socket_path, monkeypatch, mocker):
+    monkeypatch.setattr(http_utils, "shared_adapters", None)
+    mocker.patch.object(daemon.Daemon, "warm_up")
+    thread = threading.Thread(target=daemon.serve, args=(socket_path,))
+    thread.start()
+    while not os.path.exists(socket_path):
+        thread.join(0.01)
+    yield socket_path
+    daemon.stop(socket_path)
+    thread.join()
+
+
+def test_get_socket_path(monkeypatch, cache_dir):
+    signature = daemon.get_code_signature()
+    assert daemon.get_socket_path() == os.path.join(
+        str(cache_dir), f"daemon-{signature}.sock"
+    )
+
+
+def test_get_code_signature(monkeypatch):
+    signature = daemon.get_code_signature()
+    assert daemon.get_code_signature() == signature
+
+    # Another virtualenv
+    monkeypatch.setattr(sys, "prefix", "/elsewhere")
+    assert daemon.get_code_signature() != signature
+
+
+def test_get_socket_path_env(monkeypatch):
+    monkeypatch.setenv("RAINCOAT_DAEMON_SOCKET", "/tmp/a.sock")
+    assert daemon.get_socket_path() == "/tmp/a.sock"
+
+
+def test_forward_not_running(socket_path):
+    assert daemon.forward(["."], path=socket_path) is None
+
+
+def test_stop_not_running(socket_path):
+    assert daemon.stop(socket_path) is False
+
+
+def test_forward_no_unix_sockets(socket_path, monkeypatch):
+    monkeypatch.setattr(daemon, "HAS_UNIX_SOCKETS", False)
+
+    assert daemon.forward(["."], path=socket_path) is None
+    with pytest.raises(exceptions.RaincoatException):
+        daemon.serve(socket_path)
+
+
+def test_forward(running_daemon, tmp_path, monkeypatch, capsys):
+    tmp_path.joinpath("a.py").write_text("# Raincoat: nothing to see here\n")
+    monkeypatch.chdir(tmp_path)
+
+    exit_code = daemon.forward(["--no-color", "."], path=running_daemon)
+
+    assert exit_code == 0
+    assert os.getcwd() == str(tmp_path)
+
+
+def test_forward_error(running_daemon, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+
+    exit_code = daemon.forward(["--files-from", "missing.txt"], running_daemon)
+
+    assert exit_code == 2
+    assert "missing.txt" in capsys.readouterr().err
+
+
+def test_forward_other_code(running_daemon, tmp_path, monkeypatch, mocker):
+    monkeypatch.chdir(tmp_path)
+    mocker.patch("raincoat.daemon.get_code_signature", return_value="other")
+    main = mocker.patch("raincoat.cli.cli.main")
+
+    assert daemon.forward(["."], path=running_daemon) is None
+    assert main.mock_calls == []
+
+
+def test_forward_environment(running_daemon, tmp_path, monkeypatch, mocker):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("GITHUB_TOKEN", "abc")
+    environment = {}
+
+    def main(**kwargs):
+        environment.update(os.environ)
+
+    mocker.patch("raincoat.cli.cli.main", side_effect=main)
+
+    assert daemon.forward(["."], path=running_daemon) == 0
+    assert environment["GITHUB_TOKEN"] == "abc"
+
+
+def test_forward_logging(running_daemon, tmp_path, monkeypatch, mocker, capsys):
+    monkeypatch.chdir(tmp_path)
+    mocker.patch(
+        "raincoat.glue.raincoat", side_effect=exceptions.RaincoatException("Oh :(")
+    )
+    # The daemon was started with -v
+    root_logger = logging.getLogger()
+    daemon_output = io.StringIO()
+    daemon_handler = logging.StreamHandler(daemon_output)
+    monkeypatch.setattr(root_logger, "handlers", [daemon_handler])
+    monkeypatch.setattr(root_logger, "level", logging.DEBUG)
+
+    assert daemon.forward(["."], path=running_daemon) == 1
+    err = capsys.readouterr().err
+    assert "Oh :(" in err
+    assert "Exception details" not in err
+    assert "Log level set" not in err
+    assert "Oh :(" not in daemon_output.getvalue()
+
+    assert daemon.forward(["-v", "."], path=running_daemon) == 1
+    assert "Exception details" in capsys.readouterr().err
+
+    assert root_logger.handlers == [daemon_handler]
+    assert root_logger.level == logging.DEBUG
+
+
+def test_send_not_accepted(socket_path):
+    # Like a daemon busy with another request, or stuck
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+        server.listen(1)
+
+        assert daemon.send({"command": "ping"}, socket_path, timeout=0.1) is None
+    finally:
+        server.close()
+
+
+def test_serve_already_running(running_daemon):
+    with pytest.raises(exceptions.RaincoatException):
+        daemon.serve(running_daemon)
+
+
+def test_client_context(tmp_path, monkeypatch):
+    monkeypatch.setenv("RAINCOAT_OFFLINE", "1")
+    cwd = os.getcwd()
+
+    request = {
+        "cwd": str(tmp_path),
+        "env": {"RAINCOAT_LOCK": "a.lock", "XDG_CACHE_HOME": "/cache"},
+        "stdin": "a",
+    }
+    with daemon.client_context(request) as (stdout, stderr):
+        assert os.getcwd() == str(tmp_path)
+        assert "RAINCOAT_OFFLINE" not in os.environ
+        assert os.environ["RAINCOAT_LOCK"] == "a.lock"
+        assert os.environ["XDG_CACHE_HOME"] == "/cache"
+        assert not stdout.isatty()
+        print("yay")
+
+    assert stdout.getvalue() == "yay\n"
+    assert os.getcwd() == cwd
+    assert os.environ["RAINCOAT_OFFLINE"] == "1"
+    assert "RAINCOAT_LOCK" not in os.environ
+
+
+def test_daemon_run_exception(mocker, tmp_path):
+    mocker.patch("raincoat.cli.cli.main", side_effect=ValueError)
+
+    response = daemon.Daemon().run({"args": [], "cwd": str(tmp_path)})
+
+    assert response["exit_code"] == 1
+
+
+def test_daemon_refresh(mocker):
+    cache_clear = mocker.patch("raincoat.source.get_environment.cache_clear")
+    instance = daemon.Daemon()
+    instance.environment_signature = daemon.get_environment_signature()
+
+    instance.refresh()
+    assert cache_clear.mock_calls == []
+
+    instance.environment_signature = []
+    instance.refresh()
+    assert cache_clear.mock_calls == [mocker.call()]
+
+
+def test_daemon_warm_up(mocker, monkeypatch):
+    monkeypatch.setattr(http_utils, "shared_adapters", None)
+    monkeypatch.setattr(python, "elements_memory", {})
+    get_environment = mocker.patch("raincoat.source.get_environment")
+
+    daemon.Daemon().warm_up()
+
+    assert http_utils.shared_adapters == {}
+    assert get_environment.called
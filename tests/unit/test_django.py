@@ -1,8 +1,18 @@
 from __future__ import annotations
 
+import subprocess
+
 import pytest
 
-from raincoat.match import NotMatching, django
+from raincoat import cache
+from raincoat.exceptions import OfflineCacheMiss, RaincoatException
+from raincoat.github_utils import HIGH, LOW, NORMAL
+from raincoat.match import NotMatching, Unknown, django
+
+
+@pytest.fixture(autouse=True)
+def report_budget(mocker):
+    return mocker.patch("raincoat.github_utils.report_budget")
 
 
 @pytest.fixture
@@ -35,7 +45,8 @@ def test_is_commit_in_version_no(mocker):
     assert not django.is_commit_in_version("abcdef", "1.9", session)
 
     assert session.mock_calls[0] == mocker.call.get(
-        "https://api.github.com/repos/django/django/" "compare/abcdef...1.9"
+        "https://api.github.com/repos/django/django/" "compare/abcdef...1.9",
+        priority=HIGH,
     )
 
 
@@ -46,92 +57,154 @@ def test_is_commit_in_version_yes(mocker):
 django_repo = "https://api.github.com/repos/django/django"
 
 
-def test_get_merge_commit_sha1(mocker):
+search_url = "https://api.github.com/search/issues?q="
+query = "repo:django%2Fdjango+state:closed+in:title+type:pr+%2326976&per_page=100"
+
+
+@pytest.fixture
+def session(mocker):
     session = mocker.MagicMock()
+    session.get.return_value.links = {}
+    return session
 
+
+def test_get_merge_commit_sha1(mocker, session):
     session.get.return_value.status_code = 204
     session.get.return_value.json.side_effect = [
-        {"items": [{"number": 1234}]},
+        {"items": [{"number": 1234, "title": "Fixed #26976 -- Yay"}]},
         {"merge_commit_sha": "deadbeef"},
     ]
 
     assert django.get_merge_commit_sha1(26976, session) == "deadbeef"
-    query = (
-        "repo:django%2Fdjango+state:closed+in:title+"
-        "type:pr+%2326976%20+%2326976%2C+%2326976:+%2326976%29"
-    )
 
     assert session.get.call_args_list == [
-        mocker.call("https://api.github.com/search/issues?q=" + query),
-        mocker.call(django_repo + "/pulls/1234/merge"),
-        mocker.call(django_repo + "/pulls/1234"),
+        mocker.call(search_url + query, priority=NORMAL),
+        mocker.call(django_repo + "/pulls/1234/merge", priority=NORMAL),
+        mocker.call(django_repo + "/pulls/1234", priority=NORMAL),
     ]
 
 
-def test_get_merge_commit_sha1_manually_merged(mocker):
-    session = mocker.MagicMock()
-
+def test_get_merge_commit_sha1_manually_merged(mocker, session):
     session.get.return_value.status_code = 200
     session.get.return_value.json.side_effect = [
-        {"items": [{"number": 1234}]},
+        {"items": [{"number": 1234, "title": "Fixed #26976 -- Yay"}]},
         [{"body": "merged in baadf00d"}],
     ]
 
     assert django.get_merge_commit_sha1(26976, session) == "baadf00d"
-    query = (
-        "repo:django%2Fdjango+state:closed+in:title+"
-        "type:pr+%2326976%20+%2326976%2C+%2326976:+%2326976%29"
-    )
 
     assert session.get.call_args_list == [
-        mocker.call("https://api.github.com/search/issues?q=" + query),
-        mocker.call(django_repo + "/pulls/1234/merge"),
-        mocker.call(django_repo + "/issues/1234/comments"),
+        mocker.call(search_url + query, priority=NORMAL),
+        mocker.call(django_repo + "/pulls/1234/merge", priority=NORMAL),
+        mocker.call(django_repo + "/issues/1234/comments", priority=LOW),
     ]
 
 
-def test_get_merge_commit_sha1_not_merged(mocker):
-    session = mocker.MagicMock()
-
+def test_get_merge_commit_sha1_not_merged(mocker, session):
     session.get.return_value.status_code = 200
     session.get.return_value.json.side_effect = [
-        {"items": [{"number": 1234}]},
+        {"items": [{"number": 1234, "title": "Fixed #26976 -- Yay"}]},
         [{"body": "yay"}],
     ]
 
     assert django.get_merge_commit_sha1(26976, session) is None
-    query = (
-        "repo:django%2Fdjango+state:closed+in:title+"
-        "type:pr+%2326976%20+%2326976%2C+%2326976:+%2326976%29"
-    )
 
     assert session.get.call_args_list == [
-        mocker.call("https://api.github.com/search/issues?q=" + query),
-        mocker.call(django_repo + "/pulls/1234/merge"),
-        mocker.call(django_repo + "/issues/1234/comments"),
+        mocker.call(search_url + query, priority=NORMAL),
+        mocker.call(django_repo + "/pulls/1234/merge", priority=NORMAL),
+        mocker.call(django_repo + "/issues/1234/comments", priority=LOW),
     ]
 
 
-def test_get_merge_commit_sha1_same_number(mocker):
-    session = mocker.MagicMock()
-
+def test_get_merge_commit_sha1_same_number(mocker, session):
     session.get.return_value.status_code = 200
     session.get.return_value.json.side_effect = [
-        {"items": [{"number": 26976}]},
+        {"items": [{"number": 26976, "title": "Fixed #26976 -- Yay"}]},
         [{"body": "merged in 01020304"}],
     ]
 
     assert django.get_merge_commit_sha1(26976, session) is None
-    query = (
-        "repo:django%2Fdjango+state:closed+in:title+"
-        "type:pr+%2326976%20+%2326976%2C+%2326976:+%2326976%29"
-    )
 
     assert session.get.call_args_list == [
-        mocker.call("https://api.github.com/search/issues?q=" + query),
+        mocker.call(search_url + query, priority=NORMAL),
+    ]
+
+
+def test_search_ticket_prs_batches(mocker, session, monkeypatch):
+    monkeypatch.setattr(django, "TICKETS_PER_SEARCH", 2)
+    session.get.return_value.json.side_effect = [
+        {
+            "items": [
+                {"number": 1, "title": "Fixed #10, #20 -- Yay"},
+                {"number": 2, "title": "Refs #20 -- Yay"},
+                {"number": 3, "title": "Fixed #200 -- Not the same ticket"},
+            ]
+        },
+        {"items": [{"number": 4, "title": "Fixed #30."}]},
+    ]
+
+    assert django.search_ticket_prs([30, 20, "10", 20], session) == {
+        10: [1],
+        20: [1, 2],
+        30: [4],
+    }
+
+    assert session.get.call_args_list == [
+        mocker.call(
+            search_url + "repo:django%2Fdjango+state:closed+in:title+type:pr+"
+            "%2310+OR+%2320&per_page=100",
+            priority=NORMAL,
+        ),
+        mocker.call(
+            search_url + "repo:django%2Fdjango+state:closed+in:title+type:pr+"
+            "%2330&per_page=100",
+            priority=NORMAL,
+        ),
     ]
 
 
+def test_search_ticket_prs_pages(mocker, session):
+    first, second = mocker.MagicMock(), mocker.MagicMock()
+    first.links = {"next": {"url": "https://next"}}
+    first.json.return_value = {"items": [{"number": 1, "title": "Fixed #10"}]}
+    second.links = {}
+    second.json.return_value = {"items": [{"number": 2, "title": "Refs #10"}]}
+    session.get.side_effect = [first, second]
+
+    assert django.search_ticket_prs([10], session) == {10: [1, 2]}
+    assert session.get.call_args_list[1] == mocker.call("https://next", priority=NORMAL)
+
+
+def test_get_merge_commit_sha1s(mocker, session):
+    mocker.patch(
+        "raincoat.match.django.search_ticket_prs",
+        return_value={10: [1, 2], 20: [3], 30: []},
+    )
+    mocker.patch(
+        "raincoat.match.django.get_pr_merge_commit_sha1",
+        side_effect=lambda number, session: {2: "abc", 3: "def"}.get(number),
+    )
+
+    assert django.get_merge_commit_sha1s([10, 20, 30], session) == {
+        10: "abc",
+        20: "def",
+        30: None,
+    }
+
+
+def test_are_commits_in_version(mocker, session):
+    is_commit_in_version = mocker.patch(
+        "raincoat.match.django.is_commit_in_version",
+        side_effect=lambda commit, version, session: commit == "abc",
+    )
+
+    assert django.are_commits_in_version(["abc", "def"], "1.9", session) == {
+        "abc": True,
+        "def": False,
+    }
+    assert is_commit_in_version.call_count == 2
+
+
 def test_get_match_info(fixed_match, not_fixed_match):
     assert django.DjangoChecker().get_match_info(
         [fixed_match, fixed_match, not_fixed_match]
@@ -139,7 +212,9 @@ def test_get_match_info(fixed_match, not_fixed_match):
 
 
 def test_check_matches(mocker, fixed_match):
-    mocker.patch("raincoat.match.django.get_merge_commit_sha1", return_value="123")
+    mocker.patch(
+        "raincoat.match.django.get_merge_commit_sha1s", return_value={26976: "123"}
+    )
     mocker.patch("raincoat.match.django.is_commit_in_version", return_value=True)
 
     result = list(django.DjangoChecker().check_matches({26976: [fixed_match]}, "1.9"))
@@ -147,14 +222,20 @@ def test_check_matches(mocker, fixed_match):
 
 
 def test_check_matches_no_pr(mocker, fixed_match):
-    mocker.patch("raincoat.match.django.get_merge_commit_sha1", return_value=None)
+    mocker.patch(
+        "raincoat.match.django.get_merge_commit_sha1s", return_value={26976: None}
+    )
+    is_commit_in_version = mocker.patch("raincoat.match.django.is_commit_in_version")
 
     result = list(django.DjangoChecker().check_matches({26976: [fixed_match]}, "1.9"))
     assert result == []
+    assert is_commit_in_version.mock_calls == []
 
 
 def test_check_matches_not_merged(mocker, fixed_match):
-    mocker.patch("raincoat.match.django.get_merge_commit_sha1", return_value="123")
+    mocker.patch(
+        "raincoat.match.django.get_merge_commit_sha1s", return_value={26976: "123"}
+    )
     mocker.patch("raincoat.match.django.is_commit_in_version", return_value=False)
 
     result = list(django.DjangoChecker().check_matches({26976: [fixed_match]}, "1.9"))
@@ -162,7 +243,9 @@ def test_check_matches_not_merged(mocker, fixed_match):
 
 
 def test_check(mocker, fixed_match):
-    mocker.patch("raincoat.match.django.get_merge_commit_sha1", return_value="123")
+    mocker.patch(
+        "raincoat.match.django.get_merge_commit_sha1s", return_value={26976: "123"}
+    )
     mocker.patch("raincoat.match.django.is_commit_in_version", return_value=True)
     mocker.patch(
         "raincoat.match.django.source.get_current_or_latest_version",
@@ -172,3 +255,210 @@ def test_check(mocker, fixed_match):
     result = list(django.DjangoChecker().check([fixed_match]))
 
     assert result == [("Ticket #26976 has been merged in Django 1.9", fixed_match)]
+
+
+def test_check_matches_cached(mocker, fixed_match, report_budget):
+    get_sha1s = mocker.patch(
+        "raincoat.match.django.get_merge_commit_sha1s", return_value={26976: "123"}
+    )
+    is_commit_in_version = mocker.patch(
+        "raincoat.match.django.is_commit_in_version", return_value=True
+    )
+    checker = django.DjangoChecker()
+
+    first = list(checker.check_matches({26976: [fixed_match]}, "1.9"))
+    report_budget.reset_mock()
+    second = list(checker.check_matches({26976: [fixed_match]}, "1.9"))
+
+    assert first == second
+    assert get_sha1s.call_count == 1
+    assert is_commit_in_version.call_count == 1
+    assert report_budget.mock_calls == []
+
+
+def test_get_merge_commit_sha1s_cache(mocker, session):
+    get_sha1s = mocker.patch(
+        "raincoat.match.django.get_merge_commit_sha1s",
+        return_value={10: "abc", 20: None},
+    )
+    cache = django.Cache("django-tickets")
+    checker = django.DjangoChecker()
+
+    assert checker.get_merge_commit_sha1s([10, 20], session) == {10: "abc", 20: None}
+
+    assert cache.get_entry("10").expires_at is None
+    unmerged = cache.get_entry("20")
+    assert unmerged.value is None
+    assert unmerged.expires_at == pytest.approx(
+        unmerged.stored_at + django.UNMERGED_TICKET_TTL
+    )
+
+    # Unmerged tickets are looked up again once expired
+    cache.set("20", None, ttl=-1)
+    get_sha1s.return_value = {20: "def"}
+
+    assert checker.get_merge_commit_sha1s([10, 20], session) == {10: "abc", 20: "def"}
+    assert get_sha1s.call_args == mocker.call([20], session)
+
+
+def test_are_commits_in_version_cache(mocker, session):
+    are_commits_in_version = mocker.patch(
+        "raincoat.match.django.are_commits_in_version",
+        return_value={"abc": True, "def": False},
+    )
+    checker = django.DjangoChecker()
+
+    assert checker.are_commits_in_version(["abc", "def"], "1.9", session) == {
+        "abc": True,
+        "def": False,
+    }
+    are_commits_in_version.reset_mock()
+    assert checker.are_commits_in_version(["abc", "def"], "1.9", session) == {
+        "abc": True,
+        "def": False,
+    }
+    assert are_commits_in_version.mock_calls == []
+
+
+def test_get_commits_in_version(mocker, session):
+    session.get.return_value.json.return_value = [{"sha": "abc"}, {"sha": "def"}]
+
+    assert django.get_commits_in_version("1.9", session) == {"abc", "def"}
+    assert session.get.call_args_list == [
+        mocker.call(django_repo + "/commits?sha=1.9&per_page=100")
+    ]
+
+
+def test_are_commits_in_version_release_commits(mocker, session, monkeypatch):
+    monkeypatch.setattr(django, "RELEASE_COMMITS_THRESHOLD", 2)
+    get_commits_in_version = mocker.patch(
+        "raincoat.match.django.get_commits_in_version", return_value={"abc", "ghi"}
+    )
+    are_commits_in_version = mocker.patch(
+        "raincoat.match.django.are_commits_in_version"
+    )
+
+    result = django.DjangoChecker().are_commits_in_version(
+        ["abc", "def"], "1.9", session
+    )
+    assert result == {"abc": True, "def": False}
+    assert are_commits_in_version.mock_calls == []
+
+    # The list of commits is kept, any commit can now be checked for free
+    get_commits_in_version.reset_mock()
+    result = django.DjangoChecker().are_commits_in_version(["ghi"], "1.9", session)
+    assert result == {"ghi": True}
+    assert get_commits_in_version.mock_calls == []
+    assert are_commits_in_version.mock_calls == []
+
+
+def test_are_commits_in_version_release_commits_short_sha1(mocker, session):
+    full = "abc1234" + "0" * 33
+    cache.Cache("django-release-commits").set("1.9", [full, "f" * 40])
+    are_commits_in_version = mocker.patch(
+        "raincoat.match.django.are_commits_in_version"
+    )
+
+    result = django.DjangoChecker().are_commits_in_version(
+        ["abc1234", "abc9999"], "1.9", session
+    )
+
+    assert result == {"abc1234": True, "abc9999": False}
+    assert are_commits_in_version.mock_calls == []
+    assert cache.Cache("django-commits-in-version").get("abc1234...1.9") is True
+
+
+def test_check_matches_offline(mocker, fixed_match, not_fixed_match, offline):
+    search = mocker.patch("raincoat.match.django.get_merge_commit_sha1s")
+    cache.Cache("django-tickets").set("26976", "123", ttl=-1)
+    cache.Cache("django-commits-in-version").set("123...1.9", True)
+
+    result = list(
+        django.DjangoChecker().check_matches(
+            {26976: [fixed_match], 27754: [not_fixed_match]}, "1.9"
+        )
+    )
+
+    assert result == [
+        ("Ticket #26976 has been merged in Django 1.9", fixed_match),
+        ("Could not be checked: ticket #27754 is not in the cache", not_fixed_match),
+    ]
+    assert isinstance(result[1][0], Unknown)
+    assert search.mock_calls == []
+
+
+def test_check_unknown_version(mocker, fixed_match):
+    mocker.patch(
+        "raincoat.match.django.source.get_current_or_latest_version",
+        side_effect=OfflineCacheMiss("nope"),
+    )
+
+    result = list(django.DjangoChecker().check([fixed_match]))
+
+    assert result == [("Could not be checked: nope", fixed_match)]
+
+
+@pytest.fixture
+def local_repo(tmp_path):
+    path = str(tmp_path / "django")
+
+    def git(*args):
+        subprocess.run(
+            ["git", "-C", path, "-c", "user.name=a", "-c", "user.email=a@b.c", *args],
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def commit(message):
+        git("commit", "--allow-empty", "-m", message)
+
+    subprocess.run(["git", "init", "-q", path], check=True)
+    commit("Fixed #1 -- Did a thing.")
+    git("tag", "1.0")
+    git("branch", "stable/1.0.x")
+    commit("Fixed #2, #3 -- Did other things.")
+    commit("Refs #4 -- Started something.")
+    git("checkout", "-q", "stable/1.0.x")
+    commit("[1.0.x] Fixed #2 -- Did other things.\n\nBackport of abc from main")
+    git("tag", "1.0.1")
+    return path
+
+
+def test_local_repository_index(local_repo):
+    index = django.LocalDjangoRepository(local_repo).get_index()
+
+    assert sorted(index) == ["1", "2", "3"]
+    assert len(index["2"]) == 2
+
+
+def test_local_repository_index_cached(local_repo, mocker):
+    repo = django.LocalDjangoRepository(local_repo)
+    index = repo.get_index()
+    build_index = mocker.patch.object(repo, "build_index")
+
+    assert repo.get_index() == index
+    assert build_index.mock_calls == []
+
+
+def test_local_repository_get_tickets_in_version(local_repo):
+    repo = django.LocalDjangoRepository(local_repo)
+
+    assert repo.get_tickets_in_version([1, 2, 3, 4], "1.0") == {1}
+    assert repo.get_tickets_in_version([1, 2, 3, 4], "1.0.1") == {1, 2}
+
+
+def test_local_repository_unknown_version(local_repo):
+    repo = django.LocalDjangoRepository(local_repo)
+
+    with pytest.raises(RaincoatException):
+        repo.get_tickets_in_version([1], "9.9")
+
+
+def test_check_matches_local_repository(local_repo, monkeypatch):
+    monkeypatch.setenv("RAINCOAT_DJANGO_REPO", local_repo)
+    match = django.DjangoMatch(filename="bla.py", lineno=12, ticket="#2")
+
+    result = list(django.DjangoChecker().check_matches({2: [match]}, "1.0.1"))
+
+    assert result == [("Ticket #2 has been merged in Django 1.0.1", match)]
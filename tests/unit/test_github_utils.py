@@ -1,6 +1,9 @@
 from __future__ import annotations
 
-from raincoat import github_utils
+import pytest
+import requests
+
+from raincoat import exceptions, github_utils
 
 
 def test_get_session(mocker):
@@ -11,3 +14,262 @@ def test_get_session(mocker):
 def test_get_session_no_token(mocker):
     mocker.patch("os.getenv", return_value=None)
     assert github_utils.get_session().auth is None
+
+
+def make_response(mocker, status_code=200, headers=None, from_cache=False):
+    return mocker.Mock(
+        status_code=status_code, headers=headers or {}, from_cache=from_cache
+    )
+
+
+def rate_limit_headers(remaining, reset=1000, resource="core"):
+    return {
+        "X-RateLimit-Limit": "100",
+        "X-RateLimit-Remaining": str(remaining),
+        "X-RateLimit-Reset": str(reset),
+        "X-RateLimit-Resource": resource,
+    }
+
+
+@pytest.fixture
+def now(mocker):
+    return mocker.patch("time.time", return_value=900)
+
+
+@pytest.fixture
+def limiter():
+    return github_utils.RateLimiter()
+
+
+@pytest.mark.parametrize(
+    "url, resource",
+    [
+        ("https://api.github.com/search/issues?q=a", "search"),
+        ("https://api.github.com/graphql", "graphql"),
+        ("https://api.github.com/repos/a/b", "core"),
+    ],
+)
+def test_get_resource(url, resource):
+    assert github_utils.get_resource(url) == resource
+
+
+def test_rate_limiter_update(mocker, limiter):
+    limiter.update(make_response(mocker, headers=rate_limit_headers(50)))
+
+    assert limiter.budgets == {"core": github_utils.Budget(100, 50, 1000)}
+
+
+def test_rate_limiter_update_no_headers(mocker, limiter):
+    limiter.update(make_response(mocker))
+
+    assert limiter.budgets == {}
+
+
+def test_rate_limiter_acquire_unknown(limiter):
+    limiter.acquire("core")
+
+    assert limiter.budgets == {}
+
+
+def test_rate_limiter_acquire_release(limiter):
+    limiter.set_budget("core", github_utils.Budget(100, 50, 1000))
+
+    limiter.acquire("core")
+    assert limiter.budgets["core"].remaining == 49
+
+    limiter.release("core")
+    assert limiter.budgets["core"].remaining == 50
+
+
+@pytest.mark.parametrize("priority", [github_utils.HIGH, github_utils.LOW])
+def test_rate_limiter_acquire_last_request(limiter, now, priority):
+    # Nobody else is waiting: the whole budget can be used.
+    limiter.set_budget("core", github_utils.Budget(100, 1, 1000))
+
+    limiter.acquire("core", priority=priority)
+    assert limiter.budgets["core"].remaining == 0
+
+
+def test_rate_limiter_acquire_priority(limiter, now, mocker):
+    limiter.set_budget("core", github_utils.Budget(100, 1, 1000))
+    # A request of higher priority is waiting
+    limiter.waiting["core", github_utils.HIGH] = 1
+
+    def wait(timeout=None):
+        # It took the last request
+        limiter.waiting["core", github_utils.HIGH] = 0
+        limiter.budgets["core"] = github_utils.Budget(100, 0, 1000)
+        wait_mock.side_effect = reset
+
+    def reset(timeout=None):
+        limiter.budgets["core"] = github_utils.Budget(100, 100, 4600)
+
+    wait_mock = mocker.patch.object(limiter.condition, "wait", side_effect=wait)
+
+    limiter.acquire("core", priority=github_utils.LOW)
+
+    assert limiter.budgets["core"].remaining == 99
+    assert wait_mock.mock_calls == [mocker.call(), mocker.call(timeout=101)]
+    assert limiter.waiting["core", github_utils.LOW] == 0
+
+
+def test_rate_limiter_acquire_wait(limiter, now, mocker, caplog):
+    limiter.set_budget("core", github_utils.Budget(100, 0, 1000))
+
+    def wait(timeout):
+        assert timeout == 101
+        limiter.budgets["core"] = github_utils.Budget(100, 100, 4600)
+
+    mocker.patch.object(limiter.condition, "wait", side_effect=wait)
+
+    limiter.acquire("core", priority=github_utils.LOW)
+
+    assert limiter.budgets["core"].remaining == 99
+    assert "pausing for 101s" in caplog.text
+
+
+def test_rate_limiter_acquire_reset(limiter, now):
+    limiter.set_budget("core", github_utils.Budget(100, 0, 800))
+
+    limiter.acquire("core")
+
+    assert limiter.budgets == {}
+
+
+def test_rate_limiter_acquire_too_long(limiter, now, monkeypatch):
+    monkeypatch.setenv("RAINCOAT_GITHUB_MAX_WAIT", "10")
+    limiter.set_budget("core", github_utils.Budget(100, 0, 1000))
+
+    with pytest.raises(exceptions.RateLimitExceeded):
+        limiter.acquire("core")
+
+
+@pytest.mark.parametrize(
+    "status_code, headers, delay",
+    [
+        (200, {}, None),
+        (404, {}, None),
+        (403, {}, None),
+        (403, {"Retry-After": "30"}, 30),
+        (429, {"Retry-After": "soon"}, 60),
+        (403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1000"}, 101),
+        (403, {"X-RateLimit-Remaining": "0"}, 60),
+    ],
+)
+def test_get_retry_delay(mocker, now, status_code, headers, delay):
+    response = make_response(mocker, status_code=status_code, headers=headers)
+    assert github_utils.get_retry_delay(response) == delay
+
+
+@pytest.fixture
+def session_request(mocker):
+    return mocker.patch("requests.Session.request")
+
+
+def test_session_not_api(session_request, limiter):
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+    session.get("https://raw.githubusercontent.com/a/b")
+
+    assert limiter.budgets == {}
+
+
+def test_session_updates_budget(mocker, session_request, limiter):
+    session_request.return_value = make_response(mocker, headers=rate_limit_headers(50))
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    session.get("https://api.github.com/a", priority=github_utils.LOW)
+
+    assert session_request.call_args == mocker.call(
+        "GET", "https://api.github.com/a", params=None, allow_redirects=True
+    )
+    assert limiter.budgets["core"].remaining == 50
+
+
+def test_session_from_cache(mocker, session_request, limiter):
+    limiter.set_budget("core", github_utils.Budget(100, 50, 1000))
+    session_request.return_value = make_response(
+        mocker, headers=rate_limit_headers(10), from_cache=True
+    )
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    session.get("https://api.github.com/a")
+
+    assert limiter.budgets["core"].remaining == 50
+
+
+def test_session_retry(mocker, session_request, limiter, now, caplog):
+    sleep = mocker.patch("time.sleep")
+    limited = make_response(mocker, status_code=403, headers={"Retry-After": "5"})
+    ok = make_response(mocker)
+    session_request.side_effect = [limited, ok]
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    assert session.get("https://api.github.com/a") is ok
+    assert sleep.mock_calls == [mocker.call(5)]
+    assert "rate limit hit, retrying https://api.github.com/a in 5s" in caplog.text
+
+
+def test_session_retry_give_up(mocker, session_request, limiter, now):
+    mocker.patch("time.sleep")
+    limited = make_response(mocker, status_code=429, headers={"Retry-After": "5"})
+    session_request.return_value = limited
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    assert session.get("https://api.github.com/a") is limited
+    assert session_request.call_count == github_utils.MAX_RETRIES + 1
+
+
+def test_report_budget(mocker, session_request, limiter, caplog):
+    caplog.set_level("INFO")
+    session_request.return_value.status_code = 200
+    session_request.return_value.json.return_value = {
+        "resources": {"core": {"limit": 100, "remaining": 50, "reset": 1000}}
+    }
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    budget = github_utils.report_budget(session, expected=10)
+
+    assert budget == github_utils.Budget(100, 50, 1000)
+    assert limiter.budgets["core"] == budget
+    assert "Expecting to use up to 10 GitHub API core requests, 50/100" in caplog.text
+    # Never from the cache
+    assert session_request.call_args == mocker.call(
+        session,
+        "GET",
+        github_utils.API_URL + "rate_limit",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+def test_report_budget_not_enough(mocker, session_request, limiter, caplog):
+    session_request.return_value.status_code = 200
+    session_request.return_value.json.return_value = {
+        "resources": {"search": {"limit": 30, "remaining": 5, "reset": 1000}}
+    }
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    github_utils.report_budget(session, expected=10, resource="search")
+
+    assert "The run will pause until the reset" in caplog.text
+
+
+def test_report_budget_connection_error(mocker, session_request, limiter):
+    session_request.side_effect = requests.ConnectionError
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    assert github_utils.report_budget(session, expected=10) is None
+
+
+def test_report_budget_error(mocker, session_request, limiter):
+    session_request.return_value.status_code = 500
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    assert github_utils.report_budget(session, expected=10) is None
+
+
+def test_report_budget_unexpected(mocker, session_request, limiter):
+    session_request.return_value.status_code = 200
+    session_request.return_value.json.return_value = {}
+    session = github_utils.GitHubSession(rate_limiter=limiter)
+
+    assert github_utils.report_budget(session, expected=10) is None
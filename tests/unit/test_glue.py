@@ -2,7 +2,9 @@ from __future__ import annotations
 
 import pytest
 
-from raincoat.glue import raincoat
+from raincoat.changes import Changes
+from raincoat.glue import fetch, raincoat
+from raincoat.shard import Shard
 
 
 @pytest.fixture
@@ -26,3 +28,49 @@ def test_raincoat(mocker, match, match_module, match_class):
     ]
 
     assert check_matches.mock_calls[0] == mocker.call({"pypi": [match, match_module]})
+
+
+def test_fetch(mocker, match, match_module, match_class):
+    mocker.patch("raincoat.grep.find_in_dir", return_value=[match, match_module])
+    fetch_matches = mocker.patch("raincoat.glue.fetch_matches")
+
+    assert fetch(".") == 2
+
+    assert fetch_matches.mock_calls == [mocker.call({"pypi": [match, match_module]})]
+
+
+def test_raincoat_changes(mocker, match, match_module, match_other_file, match_class):
+    match.filename = "a.py"
+    match_module.filename = "b.py"
+    match_module.package = "other"
+    match_other_file.filename = "c.py"
+    mocker.patch("raincoat.grep.find_in_files", return_value=[match])
+    find_affected = mocker.patch(
+        "raincoat.index.ScanIndex.find_affected",
+        return_value=[match, match_other_file],
+    )
+    check_matches = mocker.patch("raincoat.glue.check_matches", return_value=[])
+
+    changes = Changes(files={"a.py"}, packages={"umbrella"})
+    list(raincoat(".", changes=changes))
+
+    assert check_matches.mock_calls == [
+        mocker.call({"pypi": [match, match_other_file]})
+    ]
+    assert find_affected.mock_calls == [mocker.call({"umbrella"})]
+
+
+def test_raincoat_shard(mocker, match, match_module, match_other_file, match_class):
+    match_other_file.package = "other"
+    mocker.patch(
+        "raincoat.grep.find_in_dir",
+        return_value=[match, match_module, match_other_file],
+    )
+    check_matches = mocker.patch("raincoat.glue.check_matches", return_value=[])
+
+    for index in (1, 2):
+        list(raincoat(".", shard=Shard(index, 2)))
+
+    # The 2 matches about umbrella are in the same shard
+    shards = [call.args[0].get("pypi", []) for call in check_matches.mock_calls]
+    assert sorted(len(matches) for matches in shards) == [1, 2]
@@ -253,3 +253,30 @@ def test_find_in_dir(mocker, match_class):
     assert m2.filename == "a/e.py"
     assert m2.lineno == 1
     assert m2.package == "BLU"
+
+
+@pytest.mark.parametrize(
+    "path, exclude, excluded",
+    [
+        ("a/b.py", [], False),
+        ("a/b.py", ["a"], True),
+        ("./a/b.py", ["a/*.py"], True),
+        ("a/b.py", ["test_*"], False),
+        ("a/test_b.py", ["*/test_*"], True),
+    ],
+)
+def test_is_excluded(path, exclude, excluded):
+    assert grep.is_excluded(path, exclude) is excluded
+
+
+def test_find_in_files(tmp_path, monkeypatch, mocker):
+    monkeypatch.chdir(tmp_path)
+    for path in ["src/a.py", "src/b.txt", "src/excluded/c.py", "other/d.py"]:
+        (tmp_path / path).parent.mkdir(exist_ok=True)
+        (tmp_path / path).write_text("")
+    find_in_file = mocker.patch("raincoat.grep.find_in_file", return_value=[])
+
+    files = {"src/a.py", "src/b.txt", "src/excluded/c.py", "other/d.py", "src/e.py"}
+    list(grep.find_in_files(files, base_dir="src", exclude=["src/excluded"]))
+
+    assert find_in_file.mock_calls == [mocker.call("src/a.py")]
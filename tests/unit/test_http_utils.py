@@ -0,0 +1,307 @@
+from __future__ import annotations
+
+import threading
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from raincoat import http_utils, settings
+from raincoat.exceptions import OfflineCacheMiss
+
+
+def make_response(status_code=200, content=b"yay", headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = "OK"
+    response.url = "https://example.com/a"
+    response._content = content
+    response.headers = CaseInsensitiveDict(headers or {})
+    return response
+
+
+@pytest.fixture
+def network(mocker):
+    return mocker.patch("requests.adapters.HTTPAdapter.send")
+
+
+@pytest.fixture
+def session():
+    return http_utils.get_session()
+
+
+@pytest.mark.parametrize(
+    "headers, max_age",
+    [
+        ({}, 0),
+        ({"Cache-Control": "public, max-age=60"}, 60),
+        ({"Cache-Control": 'max-age="60"'}, 60),
+        ({"Cache-Control": "max-age=-1"}, 0),
+        ({"Cache-Control": "max-age=yay"}, 0),
+        ({"Cache-Control": "no-cache, max-age=60"}, 0),
+        (
+            {
+                "Date": "Wed, 21 Oct 2015 07:28:00 GMT",
+                "Expires": "Wed, 21 Oct 2015 07:38:00 GMT",
+            },
+            600,
+        ),
+        ({"Expires": "Wed, 21 Oct 2015 07:38:00 GMT"}, 0),
+        ({"Date": "Wed, 21 Oct 2015 07:28:00 GMT", "Expires": "0"}, 0),
+    ],
+)
+def test_get_max_age(headers, max_age):
+    assert http_utils.get_max_age(headers) == max_age
+
+
+@pytest.mark.parametrize(
+    "response, cacheable",
+    [
+        (make_response(headers={"ETag": "a"}), True),
+        (make_response(headers={"Last-Modified": "a"}), True),
+        (make_response(headers={"Cache-Control": "max-age=60"}), True),
+        (make_response(), False),
+        (make_response(status_code=404, headers={"ETag": "a"}), False),
+        (make_response(headers={"ETag": "a", "Cache-Control": "no-store"}), False),
+    ],
+)
+def test_is_cacheable(response, cacheable):
+    assert http_utils.is_cacheable(response) is cacheable
+
+
+def test_get_cache_key_auth():
+    request_a = requests.Request("GET", "https://a.com", auth=("a", "b")).prepare()
+    request_b = requests.Request("GET", "https://a.com", auth=("a", "c")).prepare()
+    key_a = http_utils.get_cache_key(request_a)
+
+    assert key_a.startswith("GET https://a.com/ ")
+    assert "Basic" not in key_a
+    assert key_a != http_utils.get_cache_key(request_b)
+
+
+def test_fresh_response(session, network):
+    network.return_value = make_response(headers={"Cache-Control": "max-age=60"})
+
+    first = session.get("https://example.com/a")
+    second = session.get("https://example.com/a")
+
+    assert network.call_count == 1
+    assert second.text == first.text == "yay"
+    assert second.from_cache is True
+    assert second.status_code == 200
+
+
+def test_stale_not_modified(session, network):
+    network.side_effect = [
+        make_response(headers={"ETag": '"abc"', "Last-Modified": "yesterday"}),
+        make_response(status_code=304, content=b"", headers={"X-Foo": "bar"}),
+    ]
+
+    session.get("https://example.com/a")
+    response = session.get("https://example.com/a")
+
+    request = network.call_args_list[1][0][0]
+    assert request.headers["If-None-Match"] == '"abc"'
+    assert request.headers["If-Modified-Since"] == "yesterday"
+    assert response.status_code == 200
+    assert response.text == "yay"
+    assert response.headers["X-Foo"] == "bar"
+
+
+def test_stale_modified(session, network):
+    network.side_effect = [
+        make_response(headers={"ETag": '"abc"'}),
+        make_response(content=b"new", headers={"ETag": '"def"'}),
+        make_response(status_code=304, content=b""),
+    ]
+
+    session.get("https://example.com/a")
+    assert session.get("https://example.com/a").text == "new"
+    assert session.get("https://example.com/a").text == "new"
+
+    request = network.call_args_list[2][0][0]
+    assert request.headers["If-None-Match"] == '"def"'
+
+
+def test_stale_offline(session, network, offline):
+    with settings.override(offline=False):
+        network.return_value = make_response(headers={"ETag": '"abc"'})
+        session.get("https://example.com/a")
+
+    network.reset_mock()
+    response = session.get("https://example.com/a")
+
+    assert response.text == "yay"
+    assert network.call_count == 0
+
+
+def test_miss_offline(session, network, offline):
+    with pytest.raises(OfflineCacheMiss):
+        session.get("https://example.com/a")
+
+    assert network.call_count == 0
+
+
+def test_not_cacheable(session, network):
+    network.return_value = make_response(status_code=404)
+
+    session.get("https://example.com/a")
+    session.get("https://example.com/a")
+
+    assert network.call_count == 2
+
+
+def test_not_get(session, network):
+    network.return_value = make_response(headers={"Cache-Control": "max-age=60"})
+
+    session.post("https://example.com/a")
+    session.post("https://example.com/a")
+
+    assert network.call_count == 2
+
+
+def test_conditional_request_bypass(session, network):
+    network.return_value = make_response(headers={"Cache-Control": "max-age=60"})
+
+    session.get("https://example.com/a", headers={"If-None-Match": "a"})
+    session.get("https://example.com/a", headers={"If-None-Match": "a"})
+
+    assert network.call_count == 2
+
+
+def test_no_cache_bypass(session, network):
+    network.return_value = make_response(headers={"Cache-Control": "max-age=60"})
+
+    session.get("https://example.com/a")
+    response = session.get(
+        "https://example.com/a", headers={"Cache-Control": "no-cache"}
+    )
+
+    assert network.call_count == 2
+    assert not getattr(response, "from_cache", False)
+
+
+def test_no_store(session, network, cache_dir):
+    network.return_value = make_response(
+        headers={"Cache-Control": "max-age=60", "ETag": '"abc"'}
+    )
+
+    session.get("https://example.com/a", headers={"Cache-Control": "no-store"})
+    assert not (cache_dir / "http").exists()
+
+    session.get("https://example.com/a")
+    assert network.call_count == 2
+
+
+def test_single_flight(mocker):
+    single_flight = http_utils.SingleFlight()
+    started, waiting, release = threading.Event(), threading.Event(), threading.Event()
+    calls = []
+
+    class Future(http_utils.Future):
+        def result(self, timeout=None):
+            waiting.set()
+            return super().result(timeout=timeout)
+
+    mocker.patch("raincoat.http_utils.Future", Future)
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return "result"
+
+    results = []
+
+    def call():
+        results.append(single_flight.do("a", work))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(timeout=5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    waiting.wait(timeout=5)
+    release.set()
+    leader.join(timeout=5)
+    follower.join(timeout=5)
+
+    assert calls == [1]
+    assert sorted(results) == [("result", False), ("result", True)]
+    assert single_flight.calls == {}
+
+
+def test_single_flight_sequential():
+    single_flight = http_utils.SingleFlight()
+
+    assert single_flight.do("a", lambda: 1) == (1, False)
+    assert single_flight.do("a", lambda: 2) == (2, False)
+
+
+def test_single_flight_error():
+    single_flight = http_utils.SingleFlight()
+    future = http_utils.Future()
+
+    def work():
+        # Simulate a follower arriving while the call is running
+        single_flight.calls["a"].add_done_callback(future.set_result)
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        single_flight.do("a", work)
+
+    assert isinstance(future.result().exception(), ValueError)
+    assert single_flight.calls == {}
+
+
+def test_host_limiter():
+    limiter = http_utils.HostLimiter(max_connections=1)
+
+    with limiter.limit("a.com"):
+        semaphore = limiter.semaphores["a.com"]
+        assert not semaphore.acquire(blocking=False)
+        with limiter.limit("b.com"):
+            pass
+
+    assert semaphore.acquire(blocking=False)
+
+
+def test_host_limiter_env(monkeypatch):
+    monkeypatch.setenv("RAINCOAT_MAX_CONNECTIONS_PER_HOST", "7")
+
+    assert http_utils.HostLimiter().max_connections == 7
+
+
+def test_shared_response(session, network, mocker):
+    original = make_response(headers={"Cache-Control": "max-age=60"})
+    mocker.patch.object(http_utils.single_flight, "do", return_value=(original, True))
+
+    response = session.get("https://example.com/a")
+
+    assert response is not original
+    assert response.text == "yay"
+    assert response.from_cache is True
+    assert network.call_count == 0
+
+
+def test_shared_adapters(monkeypatch):
+    monkeypatch.setattr(http_utils, "shared_adapters", {})
+
+    adapter = http_utils.get_session().get_adapter("https://example.com")
+    http_utils.get_session().close()
+
+    assert http_utils.get_session().get_adapter("https://example.com") is adapter
+    assert adapter.shared
+
+
+def test_get_adapter_not_shared():
+    assert http_utils.get_adapter() is not http_utils.get_adapter()
+
+
+def test_send_network_host_limit(session, network, mocker):
+    limit = mocker.spy(http_utils.host_limiter, "limit")
+    network.return_value = make_response()
+
+    session.get("https://example.com/a")
+
+    assert limit.mock_calls == [mocker.call("example.com")]
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import pytest
+
+from raincoat import index
+
+PYPI_COMMENT = "# Raincoat: pypi package: Umbrella==1.0 path: a.py element: b\n"
+DJANGO_COMMENT = "# Raincoat: django ticket: #123\n"
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text(PYPI_COMMENT)
+    (tmp_path / "b.py").write_text(DJANGO_COMMENT)
+    (tmp_path / "c.py").write_text("")
+    return tmp_path
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [("Django", "django"), ("zope.interface", "zope-interface"), ("a/B_c", "a/B_c")],
+)
+def test_normalize_dependency(name, expected):
+    assert index.normalize_dependency(name) == expected
+
+
+def test_update(tree):
+    files = index.ScanIndex(".").update()
+
+    assert {path: entry["dependencies"] for path, entry in files.items()} == {
+        "a.py": ["umbrella"],
+        "b.py": ["django"],
+        "c.py": [],
+    }
+
+
+def test_update_only_reads_modified_files(tree, mocker):
+    index.ScanIndex(".").update()
+    (tree / "c.py").write_text(DJANGO_COMMENT + "# more\n")
+    find_in_file = mocker.spy(index.grep, "find_in_file")
+
+    files = index.ScanIndex(".").update()
+
+    assert find_in_file.mock_calls == [mocker.call("c.py")]
+    assert files["c.py"]["dependencies"] == ["django"]
+
+
+def test_update_removed_file(tree):
+    index.ScanIndex(".").update()
+    (tree / "b.py").unlink()
+
+    assert set(index.ScanIndex(".").update()) == {"a.py", "c.py"}
+
+
+def test_find_affected(tree):
+    scan_index = index.ScanIndex(".")
+
+    (match,) = scan_index.find_affected(["Django"])
+    assert (match.filename, match.ticket) == ("b.py", 123)
+
+    (match,) = scan_index.find_affected(["umbrella"])
+    assert match.filename == "a.py"
+
+    assert list(scan_index.find_affected(["other"])) == []
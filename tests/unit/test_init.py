@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import pytest
+
+import raincoat
+
+
+def test_metadata_attributes(mocker):
+    extract = mocker.patch(
+        "raincoat.metadata.extract_metadata",
+        return_value={
+            "author": "a",
+            "email": "b",
+            "license": "c",
+            "url": "d",
+            "version": "1.2.3",
+        },
+    )
+    mocker.patch.dict(raincoat.__dict__)
+    for name in raincoat._METADATA_ATTRIBUTES:
+        raincoat.__dict__.pop(name, None)
+
+    assert raincoat.__version__ == "1.2.3"
+    assert raincoat.__url__ == "d"
+    # All the attributes are set on first access
+    assert extract.call_count == 1
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        raincoat.foo
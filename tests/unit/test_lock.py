@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from raincoat import lock, settings
+
+
+@pytest.fixture
+def lock_path(tmp_path):
+    path = str(tmp_path / "raincoat.lock")
+    with settings.override(lock=path):
+        yield path
+
+
+def test_save_load(lock_path):
+    lockfile = lock.Lock(lock_path)
+    lockfile.set("versions", "django", "4.2")
+    lockfile.save()
+
+    assert lock.Lock.load(lock_path).get("versions", "django") == "4.2"
+
+
+def test_set_modified(lock_path):
+    lockfile = lock.Lock(lock_path, {"versions": {"django": "4.2"}})
+
+    lockfile.set("versions", "django", "4.2")
+    assert lockfile.modified is False
+
+    lockfile.set("versions", "django", "5.0")
+    assert lockfile.modified is True
+
+
+def test_use_lock_no_file(lock_path):
+    with lock.use_lock() as lockfile:
+        assert lockfile is None
+        assert lock.get_lock() is None
+
+
+def test_use_lock_existing(lock_path):
+    with open(lock_path, "w") as handler:
+        json.dump({"versions": {"django": "4.2"}}, handler)
+
+    with lock.use_lock() as lockfile:
+        assert lock.get_lock() is lockfile
+        assert lockfile.get("versions", "django") == "4.2"
+        lockfile.set("branches", "a/b@main", "123")
+
+    assert lock.get_lock() is None
+    with open(lock_path) as handler:
+        assert json.load(handler) == {
+            "branches": {"a/b@main": "123"},
+            "elements": {},
+            "versions": {"django": "4.2"},
+        }
+
+
+def test_use_lock_update(lock_path):
+    with open(lock_path, "w") as handler:
+        json.dump({"versions": {"django": "4.2"}}, handler)
+
+    with settings.override(update_lock=True), lock.use_lock() as lockfile:
+        assert lockfile.get("versions", "django") is None
+
+    with open(lock_path) as handler:
+        assert json.load(handler)["versions"] == {}
+
+
+def test_hash_element():
+    assert lock.hash_element(["a"]) == lock.hash_element(["a"])
+    assert lock.hash_element(["a"]) != lock.hash_element(["b"])
@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import io
+import json
+import threading
+
+import pytest
+
+from raincoat import lsp
+from raincoat.match import Unknown
+
+COMMENT = "# Raincoat: pypi package: umbrella==3.2 path: umbrella/__init__.py {}\n"
+
+
+def frame(message):
+    content = json.dumps(message).encode("utf-8")
+    return f"Content-Length: {len(content)}\r\n\r\n".encode("ascii") + content
+
+
+def read_all(output):
+    stream = io.BytesIO(output.getvalue())
+    messages = []
+    while True:
+        message = lsp.read_message(stream)
+        if message is None:
+            return messages
+        messages.append(message)
+
+
+@pytest.fixture
+def check_matches(mocker):
+    def check(matches_dict):
+        for matches in matches_dict.values():
+            for match in matches:
+                if match.element == "Unknown":
+                    yield Unknown("Could not be checked"), match
+                elif match.element != "Good":
+                    yield f"{match.element} is bad\ndetails", match
+
+    return mocker.patch("raincoat.lsp.check_matches", side_effect=check)
+
+
+@pytest.fixture
+def server():
+    return lsp.Server(input=io.BytesIO(), output=io.BytesIO(), debounce=0)
+
+
+@pytest.fixture
+def uri(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return (tmp_path / "a.py").as_uri()
+
+
+def test_read_write_message():
+    stream = io.BytesIO()
+    lsp.write_message(stream, {"a": "é"})
+    stream.seek(0)
+
+    assert lsp.read_message(stream) == {"a": "é"}
+    assert lsp.read_message(stream) is None
+
+
+def test_uri_to_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    assert lsp.uri_to_path((tmp_path / "a b.py").as_uri()) == "a b.py"
+    assert lsp.uri_to_path("file:///elsewhere/a.py") == "/elsewhere/a.py"
+    assert lsp.uri_to_path("untitled:Untitled-1") is None
+
+
+def test_get_diagnostic(match):
+    text = "\n" * 11 + "# Raincoat: blah\n"
+
+    assert lsp.get_diagnostic(match, "Oh :(\n", text) == {
+        "range": {
+            "start": {"line": 11, "character": 0},
+            "end": {"line": 11, "character": 16},
+        },
+        "severity": lsp.SEVERITY_WARNING,
+        "source": "raincoat",
+        "message": "Oh :(",
+    }
+    diagnostic = lsp.get_diagnostic(match, Unknown("Not checked"), text)
+    assert diagnostic["severity"] == lsp.SEVERITY_INFORMATION
+
+
+def test_serve(server):
+    server.input = io.BytesIO(
+        frame({"jsonrpc": "2.0", "id": 1, "method": "initialize", "params": {}})
+        + frame({"jsonrpc": "2.0", "method": "initialized", "params": {}})
+        + frame({"jsonrpc": "2.0", "id": 2, "method": "textDocument/hover"})
+        + frame({"jsonrpc": "2.0", "id": 3, "method": "shutdown"})
+        + frame({"jsonrpc": "2.0", "method": "exit"})
+    )
+
+    assert server.serve() == 0
+
+    initialize, hover, shutdown = read_all(server.output)
+    assert initialize["result"]["capabilities"]["textDocumentSync"]["change"] == 1
+    assert hover["error"]["code"] == lsp.METHOD_NOT_FOUND
+    assert shutdown == {"jsonrpc": "2.0", "id": 3, "result": None}
+
+
+def test_serve_exit_without_shutdown(server):
+    assert server.serve() == 1
+
+
+def test_check(server, uri, check_matches):
+    text = COMMENT.format("element: Bad") + COMMENT.format("element: Good")
+    server.on_textDocument_didOpen(
+        {"textDocument": {"uri": uri, "text": text, "version": 1}}
+    )
+    assert uri in server.pending
+
+    server.check(uri, text)
+
+    before_check, after_check = read_all(server.output)
+    assert before_check["params"] == {"uri": uri, "diagnostics": []}
+    (diagnostic,) = after_check["params"]["diagnostics"]
+    assert diagnostic["message"] == "Bad is bad\ndetails"
+    assert diagnostic["range"]["start"]["line"] == 0
+
+
+def test_check_checker_changes_matches(server, uri, check_matches):
+    def check(matches_dict):
+        for matches in matches_dict.values():
+            for match in matches:
+                match.other_version = "3.3"
+                yield "Oh :(", match
+
+    check_matches.side_effect = check
+    text = COMMENT.format("element: Bad")
+    server.update(uri, text)
+    server.output = io.BytesIO()
+
+    server.check(uri, text)
+
+    (published,) = read_all(server.output)
+    (diagnostic,) = published["params"]["diagnostics"]
+    assert diagnostic["message"] == "Oh :("
+
+    check_matches.reset_mock()
+    server.check(uri, text)
+    assert check_matches.mock_calls == []
+
+
+def test_change_uses_cache(server, uri, check_matches):
+    text = COMMENT.format("element: Bad")
+    server.update(uri, text)
+    server.check(uri, text)
+    check_matches.reset_mock()
+    server.output = io.BytesIO()
+
+    server.on_textDocument_didChange(
+        {
+            "textDocument": {"uri": uri, "version": 2},
+            "contentChanges": [{"text": "\n\n" + text}],
+        }
+    )
+
+    # Published right away, at its new position, without checking anything
+    (published,) = read_all(server.output)
+    (diagnostic,) = published["params"]["diagnostics"]
+    assert diagnostic["range"]["start"]["line"] == 2
+    assert check_matches.mock_calls == []
+
+    server.check(uri, "\n\n" + text)
+    assert check_matches.mock_calls == []
+
+
+def test_check_outdated(server, uri, check_matches):
+    server.update(uri, COMMENT.format("element: Bad"))
+    server.output = io.BytesIO()
+
+    server.check(uri, COMMENT.format("element: Other"))
+
+    assert read_all(server.output) == []
+
+
+def test_save_checks_again(server, uri, check_matches):
+    text = COMMENT.format("element: Bad")
+    server.update(uri, text)
+    server.check(uri, text)
+    server.pending.clear()
+
+    server.on_textDocument_didSave({"textDocument": {"uri": uri}})
+
+    assert server.verdicts == {}
+    assert uri in server.pending
+
+
+def test_close(server, uri, check_matches):
+    server.update(uri, COMMENT.format("element: Bad"))
+    server.output = io.BytesIO()
+
+    server.on_textDocument_didClose({"textDocument": {"uri": uri}})
+
+    assert server.documents == {}
+    assert server.pending == {}
+    (published,) = read_all(server.output)
+    assert published["params"] == {"uri": uri, "diagnostics": []}
+
+
+def test_worker(server, uri, mocker):
+    checked = threading.Event()
+    check = mocker.patch.object(
+        lsp.Server, "check", side_effect=lambda *args: checked.set()
+    )
+    server.worker.start()
+    server.update(uri, COMMENT.format("element: Bad"))
+
+    assert checked.wait(5)
+    with server.condition:
+        server.stopped = True
+        server.condition.notify()
+    server.worker.join(5)
+
+    assert not server.worker.is_alive()
+    assert check.mock_calls == [mocker.call(uri, COMMENT.format("element: Bad"))]
+
+
+def test_worker_debounce(server, uri, check_matches, mocker):
+    checked = mocker.patch.object(lsp.Server, "check")
+    server.debounce = 60
+    server.worker.start()
+    server.update(uri, COMMENT.format("element: Bad"))
+    with server.condition:
+        server.stopped = True
+        server.condition.notify()
+    server.worker.join(5)
+
+    assert checked.mock_calls == []
+
+
+def test_worker_error(server, uri, mocker):
+    mocker.patch.object(lsp.Server, "check", side_effect=ValueError)
+    server.pending = {uri: 0}
+    server.documents = {uri: "a"}
+
+    def stop(*args, **kwargs):
+        server.stopped = True
+
+    mocker.patch.object(lsp.logger, "exception", side_effect=stop)
+    server.work()
+
+    assert server.pending == {}
+
+
+def test_untitled_document(server):
+    server.update("untitled:Untitled-1", "")
+
+    assert server.documents == {}
+    assert read_all(server.output) == []
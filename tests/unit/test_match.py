@@ -48,64 +48,90 @@ def test_check_matches_no_checker(mocker):
         match_module.match_types.pop("unfinished")
 
 
-def test_compute_match_types(mocker):
-    gme = mocker.patch("raincoat.match.get_match_entrypoints")
+def test_fetch_matches(mocker, match):
+    fetch = mocker.patch("raincoat.match.pypi.PyPIChecker.fetch")
+    mocker.patch("raincoat.match.match_types", {"pypi": match.__class__})
+
+    match_module.fetch_matches({"pypi": [match]})
+
+    assert fetch.mock_calls == [mocker.call([match])]
+
+
+def test_fetch_matches_no_fetch(mocker):
+    checked = []
+
+    class Checker:
+        def check(self, matches):
+            for match in matches:
+                checked.append(match)
+                yield "bla", match
+
+    class NoFetch(match_module.Match):
+        checker = Checker
 
-    class Match:
-        def __init__(self, name):
-            self.name = name
+    match = NoFetch("yay.py", 12)
+    mocker.patch("raincoat.match.match_types", {"nofetch": NoFetch})
 
-        def __repr__(self):
-            return self.name
+    match_module.fetch_matches({"nofetch": [match]})
 
-    @dataclasses.dataclass
-    class EntryPoint:
-        name: str
-        match: Match
+    assert checked == [match]
 
-        def load(self):
-            return self.match
 
-    match_a, match_b = Match("A"), Match("B")
+@dataclasses.dataclass
+class EntryPoint:
+    name: str
+    value: str
+    loaded: list
 
-    entry_a, entry_b = gme.return_value = [
-        EntryPoint(name="a", match=match_a),
-        EntryPoint(name="b", match=match_b),
+    def load(self):
+        match_class = type(self.value, (), {})
+        self.loaded.append(match_class)
+        return match_class
+
+
+def test_compute_match_types(mocker):
+    gme = mocker.patch("raincoat.match.get_match_entrypoints")
+    loaded = []
+    gme.return_value = [
+        EntryPoint(name="a", value="A", loaded=loaded),
+        EntryPoint(name="b", value="B", loaded=loaded),
     ]
-    entry_a.load = lambda: match_a
-    entry_b.load = lambda: match_b
 
-    assert match_module.compute_match_types() == {"a": match_a, "b": match_b}
-    assert match_a.match_type == "a"
-    assert match_b.match_type == "b"
+    match_types = match_module.compute_match_types()
 
+    assert list(match_types) == ["a", "b"]
+    assert loaded == []
 
-def test_compute_match_types_duplicate(mocker, caplog):
-    iep = mocker.patch("raincoat.match.get_match_entrypoints")
+    match_a = match_types["a"]
+    assert match_a.__name__ == "A"
+    assert match_a.match_type == "a"
+    assert loaded == [match_a]
 
-    class Match:
-        def __init__(self, name):
-            self.name = name
+    # Classes are only loaded once
+    assert match_types["a"] is match_a
+    assert loaded == [match_a]
 
-        def __repr__(self):
-            return self.name
 
-    @dataclasses.dataclass
-    class EntryPoint:
-        name: str
-        match: Match
+def test_compute_match_types_unknown(mocker):
+    gme = mocker.patch("raincoat.match.get_match_entrypoints")
+    gme.return_value = [EntryPoint(name="a", value="A", loaded=[])]
 
-        def load(self):
-            return self.match
+    with pytest.raises(KeyError):
+        match_module.compute_match_types()["b"]
 
-    match_a, match_b = Match("A"), Match("B")
 
-    entry_a, entry_b = iep.return_value = [
-        EntryPoint(name="a", match=match_a),
-        EntryPoint(name="a", match=match_b),
+def test_compute_match_types_duplicate(mocker, caplog):
+    iep = mocker.patch("raincoat.match.get_match_entrypoints")
+    loaded = []
+    iep.return_value = [
+        EntryPoint(name="a", value="A", loaded=loaded),
+        EntryPoint(name="a", value="B", loaded=loaded),
     ]
 
-    assert match_module.compute_match_types() == {"a": match_a}
+    match_types = match_module.compute_match_types()
+
+    assert len(match_types) == 1
+    assert match_types["a"].__name__ == "A"
 
     assert (
         "Several classes registered for the match type a" in caplog.records[0].message
@@ -114,6 +140,31 @@ def test_compute_match_types_duplicate(mocker, caplog):
     assert "A will be used" in caplog.records[0].message
 
 
+def test_match_types_set_and_delete(mocker):
+    gme = mocker.patch("raincoat.match.get_match_entrypoints")
+    gme.return_value = [EntryPoint(name="a", value="A", loaded=[])]
+
+    match_types = match_module.compute_match_types()
+    match_types["b"] = match_module.Match
+
+    assert list(match_types) == ["a", "b"]
+    assert len(match_types) == 2
+
+    del match_types["a"]
+    del match_types["b"]
+    assert len(match_types) == 0
+
+    with pytest.raises(KeyError):
+        del match_types["a"]
+
+
+def test_match_types_builtin():
+    from raincoat.match import pypi
+
+    assert set(match_module.match_types) >= {"pypi", "django", "pygithub"}
+    assert match_module.match_types["pypi"] is pypi.PyPIMatch
+
+
 def test_format_line_first(match, color):
     assert match.format_line("haha", color, 0) == "message" "haha" "neutral"
 
@@ -153,3 +204,8 @@ def test_format_space(match, color):
         "neutral\n"
         "hehe\n"
     )
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        match_module.foo
@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import pytest
 
+from raincoat import lock
 from raincoat.match import pygithub
 
 
@@ -66,6 +67,81 @@ def test_current_source_key_cache(mocker, pygithub_match):
     assert a == b
 
 
+def test_resolve_branches(mocker, pygithub_match):
+    get_branch_commits = mocker.patch(
+        "raincoat.source.get_branch_commits",
+        return_value={("python/cpython", "3.6"): "aaabbbcccdddeeefff"},
+    )
+    get_branch_commit = mocker.patch("raincoat.source.get_branch_commit")
+
+    checker = pygithub.PyGithubChecker()
+    checker.resolve_branches([pygithub_match, pygithub_match])
+
+    assert get_branch_commits.mock_calls == [mocker.call({("python/cpython", "3.6")})]
+    assert checker.current_source_key(pygithub_match) == (
+        "python/cpython",
+        "aaabbbcccdddeeefff",
+    )
+    assert pygithub_match.branch_commit == "aaabbbcc"
+    assert get_branch_commit.mock_calls == []
+
+
+@pytest.mark.parametrize(
+    "head_blob, expected",
+    [("111", ("python/cpython", "abc123")), ("222", ("python/cpython", "fed987"))],
+)
+def test_find_unchanged_files(mocker, pygithub_match, head_blob, expected):
+    mocker.patch("raincoat.source.get_branch_commit", return_value="fed987")
+    get_blob_shas = mocker.patch(
+        "raincoat.source.get_blob_shas",
+        return_value={
+            ("python/cpython", "abc123", "Lib/this.py"): "111",
+            ("python/cpython", "fed987", "Lib/this.py"): head_blob,
+        },
+    )
+
+    checker = pygithub.PyGithubChecker()
+    checker.find_unchanged_files([pygithub_match])
+
+    assert get_blob_shas.mock_calls == [
+        mocker.call(
+            {
+                ("python/cpython", "abc123", "Lib/this.py"),
+                ("python/cpython", "fed987", "Lib/this.py"),
+            }
+        )
+    ]
+    assert checker.current_source_key(pygithub_match) == expected
+    assert pygithub_match.branch_commit == "fed987"
+
+
+def test_check_locked(mocker):
+    match = pygithub.PyGithubMatch(
+        repo="python/cpython@abc1234",
+        path="Lib/this.py",
+        element="s",
+        branch="3.6",
+        filename="filename",
+        lineno=12,
+    )
+    lockfile = lock.Lock("raincoat.lock")
+    for commit in ("abc1234", "fed9876"):
+        lockfile.set("elements", f"github python/cpython@{commit} Lib/this.py:s", "a")
+    mocker.patch("raincoat.lock.current", lockfile)
+    get_branch_commit = mocker.patch("raincoat.source.get_branch_commit")
+    get_branch_commits = mocker.patch(
+        "raincoat.source.get_branch_commits",
+        return_value={("python/cpython", "3.6"): "fed9876"},
+    )
+    get_blob_shas = mocker.patch("raincoat.source.get_blob_shas")
+
+    assert list(pygithub.PyGithubChecker().check([match])) == []
+    # The branches are resolved all at once, the files are not compared.
+    assert get_branch_commits.mock_calls == [mocker.call({("python/cpython", "3.6")})]
+    assert get_branch_commit.mock_calls == []
+    assert get_blob_shas.mock_calls == []
+
+
 def test_match_source_key(pygithub_match):
     assert pygithub.PyGithubChecker().match_source_key(pygithub_match) == (
         "python/cpython",
@@ -54,6 +54,29 @@ def test_match_source_key(match):
     assert pypi.PyPIChecker().match_source_key(match) == ("umbrella", "3.2", False)
 
 
+def test_verdict_cache_key(mocker):
+    get_hash = mocker.patch(
+        "raincoat.source.get_installed_file_hash", side_effect=["abc", "def", None]
+    )
+    checker = pypi.PyPIChecker()
+    installed = pypi.PyPIKey("umbrella", "3.4", True)
+
+    assert (
+        checker.verdict_cache_key(pypi.PyPIKey("umbrella", "3.2", False), "a.py")
+        == "pypi umbrella==3.2"
+    )
+    assert checker.verdict_cache_key(installed, "a.py") == (
+        "pypi umbrella==3.4 installed abc"
+    )
+    # Edited
+    assert checker.verdict_cache_key(installed, "a.py") == (
+        "pypi umbrella==3.4 installed def"
+    )
+    # Missing
+    assert checker.verdict_cache_key(installed, "b.py") is None
+    assert get_hash.mock_calls[0] == mocker.call("umbrella", "a.py")
+
+
 def test_get_source_installed(mocker):
     path = mocker.Mock()
     path.read_text.return_value = ["yay"]
@@ -72,17 +95,15 @@ def test_get_source_installed(mocker):
 
 def test_get_source_downloaded(mocker):
     source = mocker.patch("raincoat.match.pypi.source")
-    source.open_downloaded.return_value = {"file_1.py": ["yay"]}
-    mocker.patch("raincoat.match.pypi.Cleaner.mkdir", return_value="/tmp/clean")
+    source.get_package_archive.return_value = "/tmp/cache/umbrella-3.4.whl"
+    source.open_archive.return_value = {"file_1.py": ["yay"]}
 
     result = pypi.PyPIChecker().get_source(
         key=pypi.PyPIKey("umbrella", "3.4", False), files=["file_1.py"]
     )
 
     assert result == {"file_1.py": ["yay"]}
-    assert source.download_package.mock_calls == [
-        mocker.call("umbrella", "3.4", "/tmp/clean")
-    ]
-    assert source.open_downloaded.mock_calls == [
-        mocker.call("/tmp/clean", ["file_1.py"])
+    assert source.get_package_archive.mock_calls == [mocker.call("umbrella", "3.4")]
+    assert source.open_archive.mock_calls == [
+        mocker.call("/tmp/cache/umbrella-3.4.whl", ["file_1.py"])
     ]
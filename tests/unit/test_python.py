@@ -4,8 +4,9 @@ from itertools import count
 
 import pytest
 
-from raincoat import constants
-from raincoat.match import python
+from raincoat import constants, lock
+from raincoat.exceptions import OfflineCacheMiss
+from raincoat.match import Unknown, python
 
 
 def test_group_composite():
@@ -16,6 +17,10 @@ def test_group_composite():
     assert result == {"a": {"b": ["c", "d"], "c": ["d"]}, "b": {"b": ["c"]}}
 
 
+def test_group_composite_empty():
+    assert python.group_composite([]) == {}
+
+
 class Checker(python.PythonChecker):
     def match_source_key(self, match):
         return "a"
@@ -111,6 +116,139 @@ def test_get_elements_file_not_found(mocker):
     assert dict(result) == {("a", "path1.py", "element1"): constants.FILE_NOT_FOUND}
 
 
+class CachingChecker(Checker):
+    def element_cache_key(self, key):
+        return key
+
+
+def test_get_elements_cache(mocker):
+    find_elements = mocker.patch(
+        "raincoat.match.python.parse.find_elements",
+        return_value=[("element1", ["a"]), ("element2", constants.ELEMENT_NOT_FOUND)],
+    )
+    source_keys = [("a", "path1.py", "element1"), ("a", "path1.py", "element2")]
+    first = dict(CachingChecker().get_elements(source_keys))
+
+    find_elements.reset_mock()
+    second = dict(CachingChecker().get_elements(source_keys))
+
+    assert first == second
+    assert second[("a", "path1.py", "element2")] is constants.ELEMENT_NOT_FOUND
+    assert find_elements.mock_calls == []
+
+
+def test_get_elements_memory(mocker):
+    mocker.patch(
+        "raincoat.match.python.parse.find_elements", return_value=[("element1", ["a"])]
+    )
+    source_keys = [("a", "path1.py", "element1")]
+    list(CachingChecker().get_elements(source_keys))
+
+    cache_get = mocker.patch("raincoat.match.python.Cache.get", return_value=None)
+    elements = dict(CachingChecker().get_elements(source_keys))
+
+    assert elements == {("a", "path1.py", "element1"): ["a"]}
+    assert cache_get.mock_calls == []
+
+
+def test_fetch(mocker, python_match, python_match2):
+    get_elements = mocker.patch.object(Checker, "get_elements", return_value=[])
+
+    Checker().fetch([python_match, python_match2])
+
+    assert sorted(get_elements.mock_calls) == [
+        mocker.call([("a", "path1.py", "element1"), ("a", "path2.py", "element2")]),
+        mocker.call([("b", "path1.py", "element1"), ("b", "path2.py", "element2")]),
+    ]
+
+
+def test_check_lock(mocker, python_match, python_match2):
+    lockfile = lock.Lock("raincoat.lock")
+    mocker.patch("raincoat.lock.current", lockfile)
+    mocker.patch("raincoat.match.python.parse.find_elements", side_effect=sources)
+
+    assert len(list(CachingChecker().check([python_match, python_match2]))) == 2
+    assert len(lockfile.content["elements"]) == 4
+
+    # Once the elements are the same on both sides, nothing is fetched.
+    for key in list(lockfile.content["elements"]):
+        lockfile.content["elements"][key] = "same"
+    get_elements = mocker.patch.object(CachingChecker, "get_elements")
+
+    assert list(CachingChecker().check([python_match, python_match2])) == []
+    assert get_elements.call_args == mocker.call([])
+
+
+def test_check_verdict_cache(mocker, python_match):
+    mocker.patch("raincoat.match.python.parse.find_elements", side_effect=sources)
+
+    first = CachingChecker().check([python_match])
+
+    get_elements = mocker.patch.object(CachingChecker, "get_elements")
+    second = CachingChecker().check([python_match])
+
+    assert first == second
+    assert second[0][0].startswith("Code is different")
+    assert get_elements.call_args == mocker.call([])
+
+
+def test_check_verdict_cache_pass(mocker, python_match):
+    mocker.patch.object(CachingChecker, "current_source_key", return_value="a")
+    mocker.patch("raincoat.match.python.parse.find_elements", side_effect=sources)
+
+    assert CachingChecker().check([python_match]) == []
+
+    get_elements = mocker.patch.object(CachingChecker, "get_elements")
+    assert CachingChecker().check([python_match]) == []
+    assert get_elements.call_args == mocker.call([])
+
+
+def test_check_verdict_cache_unknown(mocker, python_match):
+    mocker.patch.object(
+        CachingChecker, "get_source", side_effect=OfflineCacheMiss("nope")
+    )
+
+    CachingChecker().check([python_match])
+
+    get_elements = mocker.patch.object(CachingChecker, "get_elements", return_value=[])
+    CachingChecker().check([python_match])
+    assert get_elements.call_args != mocker.call([])
+
+
+def test_get_elements_offline_miss(mocker):
+    mocker.patch.object(Checker, "get_source", side_effect=OfflineCacheMiss("nope"))
+
+    result = Checker().get_elements(source_keys=[("a", "path1.py", "element1")])
+
+    assert dict(result) == {("a", "path1.py", "element1"): constants.UNKNOWN}
+
+
+def test_run_matches_unknown(python_match):
+    elements = {
+        ("a", "path1.py", "element1"): constants.UNKNOWN,
+        ("b", "path1.py", "element1"): ["b"],
+    }
+
+    ((message, match),) = Checker().run_matches([python_match], elements)
+
+    assert isinstance(message, Unknown)
+    assert match is python_match
+
+
+def test_run_matches_unknown_current_key(mocker, python_match):
+    mocker.patch.object(
+        Checker, "current_source_key", side_effect=OfflineCacheMiss("nope")
+    )
+
+    assert list(Checker().get_source_keys([python_match])) == [
+        ("a", "path1.py", "element1")
+    ]
+    ((message, match),) = Checker().run_matches([python_match], {})
+
+    assert message == "Could not be checked: nope"
+    assert isinstance(message, Unknown)
+
+
 def test_run_matches(python_match):
     all_kwargs = []
 
@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+import pytest
+
+from raincoat import settings
+
+
+def test_get_default(monkeypatch):
+    monkeypatch.delenv("RAINCOAT_OFFLINE", raising=False)
+
+    assert settings.get("offline") is False
+
+
+@pytest.mark.parametrize("value, expected", [("1", True), ("True", True), ("0", False)])
+def test_get_env(monkeypatch, value, expected):
+    monkeypatch.setenv("RAINCOAT_OFFLINE", value)
+
+    assert settings.get("offline") is expected
+
+
+def test_get_env_int(monkeypatch):
+    monkeypatch.setenv("RAINCOAT_GITHUB_MAX_WAIT", "10")
+
+    assert settings.get("github_max_wait") == 10
+
+
+def test_get_default_int(monkeypatch):
+    monkeypatch.delenv("RAINCOAT_MAX_CONNECTIONS_PER_HOST", raising=False)
+
+    assert settings.get("max_connections_per_host") == 4
+
+
+def test_override(monkeypatch):
+    monkeypatch.setenv("RAINCOAT_OFFLINE", "1")
+
+    with settings.override(offline=False):
+        assert settings.is_offline() is False
+        with settings.override(offline=None):
+            assert settings.is_offline() is False
+
+    assert settings.is_offline() is True
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from raincoat import exceptions, shard
+from raincoat.match.django import DjangoMatch
+from raincoat.match.pygithub import PyGithubMatch
+from raincoat.match.pypi import PyPIMatch
+
+
+@pytest.mark.parametrize(
+    "value, expected", [("1/1", (1, 1)), ("2/4", (2, 4)), ("4/4", (4, 4))]
+)
+def test_parse_shard(value, expected):
+    assert shard.parse_shard(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "1", "a/b", "0/4", "5/4", "1/2/3"])
+def test_parse_shard_error(value):
+    with pytest.raises(ValueError):
+        shard.parse_shard(value)
+
+
+def test_get_shard_index():
+    # Must not change from one run (or machine) to the next.
+    assert shard.get_shard_index("pypi django", 4) == 4
+    assert {shard.get_shard_index(str(i), 4) for i in range(100)} == {1, 2, 3, 4}
+
+
+def make_pypi(filename, package):
+    return PyPIMatch(filename, 1, package=package, path="a.py", element="b")
+
+
+def test_select_matches():
+    matches = [
+        make_pypi(f"{i}.py", f"{package}==1.{i}")
+        for i in range(3)
+        for package in ("Django", "requests", "attrs", "click")
+    ]
+    shards = [
+        list(shard.select_matches(matches, shard.Shard(index, 3)))
+        for index in (1, 2, 3)
+    ]
+
+    # Each match is in exactly one shard
+    assert sorted(id(match) for selected in shards for match in selected) == sorted(
+        id(match) for match in matches
+    )
+    # All matches of a package are in the same shard
+    for selected in shards:
+        packages = {match.get_shard_key() for match in selected}
+        assert all(
+            match.get_shard_key() not in packages
+            for other in shards
+            if other is not selected
+            for match in other
+        )
+
+
+def test_get_shard_key():
+    assert make_pypi("a.py", "Django==1.0").get_shard_key() == "pypi django"
+    assert (
+        PyGithubMatch("a.py", 1, repo="a/b@1234", path="c.py").get_shard_key()
+        == "pygithub a/b"
+    )
+    assert DjangoMatch("a.py", 1, ticket="#123").get_shard_key() == "django"
+
+
+def write(tmp_path, name, shard_value, results):
+    path = tmp_path / name
+    shard.write_report(str(path), shard_value, results)
+    return str(path)
+
+
+def test_write_read_report(tmp_path):
+    path = write(tmp_path, "a.json", shard.Shard(1, 2), [("Oh :(", False)])
+
+    assert shard.read_report(path) == (
+        [1, 2],
+        [{"output": "Oh :(", "unknown": False}],
+    )
+
+
+def test_read_report_error(tmp_path):
+    path = tmp_path / "a.json"
+    path.write_text(json.dumps({"results": []}))
+
+    with pytest.raises(exceptions.RaincoatException):
+        shard.read_report(str(path))
+
+
+def test_merge_reports(tmp_path):
+    paths = [
+        write(tmp_path, "2.json", shard.Shard(2, 2), [("b", False), ("c", True)]),
+        write(tmp_path, "1.json", shard.Shard(1, 2), [("a", False)]),
+    ]
+
+    assert shard.merge_reports(paths) == [("a", False), ("b", False), ("c", True)]
+
+
+def test_merge_reports_no_shard(tmp_path):
+    paths = [write(tmp_path, "a.json", None, [("a", False)])]
+
+    assert shard.merge_reports(paths) == [("a", False)]
+
+
+@pytest.mark.parametrize(
+    "shards, message",
+    [
+        ([(1, 2)], "missing: [2]"),
+        ([(1, 2), (1, 2), (2, 2)], "duplicate: [1]"),
+        ([(1, 2), (2, 3)], "same number of shards: 2, 3"),
+    ],
+)
+def test_merge_reports_inconsistent(tmp_path, shards, message):
+    paths = [
+        write(tmp_path, f"{i}.json", shard.Shard(*value), [])
+        for i, value in enumerate(shards)
+    ]
+
+    with pytest.raises(exceptions.RaincoatException) as exc_info:
+        shard.merge_reports(paths)
+
+    assert message in str(exc_info.value)
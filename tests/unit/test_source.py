@@ -1,11 +1,16 @@
 from __future__ import annotations
 
+import hashlib
 import os
 import pathlib
+import subprocess
+import sys
 
 import pytest
 
-from raincoat import source
+from raincoat import cache, lock, source
+from raincoat.exceptions import OfflineCacheMiss
+from raincoat.github_utils import HIGH
 
 
 def test_open_in_tarball():
@@ -41,11 +46,31 @@ def test_download_package(mocker):
 
     assert pip.mock_calls == [
         mocker.call(
-            ["pip", "download", "--no-deps", "-d", "/tmp/clean/", "fr2csv==1.0.1"]
+            ["pip", "download", "--no-deps", "-d", "/tmp/clean/", "fr2csv==1.0.1"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
         )
     ]
 
 
+def test_download_package_output(mocker, capfd):
+    run = subprocess.run
+    mocker.patch(
+        "subprocess.run",
+        side_effect=lambda args, **kwargs: run(
+            [sys.executable, "-c", "print('Collecting fr2csv'); exit(1)"], **kwargs
+        ),
+    )
+
+    with pytest.raises(ValueError) as exc_info:
+        source.download_package("fr2csv", "1.0.1", "/tmp/clean/")
+
+    # Nothing on our own streams, the output is in the error.
+    assert capfd.readouterr() == ("", "")
+    assert "Collecting fr2csv" in str(exc_info.value)
+
+
 def test_open_downloaded_wheel(mocker):
     mocker.patch("os.listdir", return_value=["a.whl"])
     tb = mocker.patch("raincoat.source.open_in_tarball")
@@ -69,29 +94,214 @@ def test_open_downloaded_tarball(mocker):
 
 
 def test_current_version(mocker):
-    # The path for this patch is very strange but in the raincoat.source module,
-    # importlib_metadata may be either the package importlib_metadata or
-    # importlib.metadata from the standard lib depending on the python version
-    mocker.patch("raincoat.source.importlib_metadata.version", return_value="1.2.3")
+    environment = mocker.patch("raincoat.source.get_environment").return_value
+    environment.get_version.return_value = "1.2.3"
     assert source.get_current_or_latest_version("pytest") == (True, "1.2.3")
 
 
-def test_latest_version(mocker):
-    get = mocker.patch("requests.get")
-    get.return_value.json.return_value = {"releases": {"1.0.0": None, "1.0.1": None}}
+@pytest.fixture
+def site_packages(tmp_path):
+    def make_dist(dirname, name, version, files=()):
+        dist_info = tmp_path / dirname
+        dist_info.mkdir()
+        (dist_info / "METADATA").write_text(
+            f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+        )
+        (dist_info / "RECORD").write_text("".join(f"{f},,\n" for f in files))
+
+    make_dist("Foo_Bar-1.0.dist-info", "Foo_Bar", "1.0", ["foo_bar/__init__.py"])
+    make_dist("baz-2.0.dist-info", "baz", "2.0")
+    (tmp_path / "foo_bar").mkdir()
+    (tmp_path / "foo_bar" / "__init__.py").write_text("yay")
+    return tmp_path
+
+
+def test_environment_get_version(site_packages):
+    environment = source.Environment(pathes=[str(site_packages)])
+
+    assert environment.get_version("foo-bar") == "1.0"
+    assert environment.get_version("Foo.Bar") == "1.0"
+    assert environment.get_version("baz") == "2.0"
+    assert environment.get_version("qux") is None
+
+
+def test_environment_first_path_wins(site_packages, tmp_path_factory):
+    other = tmp_path_factory.mktemp("other")
+    (other / "baz-3.0.dist-info").mkdir()
+    (other / "baz-3.0.dist-info" / "METADATA").write_text("Name: baz\nVersion: 3.0\n")
+
+    environment = source.Environment(
+        pathes=[str(site_packages), "/non/existent", str(other)]
+    )
+
+    assert environment.get_version("baz") == "2.0"
+
+
+def test_environment_get_files(site_packages):
+    environment = source.Environment(pathes=[str(site_packages)])
+
+    files = environment.get_files("foo_bar")
+    assert list(files) == ["foo_bar/__init__.py"]
+    assert files["foo_bar/__init__.py"].read_text() == "yay"
+    assert environment.get_files("baz") == {}
+    assert environment.get_files("qux") == {}
+
+
+def test_environment_memoized(site_packages, mocker):
+    environment = source.Environment(pathes=[str(site_packages)])
+    version = mocker.PropertyMock(return_value="1.0")
+    files = mocker.PropertyMock(return_value=[])
+    distribution = type("Distribution", (), {"version": version, "files": files})
+    environment.distributions["foo-bar"] = distribution()
+
+    environment.get_version("foo-bar")
+    environment.get_version("foo_bar")
+    environment.get_files("foo-bar")
+    environment.get_files("foo_bar")
+
+    assert version.call_count == 1
+    assert files.call_count == 1
+
+
+def test_get_environment():
+    assert source.get_environment() is source.get_environment()
+
+
+@pytest.fixture
+def pypi_get(mocker):
+    get = mocker.patch("requests.Session.get")
+    get.return_value.status_code = 200
+    get.return_value.headers = {"ETag": '"abc"'}
+    return get
+
+
+def test_latest_version(pypi_get):
+    pypi_get.return_value.json.return_value = {
+        "releases": {"1.0.0": None, "1.0.1": None}
+    }
     assert source.get_current_or_latest_version("fr2csv") == (False, "1.0.1")
 
 
-def test_latest_version_no_prerelease(mocker):
-    get = mocker.patch("requests.get")
-    get.return_value.json.return_value = {"releases": {"1.0.1": None, "1.0.2a1": None}}
+def test_latest_version_no_prerelease(pypi_get):
+    pypi_get.return_value.json.return_value = {
+        "releases": {"1.0.1": None, "1.0.2a1": None}
+    }
     assert source.get_current_or_latest_version("fr2csv") == (False, "1.0.1")
 
 
-def test_latest_version_invalid(mocker):
-    get = mocker.patch("requests.get")
-    get.return_value.json.return_value = {"releases": {"1.0.1": None, "1.0.2rc1": None}}
+def test_latest_version_invalid(pypi_get):
+    pypi_get.return_value.json.return_value = {
+        "releases": {"1.0.1": None, "1.0.2rc1": None, "yay": None}
+    }
+    assert source.get_current_or_latest_version("fr2csv") == (False, "1.0.1")
+
+
+def test_latest_version_cached(pypi_get, mocker):
+    pypi_get.return_value.json.return_value = {"releases": {"1.0.1": None}}
+
+    assert source.get_latest_version("fr2csv") == "1.0.1"
+    assert source.get_latest_version("fr2csv") == "1.0.1"
+
+    assert pypi_get.mock_calls == [
+        mocker.call(
+            "https://pypi.org/pypi/fr2csv/json", headers={"Cache-Control": "no-store"}
+        ),
+        mocker.call().raise_for_status(),
+        mocker.call().json(),
+    ]
+    assert source.Cache("pypi-latest-version").get("fr2csv") == {
+        "version": "1.0.1",
+        "etag": '"abc"',
+    }
+
+
+def test_latest_version_shared_session(mocker):
+    get_session = mocker.patch("raincoat.http_utils.get_session")
+    session = get_session.return_value.__enter__.return_value
+    session.get.return_value.status_code = 200
+    session.get.return_value.headers = {}
+    session.get.return_value.json.return_value = {"releases": {"1.0.1": None}}
+
+    assert source.get_latest_version("fr2csv") == "1.0.1"
+    assert session.get.call_args == mocker.call(
+        "https://pypi.org/pypi/fr2csv/json", headers={"Cache-Control": "no-store"}
+    )
+
+
+def test_latest_version_expired_not_modified(pypi_get, mocker):
+    cache = source.Cache("pypi-latest-version")
+    cache.set("fr2csv", {"version": "1.0.1", "etag": '"abc"'}, ttl=-1)
+    mocker.patch("raincoat.source.LATEST_VERSION_STALE_TTL", 0)
+    pypi_get.return_value.status_code = 304
+
+    assert source.get_latest_version("fr2csv") == "1.0.1"
+
+    assert pypi_get.call_args == mocker.call(
+        "https://pypi.org/pypi/fr2csv/json",
+        headers={"Cache-Control": "no-store", "If-None-Match": '"abc"'},
+    )
+    # The entry is fresh again
+    assert cache.get("fr2csv") == {"version": "1.0.1", "etag": '"abc"'}
+
+
+def test_latest_version_lock(mocker):
+    mocker.patch("raincoat.source.get_latest_version", return_value="1.0.1")
+    lockfile = lock.Lock("raincoat.lock", {"versions": {"umbrella": "1.0.0"}})
+    mocker.patch("raincoat.lock.current", lockfile)
+
+    assert source.get_current_or_latest_version("Umbrella") == (False, "1.0.0")
     assert source.get_current_or_latest_version("fr2csv") == (False, "1.0.1")
+    assert lockfile.get("versions", "fr2csv") == "1.0.1"
+
+
+def test_latest_version_offline(pypi_get, offline):
+    cache = source.Cache("pypi-latest-version")
+    cache.set("fr2csv", {"version": "1.0.1", "etag": '"abc"'}, ttl=-1)
+
+    assert source.get_latest_version("fr2csv") == "1.0.1"
+    assert pypi_get.mock_calls == []
+
+
+def test_latest_version_offline_miss(pypi_get, offline):
+    with pytest.raises(OfflineCacheMiss):
+        source.get_latest_version("fr2csv")
+
+    assert pypi_get.mock_calls == []
+
+
+def test_latest_version_expired_modified(pypi_get, mocker):
+    cache = source.Cache("pypi-latest-version")
+    cache.set("fr2csv", {"version": "1.0.1", "etag": '"abc"'}, ttl=-1)
+    mocker.patch("raincoat.source.LATEST_VERSION_STALE_TTL", 0)
+    pypi_get.return_value.headers = {"ETag": '"def"'}
+    pypi_get.return_value.json.return_value = {"releases": {"1.0.2": None}}
+
+    assert source.get_latest_version("fr2csv") == "1.0.2"
+    assert cache.get("fr2csv") == {"version": "1.0.2", "etag": '"def"'}
+
+
+def test_latest_version_stale_while_revalidate(pypi_get, mocker):
+    cache = source.Cache("pypi-latest-version")
+    cache.set("fr2csv", {"version": "1.0.1", "etag": '"abc"'}, ttl=-1)
+    thread = mocker.patch("threading.Thread")
+
+    assert source.get_latest_version("fr2csv") == "1.0.1"
+
+    assert pypi_get.mock_calls == []
+    assert thread.mock_calls[1] == mocker.call().start()
+    # Let's run the revalidation ourselves
+    pypi_get.return_value.status_code = 304
+    source.revalidate_latest_version(**thread.call_args.kwargs["kwargs"])
+
+    assert cache.get("fr2csv") == {"version": "1.0.1", "etag": '"abc"'}
+
+
+def test_revalidate_latest_version_error(pypi_get, caplog):
+    pypi_get.side_effect = ValueError
+
+    source.revalidate_latest_version("fr2csv", source.Cache("a"), entry=None)
+
+    assert "Could not revalidate the latest version of fr2csv" in caplog.text
 
 
 def test_get_distributed_files():
@@ -112,6 +322,55 @@ def test_open_installed():
     ]
 
 
+def test_get_installed_file_hash():
+    digest = source.get_installed_file_hash("pytest", "pytest/__init__.py")
+    path = source.get_distributed_files("pytest")["pytest/__init__.py"]
+
+    assert digest == hashlib.sha256(path.read_binary()).hexdigest()
+    assert source.get_installed_file_hash("pytest", "nope.py") is None
+    assert source.get_installed_file_hash("not-installed", "a.py") is None
+
+
+def test_get_package_archive(mocker, cache_dir):
+    def download(package, version, download_dir):
+        with open(os.path.join(download_dir, "fr2csv-1.0.1.tar.gz"), "w") as f:
+            f.write("yay")
+
+    download_package = mocker.patch(
+        "raincoat.source.download_package", side_effect=download
+    )
+
+    expected = str(cache_dir / "archives" / "fr2csv" / "1.0.1" / "fr2csv-1.0.1.tar.gz")
+    assert source.get_package_archive("fr2csv", "1.0.1") == expected
+    os.utime(os.path.dirname(expected), (1000, 1000))
+    assert source.get_package_archive("fr2csv", "1.0.1") == expected
+    assert len(download_package.mock_calls) == 1
+    # Used for the eviction of the least recently used archives
+    assert os.stat(os.path.dirname(expected)).st_mtime > 1000
+    assert cache.counters == {
+        ("archives", "hits"): 1,
+        ("archives", "misses"): 1,
+    }
+
+
+def test_get_package_archive_error(mocker, cache_dir):
+    mocker.patch("raincoat.source.download_package", side_effect=ValueError)
+
+    with pytest.raises(ValueError):
+        source.get_package_archive("fr2csv", "1.0.1")
+
+    assert os.listdir(cache_dir / "archives" / "fr2csv") == []
+
+
+def test_get_package_archive_offline(mocker, offline):
+    download_package = mocker.patch("raincoat.source.download_package")
+
+    with pytest.raises(OfflineCacheMiss):
+        source.get_package_archive("fr2csv", "1.0.1")
+
+    assert download_package.mock_calls == []
+
+
 def test_unrecognized_format(tmpdir):
     install_dir = tmpdir.mkdir("install_dir")
 
@@ -168,9 +427,105 @@ def test_get_branch_commit(mocker):
 
     assert source.get_branch_commit("a/b", "bla") == "123321"
     assert get.mock_calls[0] == mocker.call(
-        "https://api.github.com/repos/a/b/branches/bla"
+        "https://api.github.com/repos/a/b/branches/bla", priority=HIGH
+    )
+
+
+def test_get_branch_commits_cache(mocker):
+    get_session = mocker.patch("raincoat.github_utils.get_session")
+    get_session.return_value.__enter__.return_value.auth = None
+    fetch = mocker.patch("raincoat.source.fetch_branch_commit", return_value="123321")
+
+    assert source.get_branch_commits([("a/b", "bla")]) == {("a/b", "bla"): "123321"}
+    fetch.reset_mock()
+    assert source.get_branch_commits([("a/b", "bla")]) == {("a/b", "bla"): "123321"}
+    assert fetch.mock_calls == []
+
+
+def test_get_branch_commits_lock(mocker):
+    lockfile = lock.Lock("raincoat.lock", {"branches": {"a/b@bla": "123321"}})
+    mocker.patch("raincoat.lock.current", lockfile)
+    resolve = mocker.patch(
+        "raincoat.source.resolve_branch_commits",
+        return_value={("c/d", "bla"): "456654"},
     )
 
+    result = source.get_branch_commits([("a/b", "bla"), ("c/d", "bla")])
+
+    assert result == {("a/b", "bla"): "123321", ("c/d", "bla"): "456654"}
+    assert resolve.call_args.args[0] == [("c/d", "bla")]
+    assert lockfile.get("branches", "c/d@bla") == "456654"
+
+
+def test_get_branch_commits_graphql(mocker):
+    get_session = mocker.patch("raincoat.github_utils.get_session")
+    session = get_session.return_value.__enter__.return_value
+    session.auth = ("me", "token")
+    session.post.return_value.status_code = 200
+    session.post.return_value.json.return_value = {
+        "data": {"b0": {"ref": {"target": {"oid": "123321"}}}, "b1": {"ref": None}}
+    }
+    fetch = mocker.patch("raincoat.source.fetch_branch_commit", return_value="456654")
+
+    result = source.get_branch_commits([("a/b", "bla"), ("c/d", "bla")])
+
+    assert result == {("a/b", "bla"): "123321", ("c/d", "bla"): "456654"}
+    # Unresolved branches are fetched one by one, to get a proper error
+    assert fetch.mock_calls == [mocker.call("c/d", "bla", session)]
+    (query,) = session.post.call_args.kwargs["json"].values()
+    assert query.count("repository(") == 2
+
+
+def test_query_branch_commits_error(mocker):
+    session = mocker.Mock()
+    session.post.return_value.status_code = 502
+
+    assert source.query_branch_commits([("a/b", "bla")], session) == {}
+
+
+@pytest.fixture
+def graphql_session(mocker):
+    get_session = mocker.patch("raincoat.github_utils.get_session")
+    session = get_session.return_value.__enter__.return_value
+    session.auth = ("me", "token")
+    session.post.return_value.status_code = 200
+    return session
+
+
+def test_get_blob_shas(graphql_session, mocker):
+    graphql_session.post.return_value.json.return_value = {
+        "data": {"f0": {"object": {"oid": "111"}}, "f1": {"object": None}}
+    }
+    files = [("a/b", "123321", "a.py"), ("a/b", "123321", "c.py")]
+
+    assert source.get_blob_shas(files) == {("a/b", "123321", "a.py"): "111"}
+    (query,) = graphql_session.post.call_args.kwargs["json"].values()
+    assert 'object(expression: "123321:a.py")' in query
+    assert query.count("repository(") == 2
+
+    graphql_session.post.reset_mock()
+    assert source.get_blob_shas(files[:1]) == {("a/b", "123321", "a.py"): "111"}
+    assert graphql_session.post.mock_calls == []
+
+
+def test_get_blob_shas_no_token(graphql_session):
+    graphql_session.auth = None
+
+    assert source.get_blob_shas([("a/b", "123321", "a.py")]) == {}
+    assert graphql_session.post.mock_calls == []
+
+
+def test_get_blob_shas_offline(graphql_session, offline):
+    assert source.get_blob_shas([("a/b", "123321", "a.py")]) == {}
+    assert graphql_session.post.mock_calls == []
+
+
+def test_query_blob_shas_error(mocker):
+    session = mocker.Mock()
+    session.post.return_value.status_code = 502
+
+    assert source.query_blob_shas([("a/b", "123321", "a.py")], session) == {}
+
 
 def test_download_files_from_repo(mocker):
     get_session = mocker.patch("raincoat.github_utils.get_session")
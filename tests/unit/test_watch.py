@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import os
+import sys
+
+import pytest
+
+from raincoat import watch
+from raincoat.color import get_color
+from raincoat.match import match_from_comment
+
+COMMENT = "# Raincoat: pypi package: umbrella==3.2 path: umbrella/__init__.py {}\n"
+
+
+def header(element, location):
+    return f"umbrella == 3.2 @ umbrella/__init__.py:{element} (from {location})\n"
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath("sub").mkdir()
+    tmp_path.joinpath("a.py").write_text(COMMENT.format("element: Umbrella"))
+    return tmp_path
+
+
+@pytest.fixture
+def check_matches(mocker):
+    # Everything fails, except what's about "Good"
+    def check(matches_dict):
+        for matches in matches_dict.values():
+            for match in matches:
+                if match.element != "Good":
+                    yield f"{match.element} is bad", match
+
+    return mocker.patch("raincoat.watch.check_matches", side_effect=check)
+
+
+def test_take_snapshot(tree):
+    snapshot = watch.take_snapshot(["."], exclude=None)
+
+    assert list(snapshot) == ["a.py"]
+
+
+def test_poller(tree):
+    poller = watch.Poller(["."], interval=0)
+    tree.joinpath("sub", "b.py").write_text("")
+    os.remove("a.py")
+
+    assert poller.wait() == {"a.py", os.path.join("sub", "b.py")}
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linux only")
+def test_inotify(tree):
+    inotify = watch.Inotify(["."], exclude=["excluded"])
+    try:
+        tree.joinpath("sub", "b.py").write_text("")
+        tree.joinpath("sub", "b.txt").write_text("")
+        tree.joinpath("excluded").mkdir()
+        tree.joinpath("excluded", "c.py").write_text("")
+        tree.joinpath("new").mkdir()
+        tree.joinpath("new", "d.py").write_text("")
+
+        assert inotify.wait() == {
+            os.path.join("sub", "b.py"),
+            os.path.join("new", "d.py"),
+        }
+        assert sorted(inotify.watches.values()) == [".", "new", "sub"]
+    finally:
+        inotify.close()
+
+
+def test_get_watcher_fallback(mocker, tree):
+    mocker.patch("raincoat.watch.Inotify", side_effect=OSError("too many watches"))
+
+    assert isinstance(watch.get_watcher(["."]), watch.Poller)
+
+
+def test_get_signature():
+    def make(lineno, **kwargs):
+        return match_from_comment(
+            "pypi",
+            "a.py",
+            lineno,
+            package="umbrella==3.2",
+            path="path/to/file.py",
+            **kwargs,
+        )
+
+    match = make(1, element="MyClass")
+    moved = make(42, element="MyClass")
+    # Set while checking
+    moved.other_version = "3.3"
+
+    assert watch.get_signature(match) == watch.get_signature(moved)
+    assert watch.get_signature(match) != watch.get_signature(make(1, element="B"))
+
+
+def test_session(tree, check_matches):
+    session = watch.Session(color=get_color(False))
+
+    assert list(session.check_files(["a.py"], initial=True)) == [
+        header("Umbrella", "a.py:1") + "Umbrella is bad\n"
+    ]
+
+    # Moving the comment doesn't check it again, adding one checks only it.
+    tree.joinpath("a.py").write_text(
+        "\n" + COMMENT.format("element: Umbrella") + COMMENT.format("element: Good")
+    )
+    check_matches.reset_mock()
+
+    assert list(session.check_files(["a.py"])) == [header("Good", "a.py:3") + "OK\n"]
+    ((matches_dict,), __) = check_matches.call_args
+    assert [match.element for match in matches_dict["pypi"]] == ["Good"]
+
+
+def test_session_checker_changes_matches(tree, check_matches):
+    def check(matches_dict):
+        for matches in matches_dict.values():
+            for match in matches:
+                match.other_version = "3.3"
+                yield "Oh :(", match
+
+    check_matches.side_effect = check
+    session = watch.Session(color=get_color(False))
+    list(session.check_files(["a.py"], initial=True))
+    check_matches.reset_mock()
+
+    # The comment didn't change, it's not checked again
+    assert list(session.check_files(["a.py"])) == []
+    assert check_matches.mock_calls[0].args == ({},)
+
+
+def test_session_fixed(tree, check_matches):
+    session = watch.Session(color=get_color(False))
+    list(session.check_files(["a.py"], initial=True))
+
+    tree.joinpath("a.py").write_text(COMMENT.format("element: Good"))
+
+    assert list(session.check_files(["a.py"])) == [header("Good", "a.py:1") + "OK\n"]
+
+
+def test_session_deleted(tree, check_matches):
+    session = watch.Session(color=get_color(False))
+    list(session.check_files(["a.py"], initial=True))
+
+    os.remove("a.py")
+
+    assert list(session.check_files(["a.py"])) == []
+    assert session.verdicts == {}
+
+
+def test_watch(tree, check_matches, mocker):
+    watcher = mocker.Mock()
+    watcher.wait.side_effect = [{"sub/b.py"}, KeyboardInterrupt]
+    tree.joinpath("sub", "b.py").write_text(COMMENT.format("element: Bad"))
+
+    lines = watch.watch(["."], color=get_color(False), watcher=watcher)
+    assert next(lines) == header("Umbrella", "a.py:1") + "Umbrella is bad\n"
+    assert next(lines) == header("Bad", "sub/b.py:1") + "Bad is bad\n"
+    with pytest.raises(KeyboardInterrupt):
+        next(lines)
+
+    assert watcher.close.called